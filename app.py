@@ -27,6 +27,9 @@ _CustomPolicyChecksStack = CustomPolicyChecksStack(
     s3key=_CommonStack.critical_permissions_file_name,
     snstopic=_CommonStack.topic,
     snsfanoutlambdas=_CommonStack.sns_fan_out_lambdas,
+    commonlayer=_CommonStack.common_layer,
+    verdictcachetable=_CommonStack.verdict_cache_table,
+    digestqueue=_CommonStack.digest_queue,
 )
 _PolicyValidatorStack = PolicyValidatorStack(
     app,
@@ -36,12 +39,18 @@ _PolicyValidatorStack = PolicyValidatorStack(
     snsfanoutlambdas=_CommonStack.sns_fan_out_lambdas,
     softfailparam=_CommonStack.soft_fail_param,
     hardfailparam=_CommonStack.hard_fail_param,
+    commonlayer=_CommonStack.common_layer,
+    verdictcachetable=_CommonStack.verdict_cache_table,
+    digestqueue=_CommonStack.digest_queue,
 )
 _UnusedAccessStack = UnusedAccessStack(
     app,
     "UnusedAccessStack",
     stack_name="WorkshopUnusedAccessStack",
+    s3bucket=_CommonStack.bucket,
     snstopic=_CommonStack.topic,
+    commonlayer=_CommonStack.common_layer,
+    digestqueue=_CommonStack.digest_queue,
 )
 _PipelineStack = PipelineStack(
     app,
@@ -50,6 +59,9 @@ _PipelineStack = PipelineStack(
     snstopic=_CommonStack.topic,
     softfailparam=_CommonStack.soft_fail_param,
     hardfailparam=_CommonStack.hard_fail_param,
+    commonlayer=_CommonStack.common_layer,
+    s3bucket=_CommonStack.bucket,
+    s3key=_CommonStack.critical_permissions_file_name,
 )
 _PipelineNotificationStack = PipelineNotificationStack(
     app,
@@ -0,0 +1,338 @@
+#!/usr/bin/env python3
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+"""  Offline replay benchmark of the policy evaluation event path.
+    Recorded EventBridge payloads are replayed in-process through
+    parse_eventbridge, custom_policy_checks, policy_validator and
+    unused_access, with local stand-ins for IAM, S3, SNS, SQS and IAM Access
+    Analyzer. Fan-out messages are delivered to the checkers in batches, as
+    the SQS event sources do. Reports events per second, API calls per event
+    and p50/p99 latencies, no AWS account is needed.
+
+    python benchmarks/replay.py --events 10000 --latency-ms 5 --throttle-rate 0.01
+"""
+import argparse
+import ast
+import collections
+import contextlib
+import copy
+import importlib.util
+import io
+import json
+import logging
+import os
+import pathlib
+import sys
+import tempfile
+import time
+import unittest.mock
+
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+EVENTS = pathlib.Path(__file__).resolve().parent / "events"
+sys.path.insert(0, str(ROOT / "lambda" / "common" / "layer" / "python"))
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent))
+
+from policy_common import action_matcher  # noqa: E402
+from stubs import (  # noqa: E402
+    ApiRecorder,
+    StubAccessAnalyzer,
+    StubIAM,
+    StubS3,
+    StubSNS,
+    StubSQS,
+    client_factory,
+)
+
+BUCKET = "benchmark-bucket"
+KEY = "permissions.json"
+FAN_OUT_TOPIC = "arn:aws:sns:us-east-1:111122223333:SNSFanOutLambdas"
+NOTIFICATION_TOPIC = "arn:aws:sns:us-east-1:111122223333:IAMAccessAnalyzerFindingNotifications"
+ANALYZER = "arn:aws:access-analyzer:us-east-1:111122223333:analyzer/workshop-analyzer"
+DIGEST_QUEUE = "https://sqs.us-east-1.amazonaws.com/111122223333/DigestQueue"
+
+
+def privileged_actions():
+    """Reads the privileged actions list seeded by the custom resource"""
+    source = (ROOT / "lambda" / "common" / "custom_resource" / "lambda_function.py").read_text()
+    for node in ast.parse(source).body:
+        if isinstance(node, ast.Assign) and getattr(node.targets[0], "id", None) == "privileged_actions":
+            return ast.literal_eval(node.value)
+    raise ValueError("privileged_actions not found")
+
+
+def load_function(name, path, environment):
+    """Imports a Lambda function module with its environment variables"""
+    os.environ.update(environment)
+    spec = importlib.util.spec_from_file_location(
+        f"{name}_lambda_function", ROOT / path / "lambda_function.py"
+    )
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def function_environments(args, workdir):
+    """Returns {name: (path, environment)} of the functions on the event path"""
+    common = {
+        "AWS_DEFAULT_REGION": "us-east-1",
+        "API_TPS": str(args.api_tps),
+        "EVALUATION_MAX_WORKERS": str(args.workers),
+        "LOG_SAMPLE_RATE": str(args.log_sample_rate),
+    }
+    if args.verdict_cache:
+        common["VERDICT_CACHE_FILE"] = str(pathlib.Path(workdir) / "verdicts.json")
+    if args.digest:
+        common["DIGEST_QUEUE_URL"] = DIGEST_QUEUE
+    if args.trace:
+        common.update(TRACE_EXPORT="file", TRACE_FILE=args.trace)
+    return {
+        "parse_eventbridge": (
+            "lambda/common/parse_eventbridge",
+            dict(common, SNS_TOPIC_ARN=FAN_OUT_TOPIC, DEDUP_WINDOW_SECONDS=str(args.dedup_window)),
+        ),
+        "custom_policy_checks": (
+            "lambda/custom_policy_checks",
+            dict(common, SNS_TOPIC_ARN=NOTIFICATION_TOPIC, BUCKET=BUCKET, KEY=KEY),
+        ),
+        "policy_validator": (
+            "lambda/policy_validator",
+            dict(
+                common,
+                SNS_TOPIC_ARN=NOTIFICATION_TOPIC,
+                REGION="us-east-1",
+                ACCOUNT_ID="111122223333",
+                SOFT_FAIL="[]",
+                HARD_FAIL='["ERROR", "SECURITY_WARNING"]',  # HardFailParam default
+            ),
+        ),
+        "unused_access": (
+            "lambda/unused_access",
+            dict(common, SNS_TOPIC_ARN=NOTIFICATION_TOPIC, SWEEP_BUCKET=BUCKET),
+        ),
+        "digest": (
+            "lambda/common/digest",
+            dict(common, SNS_TOPIC_ARN=NOTIFICATION_TOPIC),
+        ),
+    }
+
+
+def load_functions(args, workdir):
+    return {
+        name: load_function(name, path, environment)
+        for name, (path, environment) in function_environments(args, workdir).items()
+    }
+
+
+def generate_events(recorded, count, distinct_targets):
+    """Replays the recorded events with unique event ids, spread over targets"""
+    for index in range(count):
+        event = copy.deepcopy(recorded[index % len(recorded)])
+        event["detail"]["eventID"] = f"{event['detail']['eventID']}-{index}"
+        event["detail"]["eventTime"] = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+        parameters = event["detail"]["requestParameters"]
+        for element in ("roleName", "userName", "groupName"):
+            if element in parameters:
+                parameters[element] = f"{parameters[element]}-{index % distinct_targets}"
+        yield event
+
+
+def percentile(values, rank):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[int(round(rank / 100 * (len(ordered) - 1)))]
+
+
+class Timings:
+    def __init__(self, emf=None):
+        self.latencies = collections.defaultdict(list)
+        self.errors = collections.Counter()
+        # file collecting the embedded metric documents printed by the functions
+        self.emf = emf
+
+    def invoke(self, name, handler, event):
+        # the functions share the metrics module of the layer in this process
+        metrics = sys.modules.get("policy_common.metrics")
+        if metrics:
+            metrics.setup(name.removesuffix("_sweep"))
+        started = time.perf_counter()
+        stdout = io.StringIO()
+        try:
+            with contextlib.redirect_stdout(stdout):
+                response = handler(event, None)
+        except Exception:
+            self.errors[name] += 1
+        else:
+            # SQS partial batch failures
+            if isinstance(response, dict):
+                self.errors[name] += len(response.get("batchItemFailures", []))
+        self.latencies[name].append(time.perf_counter() - started)
+        if self.emf:
+            self.emf.write(stdout.getvalue())
+
+
+def replay(args):
+    recorder = ApiRecorder(args.latency_ms, args.throttle_rate, args.seed)
+    stubs = {
+        "iam": StubIAM(recorder, json.loads((EVENTS / "managed_policies.json").read_text())),
+        "s3": StubS3(recorder),
+        "sns": StubSNS(recorder),
+        "sqs": StubSQS(recorder),
+        "accessanalyzer": StubAccessAnalyzer(recorder, args.sweep_findings),
+    }
+    # the list and its compiled index, as uploaded by the custom resource
+    uploaded = stubs["s3"].put_object(Bucket=BUCKET, Key=KEY, Body="\n".join(privileged_actions()))
+    stubs["s3"].put_object(
+        Bucket=BUCKET,
+        Key=action_matcher.index_key(KEY),
+        Body=action_matcher.ActionIndex(sorted(set(privileged_actions()))).to_json(uploaded["ETag"]),
+    )
+    if args.trace:
+        # spans are appended by the functions
+        open(args.trace, "w").close()
+    # clients created at import time or during invocations are all stand-ins
+    with tempfile.TemporaryDirectory() as workdir, unittest.mock.patch(
+        "boto3.client", client_factory(stubs)
+    ):
+        functions = load_functions(args, workdir)
+        logging.getLogger().setLevel(args.log_level)
+        recorder.calls.clear()
+        recorder.throttles.clear()
+        recorded = json.loads((EVENTS / "iam_policy_events.json").read_text())
+        unused = json.loads((EVENTS / "unused_access_events.json").read_text())
+        timings = Timings(open(args.emf, "w") if args.emf else None)
+        end_to_end = []
+        events = list(generate_events(recorded, args.events, args.distinct_targets))
+        started = time.perf_counter()
+        for offset in range(0, len(events), args.batch_size):
+            received = []
+            for event in events[offset:offset + args.batch_size]:
+                received.append(time.perf_counter())
+                timings.invoke("parse_eventbridge", functions["parse_eventbridge"].lambda_handler, event)
+            batch = {
+                "Records": [
+                    {"messageId": str(index), "body": message}
+                    for index, message in enumerate(stubs["sns"].drain(FAN_OUT_TOPIC))
+                ]
+            }
+            if batch["Records"]:
+                for name in ("custom_policy_checks", "policy_validator"):
+                    timings.invoke(name, functions[name].lambda_handler, batch)
+            done = time.perf_counter()
+            end_to_end.extend(done - received_at for received_at in received)
+        for index in range(args.unused_findings):
+            event = copy.deepcopy(unused[index % len(unused)])
+            event["detail"]["findingId"] = f"{event['detail']['findingId']}-{index}"
+            timings.invoke("unused_access", functions["unused_access"].lambda_handler, event)
+        # a first sweep of the analyzer, then a sweep after 1% of the findings changed
+        if args.sweep_findings:
+            sweep = {"mode": "sweep", "analyzerArn": ANALYZER}
+            timings.invoke("unused_access_sweep", functions["unused_access"].lambda_handler, sweep)
+            stubs["accessanalyzer"].touch(max(args.sweep_findings // 100, 1))
+            timings.invoke("unused_access_sweep", functions["unused_access"].lambda_handler, sweep)
+        # the digest window closes once at the end of the run
+        digest = {
+            "Records": [
+                {"messageId": str(index), "body": body}
+                for index, body in enumerate(stubs["sqs"].drain(DIGEST_QUEUE))
+            ]
+        }
+        if digest["Records"]:
+            timings.invoke("digest", functions["digest"].lambda_handler, digest)
+        elapsed = time.perf_counter() - started
+    if timings.emf:
+        timings.emf.close()
+    return report(args, recorder, timings, end_to_end, elapsed, stubs["sns"])
+
+
+def report(args, recorder, timings, end_to_end, elapsed, sns):
+    total_events = args.events + args.unused_findings
+    return {
+        "events": total_events,
+        "elapsed_seconds": round(elapsed, 3),
+        "events_per_second": round(total_events / elapsed, 1) if elapsed else 0.0,
+        "api_calls_per_event": round(sum(recorder.calls.values()) / max(total_events, 1), 3),
+        "api_calls": dict(sorted(recorder.calls.items())),
+        "throttles": dict(sorted(recorder.throttles.items())),
+        "notifications": len(sns.drain(NOTIFICATION_TOPIC)),
+        "errors": dict(timings.errors),
+        "latency_ms": {
+            name: {
+                "p50": round(percentile(values, 50) * 1000, 2),
+                "p99": round(percentile(values, 99) * 1000, 2),
+            }
+            for name, values in list(timings.latencies.items()) + [("end_to_end", end_to_end)]
+        },
+        "spans_ms": span_durations(args.trace) if args.trace else {},
+    }
+
+
+def span_durations(path):
+    """p50/p99 duration of the spans of the trace file, by span name"""
+    durations = collections.defaultdict(list)
+    with open(path, encoding="UTF-8") as stream:
+        for line in stream:
+            span = json.loads(line)
+            durations[span["name"]].append(
+                (int(span["endTimeUnixNano"]) - int(span["startTimeUnixNano"])) / 1e9
+            )
+    return {
+        name: {
+            "count": len(values),
+            "p50": round(percentile(values, 50) * 1000, 2),
+            "p99": round(percentile(values, 99) * 1000, 2),
+        }
+        for name, values in sorted(durations.items())
+    }
+
+
+def print_report(result):
+    print(f"events              {result['events']}")
+    print(f"elapsed             {result['elapsed_seconds']} s")
+    print(f"events/sec          {result['events_per_second']}")
+    print(f"API calls per event {result['api_calls_per_event']}")
+    print(f"notifications       {result['notifications']}")
+    for operation, count in result["api_calls"].items():
+        throttles = result["throttles"].get(operation, 0)
+        print(f"  {operation:<40} {count:>8} calls {throttles:>6} throttled")
+    for name, count in result["errors"].items():
+        print(f"  {name:<40} {count:>8} failed events")
+    print(f"{'latency (ms)':<24} {'p50':>10} {'p99':>10}")
+    for name, latency in result["latency_ms"].items():
+        print(f"  {name:<22} {latency['p50']:>10} {latency['p99']:>10}")
+    if result["spans_ms"]:
+        print(f"{'span (ms)':<40} {'count':>8} {'p50':>10} {'p99':>10}")
+        for name, span in result["spans_ms"].items():
+            print(f"  {name:<38} {span['count']:>8} {span['p50']:>10} {span['p99']:>10}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--events", type=int, default=1000, help="CloudTrail events to replay")
+    parser.add_argument("--unused-findings", type=int, default=100, help="unused access findings to replay")
+    parser.add_argument("--distinct-targets", type=int, default=100, help="principals the events are spread over")
+    parser.add_argument("--batch-size", type=int, default=10, help="fan-out messages per checker invocation")
+    parser.add_argument("--latency-ms", type=float, default=5.0, help="latency of every API call")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="probability of a throttled API call")
+    parser.add_argument("--api-tps", type=float, default=1000, help="API_TPS given to the functions")
+    parser.add_argument("--workers", type=int, default=8, help="EVALUATION_MAX_WORKERS given to the functions")
+    parser.add_argument("--dedup-window", type=int, default=0, help="DEDUP_WINDOW_SECONDS, 0 disables it")
+    parser.add_argument("--verdict-cache", action="store_true", help="enable the file verdict cache")
+    parser.add_argument("--sweep-findings", type=int, default=0, help="unused access findings swept twice")
+    parser.add_argument("--digest", action="store_true", help="queue the findings for the digest function")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--log-level", default="CRITICAL")
+    parser.add_argument("--log-sample-rate", type=float, default=1, help="LOG_SAMPLE_RATE given to the functions")
+    parser.add_argument("--trace", help="file collecting the spans of the traced events")
+    parser.add_argument("--emf", help="file collecting the embedded metric documents of the functions")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    args = parser.parse_args()
+    result = replay(args)
+    if args.json:
+        print(json.dumps(result, indent=2))
+    else:
+        print_report(result)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+"""  Cold start benchmark of the Lambda functions.
+    Every function module is imported in a fresh interpreter, as in the INIT
+    phase of a new container, and the import time is reported together with
+    the time of the first client creation (import of boto3 and client build,
+    now paid by the first invocation that calls the service) and the slowest
+    imports reported by `python -X importtime`.
+
+    python benchmarks/startup.py --repeat 5
+"""
+import argparse
+import json
+import pathlib
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+BENCHMARKS = pathlib.Path(__file__).resolve().parent
+
+# runs in the fresh interpreter, prints the timings as JSON
+CHILD = """
+import importlib.util, json, os, sys, time
+sys.path.insert(0, {layer!r})
+os.environ.update({environment!r})
+spec = importlib.util.spec_from_file_location("lambda_function", {source!r})
+print("### INIT", file=sys.stderr, flush=True)
+started = time.perf_counter()
+spec.loader.exec_module(importlib.util.module_from_spec(spec))
+init = time.perf_counter() - started
+from policy_common import clients
+started = time.perf_counter()
+try:
+    clients.client({service!r})
+    first_client = time.perf_counter() - started
+except Exception:
+    first_client = None
+print(json.dumps({{"init": init, "first_client": first_client}}))
+"""
+
+# first service called by each function
+SERVICES = {
+    "parse_eventbridge": "iam",
+    "custom_policy_checks": "s3",
+    "policy_validator": "accessanalyzer",
+    "unused_access": "accessanalyzer",
+    "digest": "sns",
+}
+
+
+def run_child(name, path, environment, importtime=False):
+    """Imports a function in a new interpreter, returns its timings and stderr"""
+    source = CHILD.format(
+        layer=str(ROOT / "lambda" / "common" / "layer" / "python"),
+        source=str(ROOT / path / "lambda_function.py"),
+        environment=environment,
+        service=SERVICES[name],
+    )
+    command = [sys.executable] + (["-X", "importtime"] if importtime else []) + ["-c", source]
+    result = subprocess.run(command, capture_output=True, text=True, check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1]), result.stderr
+
+
+def slowest_imports(stderr, count):
+    """Parses `-X importtime` output, returns the top-level imports of the
+    function module and of its first client by cumulative time
+    """
+    imports = []
+    lines = stderr.splitlines()
+    for line in lines[lines.index("### INIT") + 1:]:
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, package = line[len("import time:"):].split("|")
+        # top-level imports are not indented
+        if not package.startswith("  "):
+            imports.append((int(cumulative), package.strip()))
+    return [(package, round(cumulative / 1000, 2)) for cumulative, package in sorted(imports, reverse=True)[:count]]
+
+
+def startup(args):
+    sys.path.insert(0, str(BENCHMARKS))
+    import replay
+
+    settings = argparse.Namespace(
+        api_tps=10, workers=8, verdict_cache=False, digest=True, dedup_window=600, log_sample_rate=0.1,
+        trace=None,
+    )
+    results = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        for name, (path, environment) in replay.function_environments(settings, workdir).items():
+            runs = [run_child(name, path, environment)[0] for _ in range(args.repeat)]
+            _, stderr = run_child(name, path, environment, importtime=True)
+            first_clients = [run["first_client"] for run in runs if run["first_client"] is not None]
+            results[name] = {
+                "init_ms": round(statistics.median(run["init"] for run in runs) * 1000, 2),
+                "first_client_ms": (
+                    round(statistics.median(first_clients) * 1000, 2) if first_clients else None
+                ),
+                "slowest_imports_ms": slowest_imports(stderr, args.top),
+            }
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=5, help="fresh interpreters per function")
+    parser.add_argument("--top", type=int, default=5, help="slowest imports listed per function")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    args = parser.parse_args()
+    results = startup(args)
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{'function':<24} {'init (ms)':>10} {'first client (ms)':>18}")
+    for name, result in results.items():
+        first_client = result["first_client_ms"] if result["first_client_ms"] is not None else "n/a"
+        print(f"  {name:<22} {result['init_ms']:>10} {first_client:>18}")
+        for package, cumulative in result["slowest_imports_ms"]:
+            print(f"      {package:<30} {cumulative:>8}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,303 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+"""  Local stand-ins for the AWS APIs called by the Lambda functions.
+    Every call is counted per operation, delayed by a configurable latency and
+    throttled with a configurable probability, raising the same
+    `botocore.exceptions.ClientError` as the real clients.
+"""
+import collections
+import datetime
+import io
+import json
+import random
+import threading
+import time
+import uuid
+
+from botocore.exceptions import ClientError
+
+from policy_common import action_matcher
+
+
+class ApiRecorder:
+    """Shared call counters, latency and throttling of the stand-ins"""
+
+    def __init__(self, latency_ms=5.0, throttle_rate=0.0, seed=0):
+        self.latency = latency_ms / 1000
+        self.throttle_rate = throttle_rate
+        self.random = random.Random(seed)
+        self.calls = collections.Counter()
+        self.throttles = collections.Counter()
+        self.lock = threading.Lock()
+
+    def record(self, operation):
+        with self.lock:
+            self.calls[operation] += 1
+            throttled = self.random.random() < self.throttle_rate
+            if throttled:
+                self.throttles[operation] += 1
+        if self.latency:
+            time.sleep(self.latency)
+        if throttled:
+            raise ClientError(
+                {
+                    "Error": {"Code": "ThrottlingException", "Message": "Rate exceeded"},
+                    "ResponseMetadata": {"HTTPStatusCode": 400},
+                },
+                operation,
+            )
+
+
+class StubClient:
+    def __init__(self, recorder):
+        self.recorder = recorder
+
+
+class StubIAM(StubClient):
+    """Managed policies served from a dict {policy_arn: document}"""
+
+    def __init__(self, recorder, managed_policies):
+        super().__init__(recorder)
+        self.managed_policies = managed_policies
+
+    def get_policy(self, PolicyArn):
+        self.recorder.record("iam.GetPolicy")
+        policy_id = "ANPA" + uuid.uuid5(uuid.NAMESPACE_URL, PolicyArn).hex[:17].upper()
+        return {"Policy": {"Arn": PolicyArn, "PolicyId": policy_id, "DefaultVersionId": "v1"}}
+
+    def list_policy_versions(self, PolicyArn, **kwargs):
+        self.recorder.record("iam.ListPolicyVersions")
+        return {
+            "Versions": [
+                {"VersionId": "v1", "IsDefaultVersion": True, "CreateDate": "2024-01-01T00:00:00Z"}
+            ]
+        }
+
+    def get_policy_version(self, PolicyArn, VersionId):
+        self.recorder.record("iam.GetPolicyVersion")
+        return {
+            "PolicyVersion": {
+                "Document": self.managed_policies[PolicyArn],
+                "VersionId": VersionId,
+            }
+        }
+
+
+class StubS3(StubClient):
+    """Objects kept in memory, supports conditional GETs"""
+
+    def __init__(self, recorder):
+        super().__init__(recorder)
+        self.objects = {}
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        self.recorder.record("s3.PutObject")
+        if isinstance(Body, str):
+            Body = Body.encode("UTF-8")
+        self.objects[(Bucket, Key)] = (Body, f'"{uuid.uuid4().hex}"')
+        return {"ETag": self.objects[(Bucket, Key)][1]}
+
+    def upload_file(self, Filename, Bucket, Key, **kwargs):
+        with open(Filename, "rb") as fp:
+            self.put_object(Bucket=Bucket, Key=Key, Body=fp.read())
+
+    def get_object(self, Bucket, Key, IfNoneMatch=None, **kwargs):
+        self.recorder.record("s3.GetObject")
+        if (Bucket, Key) not in self.objects:
+            raise ClientError(
+                {"Error": {"Code": "NoSuchKey"}, "ResponseMetadata": {"HTTPStatusCode": 404}},
+                "GetObject",
+            )
+        body, etag = self.objects[(Bucket, Key)]
+        if IfNoneMatch == etag:
+            raise ClientError(
+                {"Error": {"Code": "304"}, "ResponseMetadata": {"HTTPStatusCode": 304}},
+                "GetObject",
+            )
+        return {"Body": io.BytesIO(body), "ETag": etag}
+
+    def list_objects_v2(self, Bucket, Prefix="", ContinuationToken=None, **kwargs):
+        self.recorder.record("s3.ListObjectsV2")
+        keys = sorted(key for bucket, key in self.objects if bucket == Bucket and key.startswith(Prefix))
+        start = int(ContinuationToken or 0)
+        page = {"Contents": [{"Key": key} for key in keys[start:start + 1000]], "IsTruncated": False}
+        if start + 1000 < len(keys):
+            page.update(IsTruncated=True, NextContinuationToken=str(start + 1000))
+        return page
+
+    def delete_objects(self, Bucket, Delete, **kwargs):
+        self.recorder.record("s3.DeleteObjects")
+        for s3object in Delete["Objects"]:
+            self.objects.pop((Bucket, s3object["Key"]), None)
+        return {}
+
+
+class StubSNS(StubClient):
+    """Published messages are kept per topic until drained"""
+
+    def __init__(self, recorder):
+        super().__init__(recorder)
+        self.messages = collections.defaultdict(list)
+        self.lock = threading.Lock()
+
+    def publish(self, TopicArn, Message, **kwargs):
+        self.recorder.record("sns.Publish")
+        with self.lock:
+            self.messages[TopicArn].append(Message)
+        return {"MessageId": uuid.uuid4().hex}
+
+    def publish_batch(self, TopicArn, PublishBatchRequestEntries):
+        self.recorder.record("sns.PublishBatch")
+        size = sum(
+            len(entry["Message"].encode("UTF-8")) + len(entry.get("Subject", "").encode("UTF-8"))
+            for entry in PublishBatchRequestEntries
+        )
+        if size > 256 * 1024:
+            raise ClientError(
+                {
+                    "Error": {"Code": "BatchRequestTooLong", "Message": "Batch requests cannot be longer than 262144 bytes"},
+                    "ResponseMetadata": {"HTTPStatusCode": 400},
+                },
+                "PublishBatch",
+            )
+        with self.lock:
+            self.messages[TopicArn].extend(entry["Message"] for entry in PublishBatchRequestEntries)
+        return {
+            "Successful": [{"Id": entry["Id"]} for entry in PublishBatchRequestEntries],
+            "Failed": [],
+        }
+
+    def drain(self, topic_arn):
+        with self.lock:
+            messages, self.messages[topic_arn] = self.messages[topic_arn], []
+        return messages
+
+
+class StubSQS(StubClient):
+    """Sent messages are kept per queue until drained"""
+
+    def __init__(self, recorder):
+        super().__init__(recorder)
+        self.messages = collections.defaultdict(list)
+        self.lock = threading.Lock()
+
+    def send_message_batch(self, QueueUrl, Entries):
+        self.recorder.record("sqs.SendMessageBatch")
+        with self.lock:
+            self.messages[QueueUrl].extend(entry["MessageBody"] for entry in Entries)
+        return {"Successful": [{"Id": entry["Id"]} for entry in Entries], "Failed": []}
+
+    def drain(self, queue_url):
+        with self.lock:
+            messages, self.messages[queue_url] = self.messages[queue_url], []
+        return messages
+
+
+class StubAccessAnalyzer(StubClient):
+    """Answers with the local action matcher, which is exact for policies
+    without conditions or Deny statements. Unused access findings are
+    generated, `touch` marks some of them as updated.
+    """
+
+    # findings per page of ListFindingsV2
+    findings_page_size = 100
+
+    def __init__(self, recorder, unused_findings=0):
+        super().__init__(recorder)
+        created = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+        self.findings = {
+            f"finding-{index}": {
+                "id": f"finding-{index}",
+                "resource": f"arn:aws:iam::111122223333:role/Role{index}",
+                "resourceType": "AWS::IAM::Role",
+                "resourceOwnerAccount": "111122223333",
+                "status": "ACTIVE",
+                "findingType": "UnusedPermission",
+                "createdAt": created,
+                "analyzedAt": created,
+                "updatedAt": created,
+            }
+            for index in range(unused_findings)
+        }
+
+    def touch(self, count):
+        now = datetime.datetime.now(datetime.timezone.utc)
+        for finding in list(self.findings.values())[:count]:
+            finding["updatedAt"] = now
+
+    def list_findings_v2(self, analyzerArn, filter=None, nextToken=None, **kwargs):
+        self.recorder.record("accessanalyzer.ListFindingsV2")
+        findings = list(self.findings.values())
+        start = int(nextToken or 0)
+        page = {"findings": [dict(finding) for finding in findings[start:start + self.findings_page_size]]}
+        if start + self.findings_page_size < len(findings):
+            page["nextToken"] = str(start + self.findings_page_size)
+        return page
+
+    def check_access_not_granted(self, policyDocument, policyType, access):
+        self.recorder.record("accessanalyzer.CheckAccessNotGranted")
+        granted = action_matcher.candidate_actions(json.loads(policyDocument), access[0]["actions"])
+        if granted:
+            return {"result": "FAIL", "reasons": [{"description": f"grants {granted}"}]}
+        return {"result": "PASS", "reasons": []}
+
+    # findings per page of ValidatePolicy
+    page_size = 2
+
+    def validate_policy(self, policyDocument, policyType, locale="EN", nextToken=None, **kwargs):
+        self.recorder.record("accessanalyzer.ValidatePolicy")
+        policy_document = json.loads(policyDocument)
+        findings = []
+        if "Version" not in policy_document:
+            findings.append(
+                {
+                    "findingType": "SUGGESTION",
+                    "issueCode": "MISSING_VERSION",
+                    "findingDetails": "We recommend that you specify the Version element",
+                    "locations": [],
+                }
+            )
+        for statement in action_matcher.statements(policy_document):
+            if action_matcher.statement_grants(statement, "iam:PassRole") and "*" in action_matcher.as_list(
+                statement.get("Resource")
+            ):
+                findings.append(
+                    {
+                        "findingType": "SECURITY_WARNING",
+                        "issueCode": "PASS_ROLE_WITH_STAR_IN_RESOURCE",
+                        "findingDetails": "Using the iam:PassRole action with wildcards (*) in the resource can be overly permissive",
+                        "locations": [],
+                    }
+                )
+        start = int(nextToken or 0)
+        page = {"findings": findings[start:start + self.page_size]}
+        if start + self.page_size < len(findings):
+            page["nextToken"] = str(start + self.page_size)
+        return page
+
+    def get_finding_v2(self, analyzerArn, id, **kwargs):
+        self.recorder.record("accessanalyzer.GetFindingV2")
+        now = datetime.datetime.now(datetime.timezone.utc)
+        return {
+            "id": id,
+            "status": "ACTIVE",
+            "createdAt": now,
+            "analyzedAt": now,
+            "updatedAt": now,
+            "resource": "arn:aws:iam::111122223333:role/SEC203",
+            "resourceType": "AWS::IAM::Role",
+            "resourceOwnerAccount": "111122223333",
+            "findingType": "UnusedPermission",
+            "findingDetails": [
+                {"unusedPermissionDetails": {"serviceNamespace": "ec2", "actions": []}}
+            ],
+        }
+
+
+def client_factory(stubs):
+    """Replacement for boto3.client returning the stand-in of a service"""
+
+    def client(service_name, *args, **kwargs):
+        return stubs[service_name]
+
+    return client
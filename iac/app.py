@@ -12,4 +12,6 @@ app = App()
 
 _Stack = WorkShopStack(app, "Stack")
 
-app.synth()
+# synth_template.py imports the app and synthesizes it in-process
+if __name__ == "__main__":
+    app.synth()
@@ -9,13 +9,10 @@ npm i
 python3 -m venv .venv
 . .venv/bin/activate
 .venv/bin/pip3 install -r requirements.txt --quiet
-sudo wget -qO /usr/bin/yq https://github.com/mikefarah/yq/releases/latest/download/yq_linux_amd64
-sudo chmod +x /usr/bin/yq
 git config --global user.email "participant@example.com"
 git config --global user.name "Participant SEC203"
 echo "------ cloudshell environment configured -------"
 python3 --version
-yq --version
 npx cdk --version
 echo ${VIRTUAL_ENV}
 echo "------------------------------------------------"
\ No newline at end of file
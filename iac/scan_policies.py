@@ -0,0 +1,346 @@
+#!/usr/bin/env python3
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+"""  Parallel scan of the IAM policies parsed by `cfn-policy-validator parse`.
+    Every policy of the template (role, user and group policies, trust
+    policies, managed policies attached to no principal, permission set
+    policies and resource policies) becomes a task. Identical documents are
+    checked once, and the tasks run on a pool of workers:
+    * ValidatePolicy for every document
+    * CheckAccessNotGranted against the privileged actions list for identity policies
+    * CheckNoNewAccess against a reference policy for identity policies
+    The findings are merged into one report and gated with the SOFT_FAIL and
+    HARD_FAIL environment variables, JSON or comma separated lists of finding
+    types or issue codes, set from the SoftFailParam and HardFailParam of the
+    stack like the policy validator function. HardFailParam defaults to
+    ERROR and SECURITY_WARNING, without thresholds no finding fails.
+    The exit code is 1 for HARD_FAIL, 0 otherwise.
+    With a manifest (a file or an S3 object) the scan is incremental: the
+    manifest of the last build that did not fail holds the findings of every
+    document hash, only new or modified documents are sent to Access
+    Analyzer and the others carry their findings forward. The manifest is
+    discarded when the privileged actions or the reference policy change.
+
+    python scan_policies.py --parsed iac_iam_parsed.json --actions-file privileged.txt
+    python scan_policies.py --manifest-bucket my-bucket --manifest-key manifests/iac_scan.json
+"""
+import argparse
+import concurrent.futures
+import hashlib
+import json
+import os
+import sys
+
+import boto3
+from botocore.config import Config
+from botocore.exceptions import ClientError
+
+# CheckAccessNotGranted accepts at most 100 actions per access entry
+ACTIONS_BATCH_SIZE = 100
+MANIFEST_VERSION = 1
+
+
+def policy_tasks(parsed):
+    """Yields (principal, policy name, policy type, resource type, document)
+    for every policy of the parsed template
+    """
+    for kind, name_key in (("Roles", "RoleName"), ("Users", "UserName"), ("Groups", "GroupName")):
+        for principal in parsed.get(kind, []):
+            principal_name = principal.get(name_key) or principal.get("Name")
+            for policy in principal.get("Policies", []):
+                yield (
+                    f"{kind[:-1]}/{principal_name}",
+                    policy.get("PolicyName") or policy.get("Name"),
+                    "IDENTITY_POLICY",
+                    None,
+                    policy["Policy"],
+                )
+            if principal.get("TrustPolicy"):
+                yield (
+                    f"{kind[:-1]}/{principal_name}",
+                    "TrustPolicy",
+                    "RESOURCE_POLICY",
+                    "AWS::IAM::AssumeRolePolicyDocument",
+                    principal["TrustPolicy"],
+                )
+    # managed policies of the template that no role, user or group attaches
+    for policy in parsed.get("OrphanedPolicies", []):
+        yield (
+            "OrphanedPolicy",
+            policy.get("PolicyName") or policy.get("Name"),
+            "IDENTITY_POLICY",
+            None,
+            policy["Policy"],
+        )
+    # IAM Identity Center permission sets hold identity policies too
+    for permission_set in parsed.get("PermissionSets", []):
+        permission_set_name = permission_set.get("Name")
+        for policy in permission_set.get("Policies", []):
+            yield (
+                f"PermissionSet/{permission_set_name}",
+                policy.get("PolicyName") or policy.get("Name"),
+                "IDENTITY_POLICY",
+                None,
+                policy["Policy"],
+            )
+        if permission_set.get("InlinePolicy"):
+            yield (
+                f"PermissionSet/{permission_set_name}",
+                "InlinePolicy",
+                "IDENTITY_POLICY",
+                None,
+                permission_set["InlinePolicy"],
+            )
+    for resource in parsed.get("Resources", []):
+        yield (
+            f"{resource.get('ResourceType')}/{resource.get('ResourceName')}",
+            "ResourcePolicy",
+            "RESOURCE_POLICY",
+            resource.get("ResourceType"),
+            resource["Policy"],
+        )
+
+
+def document_key(policy_type, resource_type, document):
+    """Identical documents of the same type are checked once"""
+    serialized = json.dumps(document, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(f"{policy_type}#{resource_type}#{serialized}".encode("UTF-8")).hexdigest()
+
+
+class Scanner:
+    def __init__(self, client, privileged_actions, reference_policy):
+        self.client = client
+        self.privileged_actions = privileged_actions
+        self.reference_policy = reference_policy
+
+    def validate(self, policy_type, resource_type, policy_json):
+        findings = []
+        kwargs = {"policyDocument": policy_json, "policyType": policy_type, "locale": "EN"}
+        if resource_type:
+            kwargs["validatePolicyResourceType"] = resource_type
+        while True:
+            try:
+                response = self.client.validate_policy(**kwargs)
+            except self.client.exceptions.ValidationException:
+                # resource types unknown to ValidatePolicy are validated generically
+                if "validatePolicyResourceType" not in kwargs:
+                    raise
+                del kwargs["validatePolicyResourceType"]
+                continue
+            findings.extend(
+                {
+                    "check": "ValidatePolicy",
+                    "findingType": finding["findingType"],
+                    "issueCode": finding["issueCode"],
+                    "details": finding["findingDetails"],
+                }
+                for finding in response["findings"]
+            )
+            if not response.get("nextToken"):
+                return findings
+            kwargs["nextToken"] = response["nextToken"]
+
+    def granted_actions(self, policy_json, actions):
+        """Privileged actions granted by the policy, failing batches are split
+        in half until the granted actions are isolated
+        """
+        response = self.client.check_access_not_granted(
+            policyDocument=policy_json,
+            policyType="IDENTITY_POLICY",
+            access=[{"actions": actions}],
+        )
+        if response["result"] != "FAIL":
+            return []
+        if len(actions) == 1:
+            return [(actions[0], [reason.get("description") for reason in response["reasons"]])]
+        middle = len(actions) // 2
+        return self.granted_actions(policy_json, actions[:middle]) + self.granted_actions(
+            policy_json, actions[middle:]
+        )
+
+    def check_access_not_granted(self, policy_json):
+        granted = []
+        for start in range(0, len(self.privileged_actions), ACTIONS_BATCH_SIZE):
+            granted += self.granted_actions(policy_json, self.privileged_actions[start:start + ACTIONS_BATCH_SIZE])
+        return [
+            {
+                "check": "CheckAccessNotGranted",
+                "findingType": "SECURITY_WARNING",
+                "issueCode": "PRIVILEGED_ACTION_GRANTED",
+                "details": f"{action} is granted: {reasons}",
+            }
+            for action, reasons in granted
+        ]
+
+    def check_no_new_access(self, policy_json):
+        response = self.client.check_no_new_access(
+            newPolicyDocument=policy_json,
+            existingPolicyDocument=self.reference_policy,
+            policyType="IDENTITY_POLICY",
+        )
+        if response["result"] != "FAIL":
+            return []
+        return [
+            {
+                "check": "CheckNoNewAccess",
+                "findingType": "SECURITY_WARNING",
+                "issueCode": "NEW_ACCESS",
+                "details": response.get("message") or [reason.get("description") for reason in response["reasons"]],
+            }
+        ]
+
+    def scan(self, policy_type, resource_type, document):
+        """Findings of all the checks that apply to a document"""
+        policy_json = json.dumps(document)
+        findings = self.validate(policy_type, resource_type, policy_json)
+        if policy_type == "IDENTITY_POLICY":
+            if self.privileged_actions:
+                findings += self.check_access_not_granted(policy_json)
+            if self.reference_policy:
+                findings += self.check_no_new_access(policy_json)
+        return findings
+
+
+def parse_thresholds(value):
+    """Returns the finding types or issue codes of a JSON list or of a comma
+    separated list such as "ERROR,SECURITY_WARNING"
+    """
+    value = (value or "").strip()
+    if value.startswith("["):
+        return set(json.loads(value))
+    return {item.strip() for item in value.split(",") if item.strip()}
+
+
+def classify(findings, soft_fail, hard_fail):
+    """Returns HARD_FAIL, SOFT_FAIL or PASS"""
+    for status, thresholds in (("HARD_FAIL", hard_fail), ("SOFT_FAIL", soft_fail)):
+        if any(finding["findingType"] in thresholds or finding["issueCode"] in thresholds for finding in findings):
+            return status
+    return "PASS"
+
+
+def inputs_version(privileged_actions, reference_policy):
+    """Version of the inputs the findings depend on besides the documents"""
+    inputs = json.dumps([MANIFEST_VERSION, privileged_actions, reference_policy])
+    return hashlib.sha256(inputs.encode("UTF-8")).hexdigest()
+
+
+def load_manifest(args, version):
+    """Returns {document key: findings} of the last build that did not fail"""
+    try:
+        if args.manifest_file:
+            if not os.path.exists(args.manifest_file):
+                return {}
+            with open(args.manifest_file, encoding="UTF-8") as stream:
+                manifest = json.load(stream)
+        elif args.manifest_bucket and args.manifest_key:
+            s3object = boto3.client("s3").get_object(Bucket=args.manifest_bucket, Key=args.manifest_key)
+            manifest = json.loads(s3object["Body"].read())
+        else:
+            return {}
+    except ClientError as _exp:
+        if _exp.response["Error"]["Code"] not in ("NoSuchKey", "404"):
+            raise
+        return {}
+    if manifest.get("inputs_version") != version:
+        print("### Manifest built with other privileged actions or reference policy, full scan")
+        return {}
+    return manifest["documents"]
+
+
+def save_manifest(args, version, documents):
+    body = json.dumps({"inputs_version": version, "documents": documents}, separators=(",", ":"))
+    if args.manifest_file:
+        with open(args.manifest_file, "w", encoding="UTF-8") as stream:
+            stream.write(body)
+    elif args.manifest_bucket and args.manifest_key:
+        boto3.client("s3").put_object(Bucket=args.manifest_bucket, Key=args.manifest_key, Body=body)
+
+
+def load_actions(args):
+    if args.actions_file:
+        with open(args.actions_file, encoding="UTF-8") as stream:
+            text = stream.read()
+    elif args.actions_bucket and args.actions_key:
+        text = boto3.client("s3").get_object(Bucket=args.actions_bucket, Key=args.actions_key)["Body"].read().decode("UTF-8")
+    else:
+        return []
+    return sorted({action.strip() for action in text.splitlines() if action.strip()})
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--parsed", default="iac_iam_parsed.json", help="output of cfn-policy-validator parse")
+    parser.add_argument("--actions-file", help="privileged actions, one per line")
+    parser.add_argument("--actions-bucket", default=os.environ.get("PRIVILEGED_BUCKET"))
+    parser.add_argument("--actions-key", default=os.environ.get("PRIVILEGED_KEY"))
+    parser.add_argument("--reference-policy", help="policy document for CheckNoNewAccess")
+    parser.add_argument("--manifest-file", help="local manifest of the findings by document hash")
+    parser.add_argument("--manifest-bucket", default=os.environ.get("MANIFEST_BUCKET"))
+    parser.add_argument("--manifest-key", default=os.environ.get("MANIFEST_KEY"))
+    parser.add_argument("--workers", type=int, default=16)
+    parser.add_argument("--report", default="iac_scan_report.json")
+    args = parser.parse_args()
+
+    with open(args.parsed, encoding="UTF-8") as stream:
+        parsed = json.load(stream)
+    reference_policy = None
+    if args.reference_policy:
+        with open(args.reference_policy, encoding="UTF-8") as stream:
+            reference_policy = json.dumps(json.load(stream))
+    client = boto3.client(
+        "accessanalyzer",
+        region_name=parsed.get("Region") or os.environ.get("AWS_REGION"),
+        config=Config(
+            retries={"mode": "adaptive", "max_attempts": 10},
+            max_pool_connections=args.workers,
+        ),
+    )
+    scanner = Scanner(client, load_actions(args), reference_policy)
+    version = inputs_version(scanner.privileged_actions, reference_policy)
+    manifest = load_manifest(args, version)
+
+    tasks = list(policy_tasks(parsed))
+    documents = {}
+    for _principal, _name, policy_type, resource_type, document in tasks:
+        documents.setdefault(document_key(policy_type, resource_type, document), (policy_type, resource_type, document))
+    changed = {key: document for key, document in documents.items() if key not in manifest}
+    print(
+        f"### {len(tasks)} policies, {len(documents)} distinct documents, "
+        f"{len(changed)} new or modified, {args.workers} workers"
+    )
+    with concurrent.futures.ThreadPoolExecutor(max_workers=args.workers) as pool:
+        futures = {key: pool.submit(scanner.scan, *document) for key, document in changed.items()}
+        # unchanged documents carry the findings of the last build forward
+        results = {key: manifest[key] for key in documents if key not in changed}
+        results.update({key: future.result() for key, future in futures.items()})
+
+    findings = [
+        dict(finding, principal=principal, policy=name)
+        for principal, name, policy_type, resource_type, document in tasks
+        for finding in results[document_key(policy_type, resource_type, document)]
+    ]
+    soft_fail = parse_thresholds(os.environ.get("SOFT_FAIL"))
+    hard_fail = parse_thresholds(os.environ.get("HARD_FAIL"))
+    status = classify(findings, soft_fail, hard_fail)
+    report = {
+        "status": status,
+        "policies": len(tasks),
+        "documents": len(documents),
+        "scanned": len(changed),
+        "findings": findings,
+    }
+    with open(args.report, "w", encoding="UTF-8") as stream:
+        json.dump(report, stream, indent=2, default=str)
+    for finding in findings:
+        print(f"{finding['findingType']:<18} {finding['issueCode']:<32} {finding['principal']} {finding['policy']}")
+    print(f"### {status}: {len(findings)} findings, report written to {args.report}")
+    if status == "HARD_FAIL":
+        return 1
+    # only the documents of the current template are kept
+    save_manifest(args, version, results)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -13,6 +13,7 @@ setuptools.setup(
     packages=setuptools.find_packages(where="."),
     install_requires=[
         "aws-cdk-lib==" + AWS_CDK_VERSION,
+        "PyYAML>=6.0",
     ],
     python_requires=">=3.7",
     classifiers=[
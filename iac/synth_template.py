@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+"""  Synthesizes the template of the workshop stack in-process, without the
+    CDK CLI and `yq`. The App of app.py is built with the context of cdk.json
+    and the metadata and version reporting turned off, like
+    `cdk synth --asset-metadata false --path-metadata false --version-reporting false`.
+    The references to the CDK bootstrap (the Rules and the BootstrapVersion
+    parameter) are removed from the template in memory, which is then
+    written once as YAML and, optionally, as JSON.
+
+    python synth_template.py --output iac.yaml --json iac.json
+"""
+import argparse
+import json
+import os
+import sys
+
+import yaml
+
+SYNTH_CONTEXT = {
+    "aws:cdk:enable-asset-metadata": False,
+    "aws:cdk:enable-path-metadata": False,
+    "aws:cdk:version-reporting": False,
+}
+
+
+def load_context():
+    """Context of cdk.json and cdk.context.json, as the CDK CLI passes it"""
+    context = {}
+    for path, key in (("cdk.json", "context"), ("cdk.context.json", None)):
+        if os.path.exists(path):
+            with open(path, encoding="UTF-8") as stream:
+                settings = json.load(stream)
+            context.update(settings.get(key, {}) if key else settings)
+    context.update(SYNTH_CONTEXT)
+    return context
+
+
+def synth(stack_name):
+    """Template of a stack of the app, as a dict"""
+    # the App reads its context from the environment when it is created
+    os.environ["CDK_CONTEXT_JSON"] = json.dumps(load_context())
+    import app  # pylint: disable=import-outside-toplevel
+
+    return app.app.synth().get_stack_by_name(stack_name).template
+
+
+def prune(template):
+    """Removes the references to the CDK bootstrap"""
+    template.pop("Rules", None)
+    parameters = template.get("Parameters", {})
+    parameters.pop("BootstrapVersion", None)
+    if not parameters:
+        template.pop("Parameters", None)
+    return template
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--stack", default="Stack")
+    parser.add_argument("--output", default="iac.yaml", help="YAML template")
+    parser.add_argument("--json", help="JSON template")
+    args = parser.parse_args()
+
+    template = prune(synth(args.stack))
+    with open(args.output, "w", encoding="UTF-8") as stream:
+        yaml.safe_dump(template, stream, sort_keys=False, width=1000)
+    if args.json:
+        with open(args.json, "w", encoding="UTF-8") as stream:
+            json.dump(template, stream, indent=1)
+    print(f"### {args.stack} template written to {' and '.join(filter(None, (args.output, args.json)))}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
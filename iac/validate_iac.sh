@@ -1,13 +1,33 @@
 #!/bin/bash
+# The synthesized template is cached in .synth_cache (SYNTH_CACHE_DIR),
+# keyed on every tracked file of the directory (CDK app sources, modules it
+# imports, cdk.json context) and on the installed Python packages: when none
+# of them changed the synthesis is skipped. SYNTH_CACHE=off disables it.
+SYNTH_CACHE_DIR=${SYNTH_CACHE_DIR:-.synth_cache}
 echo "--------- Generating IaC.yaml --------- "
+started=$(date +%s%N)
 . .venv/bin/activate
-npx cdk synth \
-      --asset-metadata false \
-      --path-metadata false \
-      --version-reporting false > iac.yaml
-# automatic removal of references to AWS CDK bootstrap using `yq`
-yq -i 'del(.Rules)' iac.yaml
-yq -i 'del(.Parameters.BootstrapVersion)' iac.yaml
+# installed versions of the CDK CLI and construct library, without running them
+versions=$(cat node_modules/aws-cdk/package.json 2>/dev/null | grep '"version"'; \
+    ls -d .venv/lib/python*/site-packages/aws_cdk_lib-*.dist-info 2>/dev/null)
+# outside of a git work tree the key falls back to the files of the CDK app
+sources=$(git ls-files -z -- . 2>/dev/null | xargs -0 -r sha256sum) || sources=""
+if [ -z "${sources}" ]; then
+    sources=$(sha256sum app.py stack_workshop.py synth_template.py setup.py requirements.txt cdk.json "$0")
+fi
+key=$( (echo "${sources}"; pip freeze 2>/dev/null; \
+    cat package.json package-lock.json cdk.context.json 2>/dev/null; \
+    echo "${versions}") | sha256sum | cut -c1-64)
+cached="${SYNTH_CACHE_DIR}/${key}.yaml"
+if [ "${SYNTH_CACHE}" != "off" ] && [ -s "${cached}" ] && [ -s "${cached%.yaml}.json" ]; then
+    cp "${cached}" iac.yaml && cp "${cached%.yaml}.json" iac.json
+    echo "### synth cache hit ${key} in $(( ($(date +%s%N) - started) / 1000000 )) ms"
+else
+    # in-process synth, the references to AWS CDK bootstrap are removed before writing
+    python synth_template.py --output iac.yaml --json iac.json || exit 1
+    mkdir -p "${SYNTH_CACHE_DIR}" && cp iac.yaml "${cached}" && cp iac.json "${cached%.yaml}.json"
+    echo "### synth cache miss ${key} in $(( ($(date +%s%N) - started) / 1000000 )) ms"
+fi
 echo "--------- IaC generated ---------"
 cat iac.yaml
 echo "---------------------------------"
\ No newline at end of file
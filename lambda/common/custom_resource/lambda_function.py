@@ -1,19 +1,23 @@
-import boto3
 import cfnresponse
-import logging
 import os
 import json
 import traceback
 import sys
 
-logger = logging.getLogger()
-logger.setLevel(logging.INFO)
+from policy_common import action_matcher, clients, logs, policy_versions
+
+logger = logs.setup()
 
 s3bucket = os.environ["S3BUCKET"]
 s3key = os.environ["S3KEY"]
+# AWS managed policies whose default version is cached at deployment time
+preseed_policy_arns = [
+    arn for arn in os.environ.get("PRESEED_POLICY_ARNS", "").split(",") if arn
+]
 
-client_s3 = boto3.client("s3")
-client_accessanalyzer = boto3.client("accessanalyzer")
+client_s3 = clients.lazy("s3")
+client_accessanalyzer = clients.lazy("accessanalyzer")
+client_iam = clients.lazy("iam")
 
 privileged_actions = [
     "cloudtrail:DeleteTrail",
@@ -93,18 +97,53 @@ privileged_actions = [
 ]
 
 
+def preseed_policy_versions():
+    """Caches the documents of commonly attached AWS managed policies"""
+    cache = policy_versions.from_environment()
+    for policy_arn in preseed_policy_arns:
+        try:
+            policy_versions.get_policy_document(
+                cache,
+                lambda operation, **kwargs: operation(**kwargs),
+                client_iam,
+                policy_arn,
+            )
+            logger.info("### Policy version cached for %s", policy_arn)
+        except Exception as _exp:
+            logger.warning("### Policy version not cached for %s: %s", policy_arn, _exp)
+
+
+def upload_privileged_actions():
+    """Uploads the privileged actions list and the index compiled from it,
+    the index records the ETag of the list it was compiled from
+    """
+    response = client_s3.put_object(
+        Bucket=s3bucket,
+        Key=s3key,
+        Body="\n".join(str(item) for item in privileged_actions),
+    )
+    index = action_matcher.ActionIndex(sorted(set(privileged_actions)))
+    client_s3.put_object(
+        Bucket=s3bucket,
+        Key=action_matcher.index_key(s3key),
+        Body=index.to_json(source_etag=response["ETag"]),
+        ContentType="application/json",
+    )
+    logger.info("### Action index of %s actions uploaded", len(index.actions))
+
+
 def lambda_handler(event, context):
-    logger.info(f"### RAW Event {json.dumps(event)}")
-    with open(r"/tmp/" + s3key, "w") as fp:
-        fp.write("\n".join(str(item) for item in privileged_actions))
-    client_s3.upload_file("/tmp/" + s3key, s3bucket, s3key)
+    logs.start_invocation()
+    logger.debug("### RAW Event %s", logs.full(event))
+    upload_privileged_actions()
+    preseed_policy_versions()
     try:
         result = client_accessanalyzer.create_analyzer(
             analyzerName="workshop-analyzer",
             configuration={"unusedAccess": {"unusedAccessAge": 1}},
             type="ACCOUNT_UNUSED_ACCESS",
         )
-        logger.info(f"### Result {json.dumps(result, indent=4)}")
+        logger.info("### Result %s", logs.payload(result))
     except Exception as _exp:
         exception_type, exception_value, exception_traceback = sys.exc_info()
         logger.error(
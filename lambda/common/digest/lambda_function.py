@@ -0,0 +1,180 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+"""  This Lambda function receives the findings queued by custom_policy_checks,
+    policy_validator and unused_access. The SQS event source collects them over
+    the digest window, the function groups them by principal and severity and
+    sends one summary to the notification topic instead of one email per
+    finding. Summaries larger than an SNS message are split into parts sent
+    with PublishBatch, in batches within the size limit of a PublishBatch call.
+    The messages listed in a part that could not be published are reported as
+    partial batch failures, so only they are retried in a later digest.
+"""
+import collections
+import json
+import os
+
+from policy_common import clients, logs
+
+logger = logs.setup()
+
+snstopic = os.environ["SNS_TOPIC_ARN"]
+digest_window_seconds = int(os.environ.get("DIGEST_WINDOW_SECONDS", 300))
+# findings listed per principal and severity, the rest are counted
+max_summaries = int(os.environ.get("DIGEST_MAX_SUMMARIES", 20))
+# reasons listed per summary, e.g. the privileged actions granted
+max_reasons = int(os.environ.get("DIGEST_MAX_REASONS", 5))
+
+# SNS messages are limited to 256 KB, PublishBatch to 10 entries and 256 KB
+# for all the entries of the call
+MAX_MESSAGE_BYTES = 200 * 1024
+MAX_BATCH_BYTES = 256 * 1024
+PUBLISH_BATCH_SIZE = 10
+SEVERITY_ORDER = ["HARD_FAIL", "CRITICAL", "SOFT_FAIL", "UNUSED_ACCESS"]
+
+client_sns = clients.lazy("sns")
+
+
+def severity_rank(severity):
+    if severity in SEVERITY_ORDER:
+        return SEVERITY_ORDER.index(severity)
+    return len(SEVERITY_ORDER)
+
+
+def summary_lines(summary, actor, reasons, times, count):
+    """Returns the line of a summary followed by the lines of its reasons"""
+    line = f"    {summary}"
+    if actor:
+        line += f" by {actor}"
+    if times:
+        line += f" at {max(times)}"
+    lines = [line + (f" (x{count})" if count > 1 else "")]
+    lines += [f"      - {reason}" for reason in reasons[:max_reasons]]
+    if len(reasons) > max_reasons:
+        lines.append(f"      ... and {len(reasons) - max_reasons} more reasons")
+    return lines
+
+
+def build_digest(findings):
+    """Returns the lines of the summary, grouped by principal and severity,
+    each with the indexes of the findings it lists
+    """
+    groups = collections.defaultdict(list)
+    for index, finding in enumerate(findings):
+        groups[(finding["principal"], finding["severity"])].append(index)
+    severities = collections.Counter(finding["severity"] for finding in findings)
+    lines = [
+        (
+            f"{len(findings)} findings for {len({principal for principal, _ in groups})} principals "
+            f"in the last {digest_window_seconds} seconds",
+            set(),
+        ),
+        (
+            ", ".join(
+                f"{severity}: {severities[severity]}"
+                for severity in sorted(severities, key=lambda severity: (severity_rank(severity), severity))
+            ),
+            set(),
+        ),
+        ("", set()),
+    ]
+    for principal, severity in sorted(groups, key=lambda group: (severity_rank(group[1]), group)):
+        grouped = groups[(principal, severity)]
+        sources = ", ".join(sorted({findings[index]["source"] for index in grouped}))
+        lines.append((f"[{severity}] {principal} - {len(grouped)} findings ({sources})", set(grouped)))
+        # identical summaries, e.g. the same policy attached twice by the
+        # same actor, are listed once with the time of the latest
+        summaries = collections.defaultdict(list)
+        for index in grouped:
+            finding = findings[index]
+            reasons = tuple(finding.get("reasons") or ())
+            summaries[(finding["summary"], finding.get("actor"), reasons)].append(index)
+        ranked = sorted(summaries.items(), key=lambda item: len(item[1]), reverse=True)
+        for (summary, actor, reasons), indexes in ranked[:max_summaries]:
+            times = [findings[index]["event_time"] for index in indexes if findings[index].get("event_time")]
+            for line in summary_lines(summary, actor, list(reasons), times, len(indexes)):
+                lines.append((line, set(indexes)))
+        if len(ranked) > max_summaries:
+            remaining = {index for _, indexes in ranked[max_summaries:] for index in indexes}
+            lines.append((f"    ... and {len(ranked) - max_summaries} more", remaining))
+    return lines
+
+
+def split_message(lines):
+    """Splits the summary into messages within the SNS size limit, returns
+    every message with the indexes of the findings it lists
+    """
+    parts = []
+    current = []
+    indexes = set()
+    size = 0
+    for line, line_indexes in lines:
+        line_size = len(line.encode("UTF-8")) + 1
+        if current and size + line_size > MAX_MESSAGE_BYTES:
+            parts.append(("\n".join(current), indexes))
+            current = []
+            indexes = set()
+            size = 0
+        current.append(line)
+        indexes |= line_indexes
+        size += line_size
+    if current:
+        parts.append(("\n".join(current), indexes))
+    return parts
+
+
+def publish_batches(entries):
+    """Groups the entries into PublishBatch calls within the count and size limits"""
+    batch = []
+    size = 0
+    for entry in entries:
+        entry_size = len(entry["Message"].encode("UTF-8")) + len(entry["Subject"].encode("UTF-8"))
+        if batch and (len(batch) == PUBLISH_BATCH_SIZE or size + entry_size > MAX_BATCH_BYTES):
+            yield batch
+            batch = []
+            size = 0
+        batch.append(entry)
+        size += entry_size
+    if batch:
+        yield batch
+
+
+def lambda_handler(event, context):
+    """Lambda Handler"""
+    logs.start_invocation()
+    records = event["Records"]
+    findings = [json.loads(record["body"]) for record in records]
+    logger.info("### %s findings received", len(findings))
+    if not findings:
+        return {"batchItemFailures": []}
+    parts = split_message(build_digest(findings))
+    subject = f"IAM policy findings digest: {len(findings)} findings"
+    if len(parts) == 1:
+        # nothing was published when the call fails, the whole batch is retried
+        response = client_sns.publish(TopicArn=snstopic, Message=parts[0][0], Subject=subject)
+        logger.info("Digest sent: %s", response)
+        return {"batchItemFailures": []}
+    entries = [
+        {
+            "Id": str(index),
+            "Message": part,
+            "Subject": f"{subject} ({index + 1}/{len(parts)})",
+        }
+        for index, (part, _) in enumerate(parts)
+    ]
+    failed_parts = []
+    for batch in publish_batches(entries):
+        try:
+            response = client_sns.publish_batch(TopicArn=snstopic, PublishBatchRequestEntries=batch)
+        except Exception:
+            logger.exception("### Digest parts not published")
+            failed_parts += [int(entry["Id"]) for entry in batch]
+            continue
+        if response.get("Failed"):
+            logger.error("### Digest parts not published: %s", response["Failed"])
+            failed_parts += [int(failure["Id"]) for failure in response["Failed"]]
+        logger.info("Digest parts sent: %s", response)
+    # the messages listed in a part that was not published are retried
+    failed = sorted({index for part in failed_parts for index in parts[part][1]})
+    if failed:
+        logger.warning("### %s of %s findings returned to the queue", len(failed), len(findings))
+    return {"batchItemFailures": [{"itemIdentifier": records[index]["messageId"]} for index in failed]}
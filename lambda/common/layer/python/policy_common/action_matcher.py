@@ -0,0 +1,229 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+"""  Local matching of IAM policy actions against a list of actions.
+    Expands the wildcards used in the `Action` and `NotAction` elements
+    (`iam:*`, `ec2:Create*`, `*`) to find which of the listed actions a policy
+    document could possibly grant. The match is conservative: conditions,
+    resources and `Deny` statements are ignored, so an action that is not
+    returned can never be granted by the policy, while an action that is
+    returned still needs to be confirmed by IAM Access Analyzer.
+    The listed actions are compiled into an ActionIndex: a trie of action
+    names per service prefix whose nodes hold the bitset of the actions below
+    them, so a pattern costs a walk of its own length instead of a scan of
+    the list. The index is built when the list is uploaded to S3 and stored
+    next to it as JSON (`index_key`).
+"""
+import functools
+import json
+import re
+
+# keys of the trie nodes that cannot be characters of an action name
+TERMINAL = "$"
+SUBTREE = "*"
+INDEX_VERSION = 1
+
+
+@functools.lru_cache(maxsize=4096)
+def compile_pattern(pattern):
+    """Compiles an IAM action pattern into a case insensitive regular expression"""
+    expression = re.escape(pattern).replace(r"\*", ".*").replace(r"\?", ".")
+    return re.compile(f"^{expression}$", re.IGNORECASE)
+
+
+def as_list(value):
+    """IAM policy elements can be either a single string or a list of strings"""
+    if value is None:
+        return []
+    if isinstance(value, str):
+        return [value]
+    return list(value)
+
+
+def statements(policy_document):
+    """Returns the statements of a policy document as a list, a single
+    statement can be given as an object
+    """
+    if not isinstance(policy_document, dict):
+        return []
+    statement_list = policy_document.get("Statement")
+    if isinstance(statement_list, dict):
+        statement_list = [statement_list]
+    return [statement for statement in as_list(statement_list) if isinstance(statement, dict)]
+
+
+def matches_any(patterns, action):
+    """True when the action matches at least one of the patterns"""
+    return any(compile_pattern(pattern).match(action) for pattern in patterns)
+
+
+def statement_grants(statement, action):
+    """True when an Allow statement could grant the action"""
+    if statement.get("Effect") == "Deny":
+        return False
+    if "Action" in statement:
+        return matches_any(as_list(statement["Action"]), action)
+    if "NotAction" in statement:
+        return not matches_any(as_list(statement["NotAction"]), action)
+    return False
+
+
+def index_key(key):
+    """S3 key of the index compiled from the actions list stored under key"""
+    return f"{key}.index.json"
+
+
+class ActionIndex:
+    """Actions list compiled into one trie per service prefix. Every node
+    maps the next lowercase character of the action name to its child, the
+    node ending an action holds its position under TERMINAL.
+    """
+
+    def __init__(self, actions, services=None):
+        self.actions = list(actions)
+        if services is None:
+            services = {}
+            for position, action in enumerate(self.actions):
+                service, _, name = action.lower().partition(":")
+                node = services.setdefault(service, {})
+                for char in name:
+                    node = node.setdefault(char, {})
+                node[TERMINAL] = position
+        self.services = services
+        self.all = (1 << len(self.actions)) - 1
+        # bitsets of the patterns already matched, patterns repeat across documents
+        self.matched = {}
+        for node in services.values():
+            self._subtree(node)
+
+    def _subtree(self, node):
+        """Stores in every node the bitset of the actions ending below it"""
+        mask = 1 << node[TERMINAL] if TERMINAL in node else 0
+        for char, child in node.items():
+            if char not in (TERMINAL, SUBTREE):
+                mask |= self._subtree(child)
+        node[SUBTREE] = mask
+        return mask
+
+    def to_json(self, source_etag=None):
+        """Serialized index, the subtree bitsets are rebuilt when loading"""
+
+        def strip(node):
+            return {
+                char: child if char == TERMINAL else strip(child)
+                for char, child in node.items()
+                if char != SUBTREE
+            }
+
+        return json.dumps(
+            {
+                "version": INDEX_VERSION,
+                "source_etag": source_etag,
+                "actions": self.actions,
+                "services": {service: strip(node) for service, node in self.services.items()},
+            },
+            separators=(",", ":"),
+        )
+
+    @classmethod
+    def from_json(cls, text):
+        index = json.loads(text)
+        if index.get("version") != INDEX_VERSION:
+            raise ValueError(f"Unsupported action index version {index.get('version')}")
+        return cls(index["actions"], index["services"]), index.get("source_etag")
+
+    def _walk(self, node, name, position, memo):
+        """Bitset of the actions below node whose name matches name[position:]"""
+        if position == len(name):
+            return 1 << node[TERMINAL] if TERMINAL in node else 0
+        if name[position:] == "*":
+            return node[SUBTREE]
+        key = (id(node), position)
+        if key in memo:
+            return memo[key]
+        char = name[position]
+        mask = 0
+        if char == "*":
+            # the wildcard matches nothing more, or one more character
+            mask = self._walk(node, name, position + 1, memo)
+            for child_char, child in node.items():
+                if child_char not in (TERMINAL, SUBTREE):
+                    mask |= self._walk(child, name, position, memo)
+        elif char == "?":
+            for child_char, child in node.items():
+                if child_char not in (TERMINAL, SUBTREE):
+                    mask |= self._walk(child, name, position + 1, memo)
+        elif char in node and char not in (TERMINAL, SUBTREE):
+            mask = self._walk(node[char], name, position + 1, memo)
+        memo[key] = mask
+        return mask
+
+    def match(self, pattern):
+        """Bitset of the listed actions matching an IAM action pattern"""
+        pattern = pattern.lower()
+        if pattern in self.matched:
+            return self.matched[pattern]
+        if pattern == "*":
+            mask = self.all
+        elif ":" not in pattern:
+            mask = sum(
+                1 << position
+                for position, action in enumerate(self.actions)
+                if compile_pattern(pattern).match(action)
+            )
+        else:
+            service_pattern, _, name = pattern.partition(":")
+            if "*" in service_pattern or "?" in service_pattern:
+                services = [
+                    service for service in self.services if compile_pattern(service_pattern).match(service)
+                ]
+            else:
+                services = [service_pattern] if service_pattern in self.services else []
+            mask = 0
+            for service in services:
+                mask |= self._walk(self.services[service], name, 0, {})
+        if len(self.matched) >= 4096:
+            self.matched.clear()
+        self.matched[pattern] = mask
+        return mask
+
+    def match_any(self, patterns):
+        mask = 0
+        for pattern in patterns:
+            mask |= self.match(pattern)
+        return mask
+
+    def statement_mask(self, statement):
+        """Bitset of the listed actions an Allow statement could grant"""
+        if statement.get("Effect") == "Deny":
+            return 0
+        if "Action" in statement:
+            return self.match_any(as_list(statement["Action"]))
+        if "NotAction" in statement:
+            return self.all & ~self.match_any(as_list(statement["NotAction"]))
+        return 0
+
+    def candidates(self, policy_document):
+        """Listed actions, in their original order, the policy could grant"""
+        mask = 0
+        for statement in statements(policy_document):
+            mask |= self.statement_mask(statement)
+            if mask == self.all:
+                break
+        # bits from the lowest, shifting the bitset for every action is quadratic
+        return [self.actions[position] for position, bit in enumerate(bin(mask)[:1:-1]) if bit == "1"]
+
+
+@functools.lru_cache(maxsize=16)
+def compile_actions(actions):
+    """ActionIndex of a tuple of actions"""
+    return ActionIndex(actions)
+
+
+def candidate_actions(policy_document, actions):
+    """Returns the actions, in their original order, that the policy document
+    could grant. An empty list means the policy cannot grant any of them.
+    `actions` is a list of actions or an ActionIndex.
+    """
+    if not isinstance(actions, ActionIndex):
+        actions = compile_actions(tuple(actions))
+    return actions.candidates(policy_document)
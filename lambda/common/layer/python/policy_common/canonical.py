@@ -0,0 +1,145 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+"""  Canonical form of IAM policy documents.
+    Two documents granting the same permissions with a different layout
+    (`Action` as a string or a list, statement order, whitespace, duplicated
+    actions, resources or statements) have the same canonical form, and
+    therefore the same bytes and the same hash.
+    The canonical form is only used for hashes and cache keys: the checkers
+    evaluate and display the document as submitted. Elements of an unexpected
+    shape, e.g. in a malformed document of a failed API call, are kept as
+    they are.
+"""
+import hashlib
+import json
+
+# elements holding actions, their service prefix is case insensitive
+ACTION_ELEMENTS = ("Action", "NotAction")
+# elements holding ARNs or principals, their values are case sensitive
+VALUE_ELEMENTS = ("Resource", "NotResource")
+
+
+def serialize(value):
+    """Stable compact JSON serialization"""
+    return json.dumps(value, sort_keys=True, separators=(",", ":"))
+
+
+def as_sorted_list(value):
+    """Sorted list of unique values for an element holding a value or a list"""
+    if not isinstance(value, list):
+        value = [value]
+    unique = {serialize(item): item for item in value}
+    return [unique[key] for key in sorted(unique)]
+
+
+def is_string_list(value):
+    return isinstance(value, list) and all(isinstance(item, str) for item in value)
+
+
+def normalize_action(action):
+    """Lower-cases the service prefix, action names are kept as written"""
+    if not isinstance(action, str):
+        return action
+    service, separator, name = action.partition(":")
+    return service.lower() + separator + name
+
+
+def normalize_principal(principal):
+    if isinstance(principal, dict):
+        return {key: as_sorted_list(value) for key, value in principal.items()}
+    return principal
+
+
+def normalize_condition(condition):
+    return {
+        operator: {key: as_sorted_list(value) for key, value in keys.items()} if isinstance(keys, dict) else keys
+        for operator, keys in condition.items()
+    }
+
+
+def normalize_statement(statement):
+    """Canonical form of a single statement"""
+    normalized = {}
+    for element, value in statement.items():
+        if element in ACTION_ELEMENTS:
+            actions = as_sorted_list(value)
+            normalized[element] = sorted({normalize_action(action) for action in actions}) if is_string_list(
+                actions
+            ) else value
+        elif element in VALUE_ELEMENTS:
+            normalized[element] = as_sorted_list(value)
+        elif element in ("Principal", "NotPrincipal"):
+            normalized[element] = normalize_principal(value)
+        elif element == "Condition" and isinstance(value, dict):
+            normalized[element] = normalize_condition(value)
+        else:
+            normalized[element] = value
+    return normalized
+
+
+def mergeable(statement):
+    """Statements can only be merged when their Sid and actions are strings"""
+    return isinstance(statement.get("Sid", ""), str) and is_string_list(statement.get("Action", []))
+
+
+def merge_statement(kept, statement):
+    """Merges a statement into another one with the same elements apart from
+    `Sid` and `Action`: the actions are joined and the lowest `Sid` is kept.
+    """
+    if "Action" in statement:
+        kept["Action"] = sorted(set(kept["Action"]) | set(statement["Action"]))
+    sid = min(kept.get("Sid", ""), statement.get("Sid", ""))
+    kept.pop("Sid", None)
+    if sid:
+        kept["Sid"] = sid
+
+
+def canonicalize(policy_document):
+    """Returns the canonical form of a policy document.
+    Statements are normalized, merged when they only differ by their `Sid`
+    or `Action` elements, and sorted.
+    """
+    if not isinstance(policy_document, dict) or "Statement" not in policy_document:
+        return policy_document
+    statements = policy_document["Statement"]
+    if isinstance(statements, dict):
+        statements = [statements]
+    if not isinstance(statements, list):
+        return policy_document
+    merged = {}
+    for statement in statements:
+        if not isinstance(statement, dict):
+            merged.setdefault(serialize(statement), statement)
+            continue
+        normalized = normalize_statement(statement)
+        if not mergeable(normalized):
+            merged.setdefault(serialize(normalized), normalized)
+            continue
+        group = serialize(
+            [
+                "Action" in normalized,
+                {key: value for key, value in normalized.items() if key not in ("Sid", "Action")},
+            ]
+        )
+        if group in merged:
+            merge_statement(merged[group], normalized)
+        else:
+            merged[group] = normalized
+    canonical = {key: value for key, value in policy_document.items() if key != "Statement"}
+    canonical["Statement"] = sorted(merged.values(), key=serialize)
+    return canonical
+
+
+def canonical_bytes(policy_document):
+    """Stable bytes of the canonical form of a policy document"""
+    return serialize(canonicalize(policy_document)).encode("UTF-8")
+
+
+def document_hash(policy_document):
+    """SHA-256 of the canonical bytes of a policy document"""
+    return hashlib.sha256(canonical_bytes(policy_document)).hexdigest()
+
+
+def submitted_hash(policy_document):
+    """SHA-256 of a policy document as submitted, only the JSON layout is ignored"""
+    return hashlib.sha256(serialize(policy_document).encode("UTF-8")).hexdigest()
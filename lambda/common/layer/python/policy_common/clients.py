@@ -0,0 +1,58 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+"""  AWS clients shared by the Lambda functions.
+    A client is created once per service and container, with adaptive retries,
+    a connection pool sized for the concurrent evaluation workers and TCP
+    keep-alive, so warm invocations reuse the open TLS connections.
+    Module level clients are lazy, importing boto3 is left out of the INIT phase
+    of the functions.
+"""
+import os
+import threading
+
+# client creation on the default boto3 session is not thread safe
+lock = threading.Lock()
+created = {}
+
+
+def client_config():
+    """botocore configuration of the shared clients"""
+    from botocore.config import Config
+
+    max_workers = int(os.environ.get("EVALUATION_MAX_WORKERS", "8"))
+    return Config(
+        # throttling is also retried by the evaluation executor, keep few attempts here
+        retries={"mode": "adaptive", "max_attempts": int(os.environ.get("CLIENT_MAX_ATTEMPTS", "3"))},
+        max_pool_connections=max(10, 2 * max_workers),
+        tcp_keepalive=True,
+        connect_timeout=int(os.environ.get("CLIENT_CONNECT_TIMEOUT", "5")),
+        read_timeout=int(os.environ.get("CLIENT_READ_TIMEOUT", "30")),
+    )
+
+
+def client(service_name):
+    """Returns the client of a service, created on first use"""
+    if service_name not in created:
+        with lock:
+            if service_name not in created:
+                import boto3
+
+                created[service_name] = boto3.client(service_name, config=client_config())
+    return created[service_name]
+
+
+class LazyClient:
+    """Stands for the client of a service until its first use, so boto3 is
+    only imported and the client only built by the invocations that call it
+    """
+
+    def __init__(self, service_name):
+        self.service_name = service_name
+
+    def __getattr__(self, name):
+        return getattr(client(self.service_name), name)
+
+
+def lazy(service_name):
+    """Returns the client of a service, created on first attribute access"""
+    return LazyClient(service_name)
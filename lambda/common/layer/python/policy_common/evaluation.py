@@ -0,0 +1,130 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+"""  Concurrent, rate limited execution of AWS API calls.
+    Calls run on a bounded thread pool and go through a token bucket sized to
+    the API quota. The rate follows an AIMD policy: it grows by a fixed step
+    after every successful call and is cut by a factor whenever the API
+    answers with a throttling error, the throttled call is then retried with
+    exponential backoff and jitter.
+"""
+import concurrent.futures
+import contextvars
+import logging
+import os
+import random
+import threading
+import time
+
+from policy_common import metrics, tracing
+
+logger = logging.getLogger(__name__)
+
+THROTTLING_ERROR_CODES = (
+    "Throttling",
+    "ThrottlingException",
+    "ThrottledException",
+    "TooManyRequestsException",
+    "RequestLimitExceeded",
+)
+
+
+def is_throttling(exception):
+    """True when a botocore ClientError reports a throttling error"""
+    response = getattr(exception, "response", None) or {}
+    return response.get("Error", {}).get("Code") in THROTTLING_ERROR_CODES
+
+
+class AdaptiveRateLimiter:
+    """Token bucket whose refill rate is adjusted with AIMD"""
+
+    def __init__(self, rate, min_rate=0.5, increase=0.2, decrease=0.5):
+        self.max_rate = rate
+        self.rate = rate
+        self.min_rate = min(min_rate, rate)
+        self.increase = increase
+        self.decrease = decrease
+        self.tokens = max(1.0, rate)
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Blocks until a token is available"""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(
+                    max(1.0, self.rate), self.tokens + (now - self.updated_at) * self.rate
+                )
+                self.updated_at = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def on_success(self):
+        """Additive increase, up to the configured quota"""
+        with self.lock:
+            self.rate = min(self.max_rate, self.rate + self.increase)
+
+    def on_throttle(self):
+        """Multiplicative decrease, the bucket is emptied"""
+        with self.lock:
+            self.rate = max(self.min_rate, self.rate * self.decrease)
+            self.tokens = 0.0
+        logger.warning(f"### Throttled, rate lowered to {self.rate:.2f} calls per second")
+
+
+class EvaluationExecutor:
+    """Bounded thread pool running rate limited API calls"""
+
+    def __init__(self, max_workers, limiter, max_attempts=6, base_delay=0.1):
+        self.pool = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers)
+        self.limiter = limiter
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+
+    def call(self, operation, **kwargs):
+        """Calls a boto3 client operation, retrying throttled calls"""
+        operation_name = getattr(operation, "__name__", "unknown")
+        with tracing.span(f"api.{operation_name}") as span:
+            return self._call(operation, operation_name, span, **kwargs)
+
+    def _call(self, operation, operation_name, span, **kwargs):
+        for attempt in range(1, self.max_attempts + 1):
+            if span:
+                span.attributes["attempts"] = attempt
+            self.limiter.acquire()
+            started = time.perf_counter()
+            try:
+                response = operation(**kwargs)
+            except Exception as _exp:
+                metrics.api_call(operation_name, time.perf_counter() - started)
+                if not is_throttling(_exp):
+                    metrics.count("ApiErrors", Operation=operation_name)
+                    raise
+                metrics.count("Throttles", Operation=operation_name)
+                if attempt == self.max_attempts:
+                    raise
+                self.limiter.on_throttle()
+                time.sleep(random.uniform(0, self.base_delay * 2 ** attempt))
+            else:
+                metrics.api_call(operation_name, time.perf_counter() - started)
+                self.limiter.on_success()
+                return response
+
+    def map(self, function, items):
+        """Applies the function to every item concurrently, results keep the
+        order of the items. The function must not submit work to this executor.
+        The items run in copies of the caller context, e.g. its current span.
+        """
+        context = contextvars.copy_context()
+        return list(self.pool.map(lambda item: context.copy().run(function, item), items))
+
+
+def from_environment():
+    """Builds an executor configured by API_TPS and EVALUATION_MAX_WORKERS"""
+    return EvaluationExecutor(
+        max_workers=int(os.environ.get("EVALUATION_MAX_WORKERS", "8")),
+        limiter=AdaptiveRateLimiter(float(os.environ.get("API_TPS", "10"))),
+    )
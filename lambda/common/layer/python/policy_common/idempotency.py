@@ -0,0 +1,99 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+"""  Idempotency keys for the events processed by parse_eventbridge.
+    A key is claimed the first time it is seen and any claim of the same key
+    within the deduplication window fails, so duplicated deliveries and
+    repeated identical changes are only processed once per window.
+    A key claimed with a value, e.g. the hash of the document applied to a
+    policy, is only held against claims of the same value: claiming another
+    value replaces it.
+"""
+import logging
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class DynamoDBIdempotencyStore:
+    """Keys stored in a DynamoDB table with `dedup_key` as partition key and
+    `expires_at` as TTL attribute.
+    """
+
+    def __init__(self, table_name, window_seconds, client=None):
+        if client is None:
+            from policy_common import clients
+
+            client = clients.lazy("dynamodb")
+        self.table_name = table_name
+        self.window_seconds = window_seconds
+        self.client = client
+
+    def claim(self, key, value=None):
+        """Returns True when the key was not claimed with the same value within the window"""
+        now = int(time.time())
+        item = {
+            "dedup_key": {"S": key},
+            "expires_at": {"N": str(now + self.window_seconds)},
+        }
+        # DynamoDB removes expired items lazily, expiration is checked on write
+        condition = "attribute_not_exists(dedup_key) OR expires_at <= :now"
+        values = {":now": {"N": str(now)}}
+        if value is not None:
+            item["claimed_value"] = {"S": value}
+            condition += " OR claimed_value <> :value"
+            values[":value"] = {"S": value}
+        try:
+            self.client.put_item(
+                TableName=self.table_name,
+                Item=item,
+                ConditionExpression=condition,
+                ExpressionAttributeValues=values,
+            )
+        except self.client.exceptions.ConditionalCheckFailedException:
+            return False
+        return True
+
+    def release(self, key):
+        """Removes a claim so the event can be processed again, e.g. on retry"""
+        try:
+            self.client.delete_item(
+                TableName=self.table_name,
+                Key={"dedup_key": {"S": key}},
+            )
+        except Exception as _exp:
+            logger.warning(f"### Idempotency key release failed for {key}: {_exp}")
+
+
+class MemoryIdempotencyStore:
+    """Keys kept in memory, for local runs"""
+
+    def __init__(self, window_seconds):
+        self.window_seconds = window_seconds
+        # {key: (expiration time, claimed value)}
+        self.keys = {}
+
+    def claim(self, key, value=None):
+        """Returns True when the key was not claimed with the same value within the window"""
+        now = time.time()
+        expires_at, claimed_value = self.keys.get(key, (0, None))
+        if expires_at > now and claimed_value == value:
+            return False
+        self.keys[key] = (now + self.window_seconds, value)
+        return True
+
+    def release(self, key):
+        """Removes a claim so the event can be processed again"""
+        self.keys.pop(key, None)
+
+
+def from_environment():
+    """Builds the store configured by DEDUP_TABLE, or an in-memory store when
+    only DEDUP_WINDOW_SECONDS is set. Returns None when deduplication is disabled.
+    """
+    window_seconds = int(os.environ.get("DEDUP_WINDOW_SECONDS", "0"))
+    if window_seconds <= 0:
+        return None
+    if os.environ.get("DEDUP_TABLE"):
+        return DynamoDBIdempotencyStore(os.environ["DEDUP_TABLE"], window_seconds)
+    return MemoryIdempotencyStore(window_seconds)
@@ -0,0 +1,84 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+"""  Structured and sampled logging for the Lambda functions.
+    Records are written as JSON lines. Payloads are passed as `%s` arguments
+    wrapped in `payload()` or `full()`, so they are only serialized when the
+    record is emitted: `payload()` truncates to LOG_MAX_FIELD_BYTES, `full()`
+    is meant for DEBUG records, e.g. raw events, enabled with LOG_LEVEL=DEBUG.
+    INFO and DEBUG records are kept for a sample of the invocations
+    (LOG_SAMPLE_RATE), warnings and errors are always written.
+"""
+import json
+import logging
+import os
+import random
+
+max_field_bytes = int(os.environ.get("LOG_MAX_FIELD_BYTES", "2048"))
+sample_rate = float(os.environ.get("LOG_SAMPLE_RATE", "1"))
+
+# sampling decision of the current invocation
+sampled = True
+
+
+class Payload:
+    """Serializes a value as JSON when the record is formatted"""
+
+    def __init__(self, value, max_bytes=None):
+        self.value = value
+        self.max_bytes = max_bytes
+
+    def __str__(self):
+        text = self.value if isinstance(self.value, str) else json.dumps(self.value, default=str)
+        if self.max_bytes and len(text) > self.max_bytes:
+            return f"{text[:self.max_bytes]}... ({len(text)} chars)"
+        return text
+
+
+def payload(value):
+    """A value logged up to LOG_MAX_FIELD_BYTES"""
+    return Payload(value, max_field_bytes)
+
+
+def full(value):
+    """A value logged in full, for DEBUG records"""
+    return Payload(value)
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        request_id = getattr(record, "aws_request_id", None)
+        if request_id:
+            entry["request_id"] = request_id
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """Drops INFO and DEBUG records of the invocations left out of the sample"""
+
+    def filter(self, record):
+        return sampled or record.levelno >= logging.WARNING
+
+
+def start_invocation():
+    """Draws the sampling decision of a new invocation"""
+    global sampled
+    sampled = sample_rate >= 1 or random.random() < sample_rate
+
+
+def setup():
+    """Configures the root logger of a function and returns it"""
+    logger = logging.getLogger()
+    logger.setLevel(os.environ.get("LOG_LEVEL", "INFO").upper())
+    if not logger.handlers:
+        logger.addHandler(logging.StreamHandler())
+    for handler in logger.handlers:
+        handler.setFormatter(JsonFormatter())
+        handler.addFilter(SamplingFilter())
+    return logger
@@ -0,0 +1,113 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+"""  CloudWatch metrics of the Lambda functions in Embedded Metric Format.
+    Values are aggregated in memory during an invocation and `flush()` prints
+    them as EMF documents, CloudWatch Logs extracts them as metrics of the
+    IAMPolicyEvaluation namespace. Every metric has a Function dimension, set
+    by `setup()`, plus the dimensions given when it is recorded, e.g. Operation.
+"""
+import datetime
+import json
+import threading
+import time
+
+NAMESPACE = "IAMPolicyEvaluation"
+# EMF accepts at most 100 values per metric in a document
+MAX_VALUES = 100
+
+function_name = "unknown"
+# records of a batch may be processed concurrently
+lock = threading.Lock()
+# {dimensions: {metric name: [unit, values]}}
+pending = {}
+
+
+def setup(name):
+    """Sets the Function dimension of the metrics of a function"""
+    global function_name
+    function_name = name
+
+
+def put(name, value, unit="Count", **dimensions):
+    """Records a value, counts are summed until the next flush"""
+    key = tuple(sorted(dimensions.items()))
+    with lock:
+        metric = pending.setdefault(key, {}).setdefault(name, [unit, []])
+        if unit == "Count" and metric[1]:
+            metric[1][0] += value
+        else:
+            metric[1].append(value)
+
+
+def count(name, value=1, **dimensions):
+    put(name, value, "Count", **dimensions)
+
+
+def timing(name, seconds, **dimensions):
+    put(name, round(seconds * 1000, 3), "Milliseconds", **dimensions)
+
+
+def api_call(operation, seconds):
+    """Counts an API call and its latency by operation"""
+    count("ApiCalls", Operation=operation)
+    timing("ApiLatency", seconds, Operation=operation)
+
+
+def cache(name, hit, value=1):
+    """Counts hits or misses of a cache"""
+    count("CacheHits" if hit else "CacheMisses", value, Cache=name)
+
+
+def timestamp(value):
+    """Epoch seconds of an ISO 8601 time, e.g. the CloudTrail eventTime,
+    None when it cannot be parsed
+    """
+    if value is None or isinstance(value, (int, float)):
+        return value
+    try:
+        parsed = datetime.datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=datetime.timezone.utc)
+    return parsed.timestamp()
+
+
+def lag(name, event_time):
+    """Records the time elapsed since an event time, ignored when it cannot be parsed"""
+    started_at = timestamp(event_time)
+    if started_at is not None:
+        timing(name, time.time() - started_at)
+
+
+def documents(dimensions, metrics):
+    """EMF documents carrying the values of a set of dimensions"""
+    for offset in range(0, max(len(values) for _unit, values in metrics.values()), MAX_VALUES):
+        chunk = {name: (unit, values[offset:offset + MAX_VALUES]) for name, (unit, values) in metrics.items()}
+        chunk = {name: (unit, values) for name, (unit, values) in chunk.items() if values}
+        document = {
+            "_aws": {
+                "Timestamp": int(time.time() * 1000),
+                "CloudWatchMetrics": [
+                    {
+                        "Namespace": NAMESPACE,
+                        "Dimensions": [["Function"] + [name for name, _value in dimensions]],
+                        "Metrics": [{"Name": name, "Unit": unit} for name, (unit, _values) in chunk.items()],
+                    }
+                ],
+            },
+            "Function": function_name,
+        }
+        document.update(dimensions)
+        document.update({name: values if len(values) > 1 else values[0] for name, (_unit, values) in chunk.items()})
+        yield document
+
+
+def flush():
+    """Prints the recorded metrics, called at the end of every invocation"""
+    global pending
+    with lock:
+        recorded, pending = pending, {}
+    for dimensions, metrics in recorded.items():
+        for document in documents(dimensions, metrics):
+            print(json.dumps(document))
@@ -0,0 +1,150 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+"""  Notifications of the findings of the checkers.
+    When a digest queue is configured the findings are queued, in batches of
+    up to 10 messages, for the digest function which groups them by principal
+    and severity and sends one summary per window. Otherwise each finding is
+    published to the notification topic.
+    The findings of a message processed with `for_record` are sent when the
+    message succeeds, and dropped when it fails: the retry queues them again.
+"""
+import contextlib
+import contextvars
+import functools
+import json
+import logging
+import os
+import threading
+import time
+
+from policy_common import metrics, tracing
+
+logger = logging.getLogger(__name__)
+
+# SendMessageBatch accepts up to 10 entries
+SQS_BATCH_SIZE = 10
+
+# findings queued by the message being processed, see Notifier.record
+record_findings = contextvars.ContextVar("record_findings", default=None)
+
+
+class Notifier:
+    """Publishes findings to the notification topic or queues them for the digest"""
+
+    def __init__(self, topic_arn, queue_url=None, client_sns=None, client_sqs=None):
+        if queue_url and client_sqs is None:
+            from policy_common import clients
+
+            client_sqs = clients.lazy("sqs")
+        if not queue_url and client_sns is None:
+            from policy_common import clients
+
+            client_sns = clients.lazy("sns")
+        self.topic_arn = topic_arn
+        self.queue_url = queue_url
+        self.client_sns = client_sns
+        self.client_sqs = client_sqs
+        self.pending = []
+        # records of a batch may be processed concurrently
+        self.lock = threading.Lock()
+
+    def notify(
+        self, source, principal, severity, summary, subject, message, event_time=None, actor=None, reasons=None
+    ):
+        """Queues a finding for the digest, or publishes the full message.
+        The lag since `event_time`, the CloudTrail eventTime, is recorded.
+        The digest lists the `actor` who made the change and the `reasons`.
+        """
+        metrics.count("FindingsEmitted", Severity=severity)
+        if event_time:
+            metrics.lag("NotificationLag", event_time)
+        with tracing.span("notify", severity=severity, digest=bool(self.queue_url)):
+            self._notify(source, principal, severity, summary, subject, message, event_time, actor, reasons)
+
+    def _notify(self, source, principal, severity, summary, subject, message, event_time, actor, reasons):
+        if not self.queue_url:
+            started = time.perf_counter()
+            response = self.client_sns.publish(
+                TopicArn=self.topic_arn,
+                Message=message,
+                Subject=subject,
+            )
+            metrics.api_call("publish", time.perf_counter() - started)
+            logger.info("Notification sent: %s", response)
+            return
+        finding = {
+            "source": source,
+            "principal": principal or "unknown",
+            "severity": severity,
+            "summary": summary,
+            "actor": actor,
+            "event_time": event_time,
+            "reasons": list(reasons or []),
+        }
+        findings = record_findings.get()
+        if findings is not None:
+            findings.append(finding)
+        else:
+            with self.lock:
+                self.pending.append(finding)
+        logger.info("Notification queued for digest: %s", finding)
+
+    @contextlib.contextmanager
+    def record(self):
+        """Collects the findings queued while processing one message and sends
+        them when it succeeds. The findings of a failing message are dropped.
+        """
+        findings = []
+        token = record_findings.set(findings)
+        try:
+            yield
+            self.send(findings)
+        finally:
+            record_findings.reset(token)
+
+    def for_record(self, handler):
+        """Wraps a message handler so the findings of every message are sent
+        when that message succeeds, see `record`
+        """
+
+        @functools.wraps(handler)
+        def wrapper(message):
+            with self.record():
+                return handler(message)
+
+        return wrapper
+
+    def flush(self):
+        """Sends the findings queued outside of a message to the digest queue"""
+        with self.lock:
+            pending, self.pending = self.pending, []
+        self.send(pending)
+
+    def discard(self):
+        """Drops the findings queued outside of a message and not sent, so a
+        failed invocation does not leave them to the next one
+        """
+        with self.lock:
+            pending, self.pending = self.pending, []
+        if pending:
+            logger.warning("### %s findings not sent to the digest queue", len(pending))
+
+    def send(self, pending):
+        """Sends findings to the digest queue"""
+        for offset in range(0, len(pending), SQS_BATCH_SIZE):
+            entries = [
+                {"Id": str(index), "MessageBody": json.dumps(finding, default=str)}
+                for index, finding in enumerate(pending[offset:offset + SQS_BATCH_SIZE])
+            ]
+            started = time.perf_counter()
+            response = self.client_sqs.send_message_batch(QueueUrl=self.queue_url, Entries=entries)
+            metrics.api_call("send_message_batch", time.perf_counter() - started)
+            if response.get("Failed"):
+                raise RuntimeError(f"Digest queue rejected findings: {response['Failed']}")
+        if pending:
+            logger.info("### %s findings sent to the digest queue", len(pending))
+
+
+def from_environment():
+    """Returns the notifier configured by SNS_TOPIC_ARN and DIGEST_QUEUE_URL"""
+    return Notifier(os.environ["SNS_TOPIC_ARN"], os.environ.get("DIGEST_QUEUE_URL"))
@@ -0,0 +1,94 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+"""  Statement level difference between two versions of a policy document.
+    The delta holds the statements added or broadened by the new version,
+    together with all its `Deny` statements. When every statement of the
+    previous version is kept or broadened, and the `Deny` statements did not
+    change, the permissions granted by the new version are exactly those of
+    the previous version plus those of the delta, so a checker can evaluate
+    the delta and reuse the verdict of the previous version.
+"""
+from policy_common import canonical
+
+# elements whose values can only grant more when the list grows
+WIDENING_ELEMENTS = ("Action", "Resource")
+
+
+def well_formed(policy_document):
+    """True when every statement is an object whose actions and resources
+    are lists of strings, as canonicalize() returns them
+    """
+    if not isinstance(policy_document, dict) or not isinstance(policy_document.get("Statement"), list):
+        return False
+    return all(
+        isinstance(statement, dict)
+        and all(canonical.is_string_list(statement[element]) for element in WIDENING_ELEMENTS if element in statement)
+        for statement in policy_document["Statement"]
+    )
+
+
+def without_sid(statement):
+    return {key: value for key, value in statement.items() if key != "Sid"}
+
+
+def covers(statement, previous):
+    """True when the statement grants at least what the previous one granted,
+    i.e. they only differ by a superset of actions or resources.
+    """
+    if statement.get("Effect") != "Allow" or previous.get("Effect") != "Allow":
+        return False
+    fixed = set(statement) | set(previous)
+    fixed -= {"Sid", *WIDENING_ELEMENTS}
+    if any(statement.get(key) != previous.get(key) for key in fixed):
+        return False
+    for element in WIDENING_ELEMENTS:
+        if (element in statement) != (element in previous):
+            return False
+        if element in statement and not set(previous[element]) <= set(statement[element]):
+            return False
+    return True
+
+
+def added_part(statement, previous_statements):
+    """Narrows a broadened statement to the actions it added, when a previous
+    statement only differs from it by its actions.
+    """
+    if "Action" not in statement:
+        return statement
+    for previous in previous_statements:
+        if covers(statement, previous) and statement.get("Resource") == previous.get("Resource"):
+            added = [action for action in statement["Action"] if action not in previous["Action"]]
+            return dict(statement, Action=added)
+    return statement
+
+
+def delta(previous_document, policy_document):
+    """Returns the delta document of the new version, or None when the change
+    is not an addition or a broadening and the whole document must be evaluated.
+    """
+    previous_document = canonical.canonicalize(previous_document)
+    policy_document = canonical.canonicalize(policy_document)
+    if not well_formed(previous_document) or not well_formed(policy_document):
+        return None
+    previous_statements = [without_sid(statement) for statement in previous_document["Statement"]]
+    statements = [without_sid(statement) for statement in policy_document["Statement"]]
+    previous_denies = [statement for statement in previous_statements if statement.get("Effect") == "Deny"]
+    denies = [statement for statement in statements if statement.get("Effect") == "Deny"]
+    if sorted(map(canonical.serialize, previous_denies)) != sorted(map(canonical.serialize, denies)):
+        return None
+    for previous in previous_statements:
+        if previous.get("Effect") == "Deny" or previous in statements:
+            continue
+        if not any(covers(statement, previous) for statement in statements):
+            return None
+    changed = [
+        added_part(statement, previous_statements)
+        for statement in policy_document["Statement"]
+        if statement.get("Effect") != "Deny" and without_sid(statement) not in previous_statements
+    ]
+    kept_denies = [
+        statement for statement in policy_document["Statement"] if statement.get("Effect") == "Deny"
+    ]
+    delta_document = {key: value for key, value in policy_document.items() if key != "Statement"}
+    delta_document["Statement"] = changed + kept_denies
+    return delta_document
@@ -0,0 +1,176 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+"""  Cache of managed policy documents.
+    A policy version is immutable, so its document is cached under
+    (policy id, version id): first in an in-memory LRU kept by the warm
+    container, then in a DynamoDB table shared by all containers. The policy
+    id, unlike the ARN, is not reused when a policy is deleted and created
+    again under the same name. Documents are stored compressed as they can
+    be large (e.g. ReadOnlyAccess) and expire after POLICY_CACHE_TTL.
+    The default version of a policy can change at any time, it is always
+    resolved with GetPolicy. The last document seen for each inline policy
+    is kept in the same table to compute the changes made by the next update.
+"""
+import collections
+import json
+import logging
+import os
+import threading
+import time
+import zlib
+
+from policy_common import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class PolicyVersionCache:
+    def __init__(self, table_name=None, max_entries=256, ttl_seconds=86400, client=None):
+        if table_name and client is None:
+            from policy_common import clients
+
+            client = clients.lazy("dynamodb")
+        self.table_name = table_name
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.client = client
+        # {key: (document, expiration time)}
+        self.documents = collections.OrderedDict()
+        self.inline_documents = {}
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def key(policy_id, version_id):
+        return f"{policy_id}#{version_id}"
+
+    def _remember(self, key, policy_document, expires_at):
+        with self.lock:
+            self.documents[key] = (policy_document, expires_at)
+            self.documents.move_to_end(key)
+            while len(self.documents) > self.max_entries:
+                self.documents.popitem(last=False)
+
+    def _get_item(self, key):
+        """Reads a document and its expiration time from the table, None when
+        missing, expired or on failure
+        """
+        if not self.table_name:
+            return None
+        try:
+            response = self.client.get_item(
+                TableName=self.table_name,
+                Key={"policy_version": {"S": key}},
+            )
+        except Exception as _exp:
+            logger.warning(f"### Policy version cache read failed for {key}: {_exp}")
+            return None
+        item = response.get("Item")
+        # DynamoDB removes expired items lazily, expiration is checked on read
+        if not item or int(item.get("expires_at", {"N": "0"})["N"]) <= time.time():
+            return None
+        return json.loads(zlib.decompress(item["document"]["B"])), int(item["expires_at"]["N"])
+
+    def _put_item(self, key, policy_document, expires_at):
+        """Writes a document to the table, write failures are logged"""
+        if not self.table_name:
+            return
+        try:
+            self.client.put_item(
+                TableName=self.table_name,
+                Item={
+                    "policy_version": {"S": key},
+                    "document": {"B": zlib.compress(json.dumps(policy_document).encode("UTF-8"))},
+                    "expires_at": {"N": str(int(expires_at))},
+                },
+            )
+        except Exception as _exp:
+            logger.warning(f"### Policy version cache write failed for {key}: {_exp}")
+
+    def get(self, policy_id, version_id):
+        """Returns the cached document of a policy version or None"""
+        key = self.key(policy_id, version_id)
+        with self.lock:
+            if key in self.documents:
+                policy_document, expires_at = self.documents[key]
+                if expires_at > time.time():
+                    self.documents.move_to_end(key)
+                    return policy_document
+                del self.documents[key]
+        item = self._get_item(key)
+        if item is None:
+            return None
+        self._remember(key, *item)
+        return item[0]
+
+    def put(self, policy_id, version_id, policy_document):
+        """Stores the document of a policy version"""
+        key = self.key(policy_id, version_id)
+        expires_at = time.time() + self.ttl_seconds
+        self._remember(key, policy_document, expires_at)
+        self._put_item(key, policy_document, expires_at)
+
+    def get_inline(self, reference):
+        """Returns the last document seen for an inline policy or None.
+        Inline policies change in place, they are not kept in the LRU
+        unless there is no table.
+        """
+        key = f"inline#{reference}"
+        if not self.table_name:
+            with self.lock:
+                policy_document, expires_at = self.inline_documents.get(key, (None, 0))
+            return policy_document if expires_at > time.time() else None
+        item = self._get_item(key)
+        return item[0] if item else None
+
+    def put_inline(self, reference, policy_document):
+        """Stores the current document of an inline policy"""
+        key = f"inline#{reference}"
+        expires_at = time.time() + self.ttl_seconds
+        if not self.table_name:
+            with self.lock:
+                self.inline_documents[key] = (policy_document, expires_at)
+            return
+        self._put_item(key, policy_document, expires_at)
+
+
+def get_version_document(cache, call, client_iam, policy_id, policy_arn, version_id):
+    """Returns the document of a policy version, IAM is only called when
+    the cache misses. `call` runs the IAM operations, e.g. EvaluationExecutor.call.
+    """
+    policy_document = cache.get(policy_id, version_id)
+    metrics.cache("policy_version", policy_document is not None)
+    if policy_document is None:
+        get_policy_version = call(
+            client_iam.get_policy_version,
+            PolicyArn=policy_arn,
+            VersionId=version_id,
+        )
+        policy_document = get_policy_version["PolicyVersion"]["Document"]
+        cache.put(policy_id, version_id, policy_document)
+    return policy_document
+
+
+def get_policy(call, client_iam, policy_arn):
+    """Returns the policy id and the default version id of a policy"""
+    policy = call(client_iam.get_policy, PolicyArn=policy_arn)["Policy"]
+    return policy["PolicyId"], policy["DefaultVersionId"]
+
+
+def get_policy_document(cache, call, client_iam, policy_arn, version_id=None):
+    """Returns the document of a policy version, the default version when no
+    version id is given. GetPolicy is always called, the default version may
+    have just been changed by another container.
+    """
+    policy_id, default_version_id = get_policy(call, client_iam, policy_arn)
+    return get_version_document(cache, call, client_iam, policy_id, policy_arn, version_id or default_version_id)
+
+
+def from_environment():
+    """Builds the cache configured by POLICY_VERSION_TABLE, POLICY_VERSION_CACHE_SIZE
+    and POLICY_CACHE_TTL
+    """
+    return PolicyVersionCache(
+        table_name=os.environ.get("POLICY_VERSION_TABLE"),
+        max_entries=int(os.environ.get("POLICY_VERSION_CACHE_SIZE", "256")),
+        ttl_seconds=int(os.environ.get("POLICY_CACHE_TTL", "86400")),
+    )
@@ -0,0 +1,83 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+"""  Batch processing of the messages fanned out by parse_eventbridge.
+    Messages are delivered either through an SQS queue subscribed to the SNS
+    topic with raw message delivery (`body`), or directly by SNS
+    (`Sns.Message`). A failing SQS message is reported as a partial batch
+    failure so only that message is retried. SQS messages that cannot start
+    before the function timeout, less BATCH_TIME_RESERVE_SECONDS, are
+    returned to the queue the same way instead of timing out the whole batch.
+"""
+import json
+import logging
+import os
+
+from policy_common import metrics, tracing
+
+logger = logging.getLogger(__name__)
+
+# time left to a message started last, e.g. a broad policy checked action by action
+time_reserve_seconds = float(os.environ.get("BATCH_TIME_RESERVE_SECONDS", "30"))
+
+
+class Deferred(Exception):
+    """The message was not processed, too close to the function timeout"""
+
+
+def parse_message(record):
+    """Returns the message published by parse_eventbridge carried by a record"""
+    if "body" in record:
+        return json.loads(record["body"])
+    return json.loads(record["Sns"]["Message"])
+
+
+def process_record(record, handler, name=None, context=None):
+    """Calls the handler with the message of a record, returns the exception
+    raised for SQS records and raises it for SNS records. With a name the
+    handler runs in a hop continuing the trace of the message. With the
+    Lambda context an SQS record is deferred when the time left is too short.
+    """
+    if (
+        context is not None
+        and "messageId" in record
+        and context.get_remaining_time_in_millis() < time_reserve_seconds * 1000
+    ):
+        logger.warning(f"### Message {record['messageId']} deferred, function timeout too close")
+        metrics.count("RecordsDeferred")
+        return Deferred(record["messageId"])
+    try:
+        message = parse_message(record)
+        if name:
+            with tracing.from_message(name, message):
+                handler(message)
+        else:
+            handler(message)
+    except Exception as _exp:
+        if "messageId" not in record:
+            raise
+        logger.exception(f"### Processing failed for message {record['messageId']}")
+        return _exp
+    return None
+
+
+def process_batch(event, handler, executor=None, name=None, context=None):
+    """Calls the handler with every message of the event and returns the
+    SQS partial batch response listing the messages that failed or were
+    deferred. With an EvaluationExecutor the messages are processed
+    concurrently, the handler must then not submit work to the same executor.
+    `name` traces the processing of every message as a hop of that name.
+    `context`, the Lambda context, defers the messages that cannot start
+    before the timeout.
+    """
+    batch = event.get("Records", [])
+    if executor:
+        errors = executor.map(lambda record: process_record(record, handler, name, context), batch)
+    else:
+        errors = [process_record(record, handler, name, context) for record in batch]
+    return {
+        "batchItemFailures": [
+            {"itemIdentifier": record["messageId"]}
+            for record, error in zip(batch, errors)
+            if error is not None
+        ]
+    }
@@ -0,0 +1,151 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+"""  End-to-end tracing of a policy change, from the CloudTrail eventTime to
+    the notification of the findings.
+    The trace id is derived from the CloudTrail eventID, parse_eventbridge
+    passes it in the fan-out message with its span id and the time the
+    message was published, so every checker continues the same trace and
+    records the time the message waited in the fan-out topic and queue.
+    Spans are written as JSON lines with the field names of OpenTelemetry
+    (OTLP JSON) to stdout or to a file (TRACE_EXPORT=stdout|file|none,
+    TRACE_FILE), for the traces kept by TRACE_SAMPLE_RATE. The sampling
+    decision only depends on the trace id, so the hops of a trace agree.
+"""
+import contextlib
+import contextvars
+import json
+import os
+import secrets
+import threading
+import time
+
+from policy_common import metrics
+
+export_mode = os.environ.get("TRACE_EXPORT", "none").lower()
+export_file = os.environ.get("TRACE_FILE", "/tmp/traces.jsonl")
+sample_rate = float(os.environ.get("TRACE_SAMPLE_RATE", "1"))
+
+current = contextvars.ContextVar("current_span", default=None)
+# spans of concurrent API calls are written by several threads
+lock = threading.Lock()
+
+
+def trace_id_for(event_id):
+    """Trace id of a CloudTrail event, retries of the event share it"""
+    trace_id = str(event_id).replace("-", "").lower()
+    if len(trace_id) == 32 and all(char in "0123456789abcdef" for char in trace_id):
+        return trace_id
+    return secrets.token_hex(16)
+
+
+def sampled(trace_id):
+    return sample_rate >= 1 or int(trace_id[:8], 16) < sample_rate * 2 ** 32
+
+
+class Span:
+    def __init__(self, name, trace_id, parent_span_id=None, start=None, attributes=None):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = secrets.token_hex(8)
+        self.parent_span_id = parent_span_id
+        self.start = time.time() if start is None else start
+        self.end = None
+        self.attributes = attributes or {}
+
+    def to_json(self):
+        return {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "parentSpanId": self.parent_span_id or "",
+            "name": self.name,
+            "startTimeUnixNano": int(self.start * 1e9),
+            "endTimeUnixNano": int(self.end * 1e9),
+            "attributes": self.attributes,
+            "resource": {"service.name": metrics.function_name},
+        }
+
+
+def export(span):
+    """Writes a finished span, when its trace is sampled"""
+    if export_mode == "none" or not sampled(span.trace_id):
+        return
+    line = json.dumps(span.to_json(), default=str)
+    with lock:
+        if export_mode == "file":
+            with open(export_file, "a", encoding="UTF-8") as stream:
+                stream.write(line + "\n")
+        else:
+            print(line)
+
+
+def record(name, start, end, trace_id, parent_span_id=None, **attributes):
+    """Exports a span measured elsewhere, e.g. the delivery of a message"""
+    span = Span(name, trace_id, parent_span_id, start, attributes)
+    span.end = end
+    export(span)
+    return span
+
+
+@contextlib.contextmanager
+def span(name, trace_id=None, parent_span_id=None, start=None, **attributes):
+    """Span of the enclosed block, a child of the current span by default.
+    Without a trace id or a current span nothing is recorded.
+    """
+    parent = current.get()
+    if trace_id is None and parent is not None:
+        trace_id, parent_span_id = parent.trace_id, parent.span_id
+    if trace_id is None:
+        yield None
+        return
+    opened = Span(name, trace_id, parent_span_id, start, attributes)
+    token = current.set(opened)
+    try:
+        yield opened
+    except Exception as _exp:
+        opened.attributes["error"] = repr(_exp)
+        raise
+    finally:
+        current.reset(token)
+        opened.end = time.time()
+        export(opened)
+
+
+@contextlib.contextmanager
+def hop(name, trace_id, parent_span_id=None, sent_at=None, **attributes):
+    """Span of the processing of a message by a function, preceded by a
+    `<name>.wait` span from the time the message was sent, e.g. the
+    CloudTrail eventTime or the fan-out publish time. Both durations are
+    also recorded as the QueueWait and ProcessingTime metrics.
+    """
+    received_at = time.time()
+    sent_at = metrics.timestamp(sent_at)
+    if sent_at is not None:
+        record(f"{name}.wait", sent_at, received_at, trace_id, parent_span_id)
+        metrics.timing("QueueWait", received_at - sent_at)
+    with span(name, trace_id, parent_span_id, received_at, **attributes) as opened:
+        yield opened
+    metrics.timing("ProcessingTime", time.time() - received_at)
+
+
+def from_message(name, message, **attributes):
+    """hop() continuing the trace carried by a fan-out message"""
+    context = message.get("trace") or {}
+    return hop(
+        name,
+        context.get("trace_id") or trace_id_for(None),
+        context.get("span_id"),
+        context.get("sent_at"),
+        **attributes,
+    )
+
+
+def propagate(sent_at=None):
+    """Trace context carried by a message sent from the current span"""
+    opened = current.get()
+    if opened is None:
+        return None
+    return {
+        "trace_id": opened.trace_id,
+        "span_id": opened.span_id,
+        "sent_at": time.time() if sent_at is None else sent_at,
+    }
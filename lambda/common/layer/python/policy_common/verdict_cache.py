@@ -0,0 +1,127 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+"""  Verdict cache for policy documents.
+    Verdicts are stored under a key built from the checker name, the version of
+    the inputs the checker depends on (e.g. the privileged actions list) and the
+    hash of the canonical form of the policy document, so evaluating a document already seen is a
+    single key lookup. Entries expire after a TTL.
+    The DynamoDB backend is used by the Lambda functions, the file backend
+    allows running the checkers locally.
+"""
+import json
+import logging
+import os
+import threading
+import time
+
+from policy_common import canonical
+
+logger = logging.getLogger(__name__)
+
+
+def cache_key(checker, version, policy_document):
+    """Key of the verdict of a checker for a policy document"""
+    return cache_key_for_hash(checker, version, canonical.document_hash(policy_document))
+
+
+def cache_key_for_hash(checker, version, document_hash):
+    """Key of the verdict of a checker for the canonical hash of a policy document"""
+    return f"{checker}#{version}#{document_hash}"
+
+
+class DynamoDBVerdictCache:
+    """Verdicts stored in a DynamoDB table with `cache_key` as partition key
+    and `expires_at` as TTL attribute.
+    """
+
+    def __init__(self, table_name, ttl_seconds, client=None):
+        if client is None:
+            from policy_common import clients
+
+            client = clients.lazy("dynamodb")
+        self.table_name = table_name
+        self.ttl_seconds = ttl_seconds
+        self.client = client
+
+    def get(self, key):
+        """Returns the cached verdict or None"""
+        try:
+            response = self.client.get_item(
+                TableName=self.table_name,
+                Key={"cache_key": {"S": key}},
+            )
+        except Exception as _exp:
+            logger.warning(f"### Verdict cache read failed for {key}: {_exp}")
+            return None
+        item = response.get("Item")
+        # DynamoDB removes expired items lazily, expiration is checked on read
+        if not item or int(item["expires_at"]["N"]) <= time.time():
+            return None
+        return json.loads(item["verdict"]["S"])
+
+    def put(self, key, verdict):
+        """Stores the verdict, failures are logged and ignored"""
+        try:
+            self.client.put_item(
+                TableName=self.table_name,
+                Item={
+                    "cache_key": {"S": key},
+                    "verdict": {"S": json.dumps(verdict, default=str)},
+                    "expires_at": {"N": str(int(time.time()) + self.ttl_seconds)},
+                },
+            )
+        except Exception as _exp:
+            logger.warning(f"### Verdict cache write failed for {key}: {_exp}")
+
+
+class FileVerdictCache:
+    """Verdicts stored in a local JSON file"""
+
+    def __init__(self, path, ttl_seconds):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        # records of a batch may be processed concurrently
+        self.lock = threading.Lock()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return {}
+        with open(self.path, "r") as fp:
+            return json.load(fp)
+
+    def get(self, key):
+        """Returns the cached verdict or None"""
+        with self.lock:
+            entry = self._load().get(key)
+        if not entry or entry["expires_at"] <= time.time():
+            return None
+        return entry["verdict"]
+
+    def put(self, key, verdict):
+        """Stores the verdict and evicts expired entries"""
+        now = time.time()
+        with self.lock:
+            entries = {
+                cached_key: entry
+                for cached_key, entry in self._load().items()
+                if entry["expires_at"] > now
+            }
+            entries[key] = {
+                "verdict": json.loads(json.dumps(verdict, default=str)),
+                "expires_at": int(now) + self.ttl_seconds,
+            }
+            with open(f"{self.path}.tmp", "w") as fp:
+                json.dump(entries, fp)
+            os.replace(f"{self.path}.tmp", self.path)
+
+
+def from_environment():
+    """Builds the cache configured by VERDICT_CACHE_TABLE or VERDICT_CACHE_FILE,
+    returns None when caching is disabled.
+    """
+    ttl_seconds = int(os.environ.get("VERDICT_CACHE_TTL", "86400"))
+    if os.environ.get("VERDICT_CACHE_TABLE"):
+        return DynamoDBVerdictCache(os.environ["VERDICT_CACHE_TABLE"], ttl_seconds)
+    if os.environ.get("VERDICT_CACHE_FILE"):
+        return FileVerdictCache(os.environ["VERDICT_CACHE_FILE"], ttl_seconds)
+    return None
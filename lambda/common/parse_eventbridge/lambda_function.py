@@ -8,20 +8,39 @@
     Sends an alert via SNS whenever there is a match.
 """
 import json
-import logging
-import boto3
 import os
 
+from policy_common import (
+    canonical, clients, evaluation, idempotency, logs, metrics, policy_diff, policy_versions, tracing
+)
+
 sns_topic_arn = os.environ["SNS_TOPIC_ARN"]
 
-logger = logging.getLogger()
-logger.setLevel(logging.INFO)
+logger = logs.setup()
+metrics.setup("parse_eventbridge")
 
-client_iam = boto3.client("iam")
-client_sns = boto3.client("sns")
+client_iam = clients.lazy("iam")
+client_sns = clients.lazy("sns")
+executor = evaluation.from_environment()
+dedup_store = idempotency.from_environment()
+policy_version_cache = policy_versions.from_environment()
 
-def lambda_handler(event, context):
-    """Lambda Handler"""
+
+def previous_policy_document(policy_id, version_id):
+    """Returns the cached document of the version created before a new version,
+    or None. No IAM call is made: the delta against any earlier document is
+    sound, the checkers only reuse a verdict cached for that document.
+    """
+    number = version_id.removeprefix("v")
+    if not number.isdigit() or int(number) <= 1:
+        return None
+    previous_document = policy_version_cache.get(policy_id, f"v{int(number) - 1}")
+    metrics.cache("previous_version", previous_document is not None)
+    return previous_document
+
+
+def process_event(event, claimed_keys):
+    """Publishes the policy document changed by the event to the fan-out topic"""
     # These actions track creation, update, assignment, and changes in default of identity-based policies
     # https://docs.aws.amazon.com/IAM/latest/UserGuide/access_policies.html#policies_id-based
     # https://docs.aws.amazon.com/IAM/latest/APIReference/API_Operations.html
@@ -38,14 +57,16 @@ def lambda_handler(event, context):
     ]
     requestparameters = event["detail"]["requestParameters"]
     responseelements = event["detail"]["responseElements"]
-    logger.info(f"### RAW Event {json.dumps(event)}")
+    logger.debug("### RAW Event %s", logs.full(event))
     action = event["detail"]["eventName"]
-    logger.info(f"### Event requestParameters {requestparameters}")
-    logger.info(f"### Event responseElements {responseelements}")
+    logger.debug("### Event requestParameters %s", logs.full(requestparameters))
+    logger.debug("### Event responseElements %s", logs.full(responseelements))
     policy_reference = None
     policy_document = None
+    previous_document = None
     if action in actions:
-        logger.info(f"### API call supported {action}")
+        logger.info("### API call supported %s", action)
+        metrics.count("EventsReceived", Action=action)
         # These actions monitor the assignment of identity-based policies to IAM Principals
         if action in [
             "AttachGroupPolicy",
@@ -53,17 +74,12 @@ def lambda_handler(event, context):
             "AttachUserPolicy",
             "SetDefaultPolicyVersion"
         ]:
-            logger.info(f"### processing {action}")
+            logger.info("### processing %s", action)
             policy_arn = requestparameters["policyArn"]
-            get_policy = client_iam.get_policy(
-                PolicyArn=policy_arn
-            )
-            # retrieves policy document for processing
-            get_policy_version = client_iam.get_policy_version(
-                PolicyArn=policy_arn,
-                VersionId=get_policy["Policy"]["DefaultVersionId"]
+            # SetDefaultPolicyVersion names the version, attachments use the default one
+            policy_document = policy_versions.get_policy_document(
+                policy_version_cache, executor.call, client_iam, policy_arn, requestparameters.get("versionId")
             )
-            policy_document = get_policy_version["PolicyVersion"]["Document"]
             policy_reference = event["detail"]["requestParameters"]["policyArn"]
         # These actions monitor creation and changes to principal IAM Policies
         # They embed the policy document in `requestParameters`
@@ -73,16 +89,43 @@ def lambda_handler(event, context):
             "PutGroupPolicy",
             "PutUserPolicy",
         ]:
-            logger.info(f'### processing {action}')
+            logger.info('### processing %s', action)
             policy_document = json.loads(requestparameters["policyDocument"])
             policy_reference = event["detail"]["requestParameters"]["policyName"]
+            if action == "CreatePolicy" and responseelements:
+                # the first version of a new policy is cached for its future attachments
+                policy_version_cache.put(
+                    responseelements["policy"]["policyId"],
+                    responseelements["policy"]["defaultVersionId"],
+                    policy_document,
+                )
+            elif action != "CreatePolicy":
+                # an inline policy is compared with the last document seen for it
+                principal = (
+                    requestparameters.get("roleName")
+                    or requestparameters.get("groupName")
+                    or requestparameters.get("userName")
+                )
+                inline_reference = f"{action}/{principal}/{policy_reference}"
+                previous_document = policy_version_cache.get_inline(inline_reference)
+                policy_version_cache.put_inline(inline_reference, policy_document)
         # This action monitors changes in default IAM Policy version
         elif action in [
             "CreatePolicyVersion",
         ]:
-            logger.info(f'### processing {action}')
+            logger.info('### processing %s', action)
             policy_document = json.loads(requestparameters["policyDocument"])
             policy_reference = event["detail"]["requestParameters"]["policyArn"]
+            if responseelements:
+                version = responseelements["policyVersion"]
+                try:
+                    policy_id, _default_version_id = policy_versions.get_policy(
+                        executor.call, client_iam, policy_reference
+                    )
+                    policy_version_cache.put(policy_id, version["versionId"], policy_document)
+                    previous_document = previous_policy_document(policy_id, version["versionId"])
+                except Exception as _exp:
+                    logger.warning("### Previous version not found for %s: %s", policy_reference, _exp)
         target = None
         if "roleName" in event["detail"]["requestParameters"]:
             target = event["detail"]["requestParameters"]["roleName"]
@@ -90,10 +133,33 @@ def lambda_handler(event, context):
             target = event["detail"]["requestParameters"]["groupName"]
         if "userName" in event["detail"]["requestParameters"]:
             target = event["detail"]["requestParameters"]["userName"]
+        # the document is published as submitted, the canonical form is only
+        # used for hashes. The checkers evaluate only the added or broadened statements when they
+        # still hold the verdict of the previous document
+        policy_delta = None
+        previous_policy_hash = None
+        if previous_document is not None:
+            policy_delta = policy_diff.delta(previous_document, policy_document)
+        if policy_delta is not None:
+            previous_policy_hash = canonical.document_hash(previous_document)
+            logger.info("found policy delta %s", logs.payload(policy_delta))
         if target:
-            logger.info(f"found target {target}")
-        logger.info(f"found policy {policy_reference}")
-        logger.info(f"found policy document {policy_document}")
+            logger.info("found target %s", target)
+        logger.info("found policy %s", policy_reference)
+        logger.debug("found policy document %s", logs.full(policy_document))
+        if dedup_store:
+            # only a re-send of the document currently applied is suppressed,
+            # publishing another document for the policy replaces the claim.
+            # The principal type is part of the key, a role and a user can share a name
+            principal_type = next(
+                (kind for kind in ("role", "group", "user") if f"{kind}Name" in requestparameters), ""
+            )
+            change_key = f"change#{principal_type}/{target or ''}#{policy_reference}"
+            if not dedup_store.claim(change_key, canonical.document_hash(policy_document)):
+                logger.info("### Duplicate change suppressed %s", change_key)
+                metrics.count("DuplicatesSuppressed", Reason="PolicyChange")
+                return
+            claimed_keys.append(change_key)
         message = {
             "policy_reference":  policy_reference,
             "trigger": event["detail"]["eventName"],
@@ -101,10 +167,52 @@ def lambda_handler(event, context):
             "event_time": event["detail"]["eventTime"],
             "target_principal": target,
             "policy_document": policy_document,
+            "policy_delta": policy_delta,
+            "previous_policy_hash": previous_policy_hash,
+            # the checkers continue the trace and measure the fan-out delivery
+            "trace": tracing.propagate(),
         }
-        response = client_sns.publish(
+        response = executor.call(
+            client_sns.publish,
             TopicArn=sns_topic_arn,
             Message=json.dumps(message),
         )
-        logger.info(f"Notification sent: {response}")
-        logger.info(f"notification message: {message}")
\ No newline at end of file
+        metrics.count("DocumentsPublished")
+        metrics.lag("FanOutLag", event["detail"]["eventTime"])
+        logger.info("Notification sent: %s", response)
+        logger.debug("notification message: %s", logs.full(message))
+
+
+def lambda_handler(event, context):
+    """Lambda Handler"""
+    logs.start_invocation()
+    try:
+        # the wait covers the CloudTrail and EventBridge delivery of the event
+        with tracing.hop(
+            "parse_eventbridge",
+            tracing.trace_id_for(event["detail"].get("eventID")),
+            sent_at=event["detail"].get("eventTime"),
+            action=event["detail"].get("eventName"),
+        ):
+            process_unique_event(event)
+    finally:
+        metrics.flush()
+
+
+def process_unique_event(event):
+    """Processes an event unless the same event ID was already processed"""
+    claimed_keys = []
+    if dedup_store:
+        event_key = f"event#{event['detail']['eventID']}"
+        if not dedup_store.claim(event_key):
+            logger.info("### Duplicate event suppressed %s", event_key)
+            metrics.count("DuplicatesSuppressed", Reason="EventID")
+            return
+        claimed_keys.append(event_key)
+    try:
+        process_event(event, claimed_keys)
+    except Exception:
+        # the event was not fanned out, a retry must not be suppressed
+        for key in claimed_keys:
+            dedup_store.release(key)
+        raise
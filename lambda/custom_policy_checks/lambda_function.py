@@ -3,45 +3,197 @@
 """  This Lambda function
 """
 import json
-import logging
-import boto3
 import os
+import time
+from botocore.exceptions import ClientError
+
+from policy_common import (
+    action_matcher, canonical, clients, evaluation, logs, metrics, notifications, records, verdict_cache
+)
 
 snstopic = os.environ["SNS_TOPIC_ARN"]
 s3bucket = os.environ["BUCKET"]
 s3key = os.environ["KEY"]
+# CheckAccessNotGranted accepts at most 100 actions per access entry
+batch_size = min(int(os.environ.get("ACTIONS_BATCH_SIZE", "100")), 100)
+# failing batches of at most this many actions are checked action by action
+SINGLE_CHECK_SIZE = 4
+# when enabled, every privileged action is still sent to Access Analyzer and
+# any disagreement with the local pre-filter is logged
+verify_prefilter = os.environ.get("PREFILTER_VERIFY", "false").lower() == "true"
+# minimum number of seconds between two revalidations of the privileged actions list
+refresh_interval = int(os.environ.get("PRIVILEGED_REFRESH_SECONDS", "300"))
 
-logger = logging.getLogger()
-logger.setLevel(logging.INFO)
+logger = logs.setup()
+metrics.setup("custom_policy_checks")
 
-client_s3 = boto3.client("s3")
-client_sns = boto3.client("sns")
-client_accessanalyzer = boto3.client("accessanalyzer")
+client_s3 = clients.lazy("s3")
+notifier = notifications.from_environment()
+client_accessanalyzer = clients.lazy("accessanalyzer")
+cache = verdict_cache.from_environment()
+executor = evaluation.from_environment()
 
+# privileged actions list kept across invocations of a warm container
+privileged_actions = frozenset()
+privileged_index = action_matcher.ActionIndex([])
+privileged_etag = None
+privileged_checked_at = 0.0
 
-def lambda_handler(event, context):
-    """Lambda Handler"""
-    logger.info(f"### RAW Event {json.dumps(event)}")
-    logger.info(f"Bucket {s3bucket} Key {s3key}")
-    s3object = client_s3.get_object(Bucket=s3bucket, Key=s3key)
-    privileged_actions = s3object["Body"].read().decode("UTF-8").splitlines()
-    logger.info(f"### Privileged actions {privileged_actions}")
-    parsed_event = json.loads(event["Records"][0]["Sns"]["Message"])
-    logger.info(f"### Parsed Event {parsed_event}")
-    policy_document = json.dumps(parsed_event["policy_document"])
-    results = []
-    for action in privileged_actions:
-        response = client_accessanalyzer.check_access_not_granted(
-            policyDocument=policy_document,
-            policyType="IDENTITY_POLICY",
-            access=[{"actions": [action]}],
+
+def load_privileged_index(actions, etag):
+    """Returns the index uploaded with the privileged actions list, or an
+    index compiled here when it is missing or was built from another list
+    """
+    try:
+        s3object = client_s3.get_object(Bucket=s3bucket, Key=action_matcher.index_key(s3key))
+        index, source_etag = action_matcher.ActionIndex.from_json(s3object["Body"].read())
+        if source_etag == etag:
+            return index
+        logger.warning("### Action index built from %s, not %s, compiling it", source_etag, etag)
+    except (ClientError, ValueError) as _exp:
+        logger.warning("### Action index not loaded, compiling it: %s", _exp)
+    return action_matcher.ActionIndex(sorted(actions))
+
+
+def load_privileged_actions():
+    """Refreshes the privileged actions list from S3 when the refresh interval
+    has elapsed. The object is only downloaded and parsed again when its ETag
+    changed, an unchanged object answers the conditional GET with a 304.
+    """
+    global privileged_actions, privileged_index, privileged_etag, privileged_checked_at
+    if privileged_etag and time.monotonic() - privileged_checked_at < refresh_interval:
+        return
+    request = {"Bucket": s3bucket, "Key": s3key}
+    if privileged_etag:
+        request["IfNoneMatch"] = privileged_etag
+    try:
+        s3object = client_s3.get_object(**request)
+    except ClientError as _exp:
+        if _exp.response["ResponseMetadata"]["HTTPStatusCode"] != 304:
+            raise
+        logger.info("### Privileged actions not modified %s", privileged_etag)
+    else:
+        privileged_actions = frozenset(
+            action.strip()
+            for action in s3object["Body"].read().decode("UTF-8").splitlines()
+            if action.strip()
         )
-        if response["result"] == "FAIL":
-            results.append([action, response["reasons"]])
-    logger.info(f"### Results {results}")
+        privileged_etag = s3object["ETag"]
+        privileged_index = load_privileged_index(privileged_actions, privileged_etag)
+        logger.info("### %s privileged actions", len(privileged_actions))
+        logger.debug("### Privileged actions %s", logs.full(sorted(privileged_actions)))
+    privileged_checked_at = time.monotonic()
+
+
+def check_actions(policy_document, actions):
+    """Checks a batch of actions with a single CheckAccessNotGranted call"""
+    return executor.call(
+        client_accessanalyzer.check_access_not_granted,
+        policyDocument=policy_document,
+        policyType="IDENTITY_POLICY",
+        access=[{"actions": actions}],
+    )
+
+
+def find_granted_actions(policy_document, actions):
+    """Returns a list of [action, reasons] for every action granted by the policy.
+    Actions are checked in batches, failing batches are split in half until the
+    offending actions are isolated, so passing batches cost a single call
+    whatever their size. When both halves of a batch fail most of its actions
+    are likely granted and bisecting would cost up to 2N-1 calls, so their
+    actions are checked one by one, as are failing batches of up to
+    SINGLE_CHECK_SIZE actions. The batches of each round are checked concurrently.
+    """
+    results = []
+    # the halves of a split batch are kept together to tell when both fail
+    groups = [[actions[start:start + batch_size]] for start in range(0, len(actions), batch_size)]
+    while groups:
+        batches = [batch for group in groups for batch in group]
+        responses = iter(executor.map(lambda batch: check_actions(policy_document, batch), batches))
+        next_groups = []
+        for group in groups:
+            failing_batches = []
+            for batch in group:
+                response = next(responses)
+                if response["result"] != "FAIL":
+                    continue
+                if len(batch) == 1:
+                    results.append([batch[0], response["reasons"]])
+                else:
+                    failing_batches.append(batch)
+            dense = len(group) > 1 and len(failing_batches) == len(group)
+            for batch in failing_batches:
+                if dense or len(batch) <= SINGLE_CHECK_SIZE:
+                    next_groups.append([[action] for action in batch])
+                else:
+                    middle = len(batch) // 2
+                    next_groups.append([batch[:middle], batch[middle:]])
+        groups = next_groups
+    return sorted(results, key=lambda result: result[0])
+
+
+def evaluate_policy(policy_document, privileged_index):
+    """Returns [action, reasons] for every privileged action granted by the policy"""
+    candidates = sorted(privileged_index.candidates(policy_document))
+    logger.info("### Candidate actions %s", logs.payload(candidates))
+    if not candidates and not verify_prefilter:
+        logger.info("### Result PASS, policy cannot grant any privileged action")
+        return []
+    actions_to_check = privileged_index.actions if verify_prefilter else candidates
+    results = find_granted_actions(json.dumps(policy_document), actions_to_check)
+    if verify_prefilter:
+        missed = [action for action, _reasons in results if action not in candidates]
+        if missed:
+            logger.warning("### Pre-filter disagrees with Access Analyzer for %s", missed)
+    return results
+
+
+def evaluate_delta(parsed_event, version):
+    """Evaluates only the statements added or broadened since the previous
+    document and merges the result with the cached verdict of the previous
+    document. Returns None when the whole document must be evaluated.
+    """
+    if not cache or verify_prefilter or parsed_event.get("policy_delta") is None:
+        return None
+    previous_key = verdict_cache.cache_key_for_hash(
+        "custom_policy_checks", version, parsed_event["previous_policy_hash"]
+    )
+    previous_results = cache.get(previous_key)
+    if previous_results is None:
+        return None
+    logger.info("### Evaluating policy delta, previous verdict %s", previous_key)
+    metrics.count("DeltaEvaluations")
+    delta_results = evaluate_policy(
+        canonical.canonicalize(parsed_event["policy_delta"]), privileged_index
+    )
+    merged = dict(previous_results)
+    merged.update(dict(delta_results))
+    return [[action, merged[action]] for action in sorted(merged)]
+
+
+def process_message(parsed_event):
+    """Evaluates the policy document of a message and notifies the findings"""
+    logger.info("### Parsed Event %s", logs.payload(parsed_event))
+    # the verdict only depends on the permissions, it is cached by canonical hash
+    policy_document = parsed_event["policy_document"]
+    # the ETag identifies the version of the privileged actions list
+    version = privileged_etag.strip('"')
+    key = verdict_cache.cache_key("custom_policy_checks", version, policy_document)
+    results = cache.get(key) if cache and not verify_prefilter else None
+    metrics.count("DocumentsEvaluated")
+    if cache and not verify_prefilter:
+        metrics.cache("verdict", results is not None)
+    if results is None:
+        results = evaluate_delta(parsed_event, version)
+        if results is None:
+            results = evaluate_policy(policy_document, privileged_index)
+        if cache:
+            cache.put(key, results)
+    else:
+        logger.info("### Verdict cache hit %s", key)
+    logger.info("### Results %s", logs.payload(results))
     if results:
         policy_reference = parsed_event["policy_reference"]
-        policy_document = parsed_event["policy_document"]
         trigger = parsed_event["trigger"]
         useridentity_arn = parsed_event["agent_role_arn"]
         event_time = parsed_event["event_time"]
@@ -56,10 +208,34 @@ def lambda_handler(event, context):
             f"Evaluation: {results}"
         )
         subject = "Policy Document Check for Custom Policy Checks"
-        response = client_sns.publish(
-            TopicArn=snstopic,
-            Message=message,
-            Subject=subject,
+        notifier.notify(
+            "custom_policy_checks",
+            target or useridentity_arn,
+            "CRITICAL",
+            f"{policy_reference} ({trigger}) grants {', '.join(action for action, _ in results)}",
+            subject,
+            message,
+            event_time=event_time,
+            actor=useridentity_arn,
+            reasons=[
+                f"{action}: {'; '.join(reason.get('description', '') for reason in reasons)}"
+                for action, reasons in results
+            ],
+        )
+        logger.debug("notification message: %s", logs.full(message))
+
+
+def lambda_handler(event, context):
+    """Lambda Handler"""
+    logs.start_invocation()
+    logger.debug("### RAW Event %s", logs.full(event))
+    logger.info("Bucket %s Key %s", s3bucket, s3key)
+    try:
+        load_privileged_actions()
+        # the findings of every message are sent as soon as it succeeds
+        response = records.process_batch(
+            event, notifier.for_record(process_message), name="custom_policy_checks", context=context
         )
-        logger.info(f"Notification sent: {response}")
-        logger.info(f"notification message: {message}")
\ No newline at end of file
+    finally:
+        metrics.flush()
+    return response
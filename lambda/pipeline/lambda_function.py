@@ -3,29 +3,31 @@
 """  This Lambda function
 """
 import json
-import logging
 import os
-import boto3
+import time
 
-logger = logging.getLogger()
-logger.setLevel(logging.INFO)
+from policy_common import clients, logs, metrics
+
+logger = logs.setup()
+metrics.setup("pipeline")
 
 snstopic = os.environ["SNS_TOPIC_ARN"]
 
-client_sns = boto3.client("sns")
+client_sns = clients.lazy("sns")
 
 
 def lambda_handler(event, context):
     """Lambda Handler"""
-    logger.info(f"### RAW Event {json.dumps(event)}")
+    logs.start_invocation()
+    logger.debug("### RAW Event %s", logs.full(event))
     parsed_event = json.loads(event["Records"][0]["Sns"]["Message"])
-    logger.info(f"### Parsed Event {parsed_event}")
+    logger.info("### Parsed Event %s", logs.payload(parsed_event))
     build_status = parsed_event["detail"]["build-status"]
     build_id = parsed_event["detail"]["build-id"]
     project_name = parsed_event["detail"]["project-name"]
     initiator = parsed_event["detail"]["additional-information"]["initiator"]
     build_start_time = parsed_event["detail"]["additional-information"]["build-start-time"]
-    logs = parsed_event["detail"]["additional-information"]["logs"]["deep-link"]
+    logs_link = parsed_event["detail"]["additional-information"]["logs"]["deep-link"]
     context = []
     for phase in parsed_event["detail"]["additional-information"]["phases"]:
         if "phase-status" in phase:
@@ -37,14 +39,19 @@ def lambda_handler(event, context):
         f"Project Name: {project_name} \n\n"
         f"Initiator: {initiator} \n\n"
         f"Build start time: {build_start_time} \n\n"
-        f"URL for logs: {logs} \n\n"
+        f"URL for logs: {logs_link} \n\n"
         f"Context: {context}"
     )
     subject = "Pipeline Build Result"
+    started = time.perf_counter()
     response = client_sns.publish(
         TopicArn=snstopic,
         Message=message,
         Subject=subject,
     )
-    logger.info(f"Notification sent: {response}")
-    logger.info(f"notification message: {message}")
+    metrics.api_call("publish", time.perf_counter() - started)
+    metrics.count("BuildResults", Status=build_status)
+    metrics.lag("NotificationLag", parsed_event.get("time"))
+    metrics.flush()
+    logger.info("Notification sent: %s", response)
+    logger.debug("notification message: %s", logs.full(message))
@@ -2,43 +2,110 @@
 # SPDX-License-Identifier: MIT-0
 """  This Lambda function
 """
+import functools
 import json
-import logging
 import os
-import boto3
 
-logger = logging.getLogger()
-logger.setLevel(logging.INFO)
+from policy_common import canonical, clients, evaluation, logs, metrics, notifications, records, verdict_cache
+
+logger = logs.setup()
+metrics.setup("policy_validator")
 
 region = os.environ["REGION"]
 account_id = os.environ["ACCOUNT_ID"]
 snstopic = os.environ["SNS_TOPIC_ARN"]
-soft_fail = os.environ["SOFT_FAIL"]
-hard_fail = os.environ["HARD_FAIL"]
 
-client_accessanalyzer = boto3.client("accessanalyzer")
-client_sns = boto3.client("sns")
 
+def parse_thresholds(value):
+    """Returns the finding types (e.g. "ERROR") or issue codes of a JSON list
+    or of a comma separated list such as "ERROR,SECURITY_WARNING"
+    """
+    value = (value or "").strip()
+    if value.startswith("["):
+        return set(json.loads(value))
+    return {item.strip() for item in value.split(",") if item.strip()}
 
-def lambda_handler(event, context):
-    """Lambda Handler"""
-    logger.info(f"### RAW Event {json.dumps(event)}")
-    parsed_event = json.loads(event["Records"][0]["Sns"]["Message"])
-    logger.info(f"### Parsed Event {parsed_event}")
-    result_validate = client_accessanalyzer.validate_policy(
-        policyDocument=json.dumps(parsed_event["policy_document"]),
-        policyType="IDENTITY_POLICY",
-        locale="EN",
-    )
-    logger.info(f"### Access Analyzer Result {result_validate}")
-    policy_reference = parsed_event["policy_reference"]
+
+soft_fail = parse_thresholds(os.environ["SOFT_FAIL"])
+hard_fail = parse_thresholds(os.environ["HARD_FAIL"])
+validation_cache_size = int(os.environ.get("VALIDATION_CACHE_SIZE", 256))
+
+client_accessanalyzer = clients.lazy("accessanalyzer")
+notifier = notifications.from_environment()
+cache = verdict_cache.from_environment()
+executor = evaluation.from_environment()
+
+
+@functools.lru_cache(maxsize=validation_cache_size)
+def validate_serialized(policy_json):
+    """Returns all the pages of findings of ValidatePolicy for a serialized
+    document, repeated documents are served from memory
+    """
+    findings = []
+    kwargs = {}
+    while True:
+        result_validate = executor.call(
+            client_accessanalyzer.validate_policy,
+            policyDocument=policy_json,
+            policyType="IDENTITY_POLICY",
+            locale="EN",
+            **kwargs,
+        )
+        logger.info("### Access Analyzer Result %s", logs.payload(result_validate))
+        findings.extend(result_validate["findings"])
+        if not result_validate.get("nextToken"):
+            return findings
+        kwargs["nextToken"] = result_validate["nextToken"]
+
+
+def validate_policy(policy_document):
+    """Returns the findings of ValidatePolicy for a policy document as submitted,
+    their locations point into it
+    """
+    return list(validate_serialized(json.dumps(policy_document)))
+
+
+def classify(findings):
+    """Returns HARD_FAIL, SOFT_FAIL or PASS, and the findings that matched"""
+    for status, thresholds in (("HARD_FAIL", hard_fail), ("SOFT_FAIL", soft_fail)):
+        matched = [
+            finding
+            for finding in findings
+            if finding["findingType"] in thresholds or finding["issueCode"] in thresholds
+        ]
+        if matched:
+            return status, matched
+    return "PASS", []
+
+
+def process_message(parsed_event):
+    """Validates the policy document of a message and notifies the findings"""
+    logger.info("### Parsed Event %s", logs.payload(parsed_event))
+    # findings such as REDUNDANT_STATEMENT and their locations depend on the
+    # layout of the whole document, so it is always validated whole (never as
+    # a delta) and the findings are cached for the document as submitted
     policy_document = parsed_event["policy_document"]
+    key = verdict_cache.cache_key_for_hash("policy_validator", "EN", canonical.submitted_hash(policy_document))
+    findings = cache.get(key) if cache else None
+    metrics.count("DocumentsEvaluated")
+    if cache:
+        metrics.cache("verdict", findings is not None)
+    if findings is None:
+        findings = validate_policy(policy_document)
+        if cache:
+            cache.put(key, findings)
+    else:
+        logger.info("### Verdict cache hit %s", key)
+    policy_reference = parsed_event["policy_reference"]
     trigger = parsed_event["trigger"]
     useridentity_arn = parsed_event["agent_role_arn"]
     event_time = parsed_event["event_time"]
     target = parsed_event["target_principal"]
-    findings = result_validate["findings"]
-    if findings:
+    status, failed_findings = classify(findings)
+    logger.info("### Validation status %s, %s of %s findings", status, len(failed_findings), len(findings))
+    # the thresholds are those of the IaC scan, HardFailParam defaults to
+    # ERROR and SECURITY_WARNING and without thresholds no finding fails
+    if status != "PASS":
         message = (
             f"Critical permissions evaluation for IAM Policy {policy_reference} \n\n"
             f"Action triggering policy evaluation: {trigger} \n\n"
@@ -46,13 +113,42 @@ def lambda_handler(event, context):
             f"Event time: {event_time} \n\n"
             f"Target principal: {target} \n\n"
             f"Policy Document: {json.dumps(policy_document, indent=4)} \n\n"
+            f"Validation status: {status} \n\n"
             f"Evaluation: {findings}"
         )
-        subject = "Policy Document Check for Policy Validation"
-        response = client_sns.publish(
-            TopicArn=snstopic,
-            Message=message,
-            Subject=subject,
+        subject = f"Policy Document Check for Policy Validation {status}"
+        issue_codes = sorted({finding["issueCode"] for finding in failed_findings})
+        notifier.notify(
+            "policy_validator",
+            target or useridentity_arn,
+            status,
+            f"{policy_reference} ({trigger}) {', '.join(issue_codes)}",
+            subject,
+            message,
+            event_time=event_time,
+            actor=useridentity_arn,
+            reasons=[
+                f"{finding['findingType']} {finding['issueCode']}: {finding['findingDetails']}"
+                for finding in failed_findings
+            ],
+        )
+        logger.debug("notification message: %s", logs.full(message))
+
+
+def lambda_handler(event, context):
+    """Lambda Handler"""
+    logs.start_invocation()
+    logger.debug("### RAW Event %s", logs.full(event))
+    validations = validate_serialized.cache_info()
+    try:
+        # the findings of every message are sent as soon as it succeeds
+        response = records.process_batch(
+            event, notifier.for_record(process_message), executor, name="policy_validator", context=context
         )
-        logger.info(f"Notification sent: {response}")
-        logger.info(f"notification message: {message}")
+    finally:
+        # hits and misses of the in-memory validation cache during this invocation
+        current = validate_serialized.cache_info()
+        metrics.cache("validation", True, current.hits - validations.hits)
+        metrics.cache("validation", False, current.misses - validations.misses)
+        metrics.flush()
+    return response
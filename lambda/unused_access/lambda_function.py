@@ -1,29 +1,41 @@
-"""Gathers information on roles access history."""
-import boto3
-import logging
+"""Gathers information on roles access history.
+Invoked by EventBridge for a single finding, or by a scheduled rule with
+{"mode": "sweep"} to page through all the findings of the analyzer.
+A finding notified by its event is marked under the sweep prefix, so the
+next sweep does not notify it again. The sweep moves its checkpoint after
+every chunk of notified findings and stops before the function timeout,
+the next sweep notifies the changes that are left.
+"""
+import datetime
+import gzip
 import os
 import json
+import tempfile
+from botocore.exceptions import ClientError
 
-logger = logging.getLogger()
-logger.setLevel(logging.INFO)
+from policy_common import clients, evaluation, logs, metrics, notifications
+
+logger = logs.setup()
+metrics.setup("unused_access")
 
 snstopic = os.environ["SNS_TOPIC_ARN"]
+analyzer_arn = os.environ.get("ANALYZER_ARN")
+sweep_bucket = os.environ.get("SWEEP_BUCKET")
+sweep_prefix = os.environ.get("SWEEP_PREFIX", "unused_access/")
+sweep_status = os.environ.get("SWEEP_STATUS", "ACTIVE")
+# findings detailed and notified between two checkpoints
+sweep_chunk_size = int(os.environ.get("SWEEP_CHUNK_SIZE", 100))
+# time left to the last chunk of a sweep and to the checkpoint
+sweep_time_reserve_seconds = float(os.environ.get("SWEEP_TIME_RESERVE_SECONDS", 60))
 
-client_accessanalyzer = boto3.client("accessanalyzer")
+client_accessanalyzer = clients.lazy("accessanalyzer")
+client_s3 = clients.lazy("s3")
+executor = evaluation.from_environment()
+notifier = notifications.from_environment()
 
-def lambda_handler(event, context):
-    """Lambda Handler"""
-    logger.info(f"### event received {event}")
-    findind_id = event["detail"]["findingId"]
-    analyzer = event["detail"]["resources"][0]
-    response = ""
-    client_sns = boto3.client("sns")
-    logger.info(f"### finding id {findind_id} analyzer {analyzer}")
-    response = client_accessanalyzer.get_finding_v2(
-        analyzerArn=analyzer,
-        id=findind_id,
-    )
-    logger.info(f"### Response {response}")
+
+def notify_finding(analyzer, response, event_time=None):
+    """Notifies a finding returned by GetFindingV2"""
     status = response["status"]
     created_at = response["createdAt"]
     resource_type = response["resourceType"]
@@ -47,10 +59,170 @@ def lambda_handler(event, context):
         f"Finding Details: {finding_details} \n\n"
     )
     subject = "Unused findings"
-    response = client_sns.publish(
-        TopicArn=snstopic,
-        Message=message,
-        Subject=subject,
+    notifier.notify(
+        "unused_access",
+        response.get("resource", resource_owner_account),
+        "UNUSED_ACCESS",
+        f"{finding_type} {findind_id} ({status})",
+        subject,
+        message,
+        event_time=event_time,
+        reasons=[json.dumps(detail, default=str) for detail in finding_details],
+    )
+    logger.debug("notification message: %s", logs.full(message))
+
+
+def notified_prefix():
+    return f"{sweep_prefix}notified/"
+
+
+def mark_notified(response):
+    """Marks a finding notified by its event, with the updatedAt the sweep compares"""
+    if not sweep_bucket:
+        return
+    client_s3.put_object(
+        Bucket=sweep_bucket,
+        Key=f"{notified_prefix()}{response['id']}@{response['updatedAt']}",
+        Body=b"",
+    )
+
+
+def list_notified():
+    """Returns {finding id: updatedAt} of the findings notified by their
+    event since the last sweep, and the keys of their marks
+    """
+    notified = {}
+    keys = []
+    kwargs = {"Bucket": sweep_bucket, "Prefix": notified_prefix()}
+    while True:
+        response = client_s3.list_objects_v2(**kwargs)
+        for s3object in response.get("Contents", []):
+            finding_id, _, updated_at = s3object["Key"][len(notified_prefix()):].partition("@")
+            notified[finding_id] = updated_at
+            keys.append(s3object["Key"])
+        if not response.get("IsTruncated"):
+            return notified, keys
+        kwargs["ContinuationToken"] = response["NextContinuationToken"]
+
+
+def delete_marks(keys):
+    # DeleteObjects accepts up to 1000 keys
+    for offset in range(0, len(keys), 1000):
+        client_s3.delete_objects(
+            Bucket=sweep_bucket,
+            Delete={"Objects": [{"Key": key} for key in keys[offset:offset + 1000]], "Quiet": True},
+        )
+
+
+def list_findings(analyzer):
+    """Yields the summaries of all the findings with the sweep status"""
+    kwargs = {"analyzerArn": analyzer, "filter": {"status": {"eq": [sweep_status]}}}
+    while True:
+        response = executor.call(client_accessanalyzer.list_findings_v2, **kwargs)
+        yield from response["findings"]
+        if not response.get("nextToken"):
+            return
+        kwargs["nextToken"] = response["nextToken"]
+
+
+def load_checkpoint():
+    """Returns {finding id: updatedAt} of the last sweep"""
+    try:
+        s3object = client_s3.get_object(Bucket=sweep_bucket, Key=f"{sweep_prefix}checkpoint.json")
+    except ClientError as _exp:
+        # AccessDenied is raised, not taken for a first sweep notifying every finding
+        if _exp.response["Error"]["Code"] not in ("NoSuchKey", "404"):
+            raise
+        return {}
+    return json.loads(s3object["Body"].read())["findings"]
+
+
+def save_checkpoint(key, findings):
+    client_s3.put_object(
+        Bucket=sweep_bucket,
+        Key=f"{sweep_prefix}checkpoint.json",
+        Body=json.dumps({"sweep": key, "findings": findings}),
     )
-    logger.info(f"Notification sent: {response}")
-    logger.info(f"notification message: {message}")
+
+
+def sweep(analyzer, context=None):
+    """Streams the findings of the analyzer to S3 as gzip JSON Lines and
+    notifies only the findings that are new or changed since the checkpoint
+    or the notification of their event. With the Lambda context the sweep
+    stops when the time left is too short, after saving its progress.
+    """
+    checkpoint = load_checkpoint()
+    notified, notified_keys = list_notified()
+    checkpoint.update(notified)
+    started_at = datetime.datetime.now(datetime.timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+    seen = {}
+    changed = []
+    with tempfile.NamedTemporaryFile(suffix=".jsonl.gz") as fp:
+        with gzip.GzipFile(fileobj=fp, mode="wb") as stream:
+            for summary in list_findings(analyzer):
+                updated_at = str(summary["updatedAt"])
+                seen[summary["id"]] = updated_at
+                if checkpoint.get(summary["id"]) != updated_at:
+                    changed.append(summary["id"])
+                stream.write(json.dumps(summary, default=str).encode("UTF-8") + b"\n")
+        fp.flush()
+        key = f"{sweep_prefix}sweeps/{started_at}.jsonl.gz"
+        client_s3.upload_file(fp.name, sweep_bucket, key)
+    logger.info("### Sweep of %s findings written to s3://%s/%s", len(seen), sweep_bucket, key)
+    logger.info(
+        "### %s findings new or changed since the last sweep, %s notified by their event",
+        len(changed),
+        len(notified),
+    )
+    metrics.count("SweepFindings", len(seen))
+    metrics.count("SweepChangedFindings", len(changed))
+    # the checkpoint holds the notified changes after every chunk, so a sweep
+    # that fails or stops does not notify them again
+    progress = dict(checkpoint)
+    for offset in range(0, len(changed), sweep_chunk_size):
+        if context is not None and context.get_remaining_time_in_millis() < sweep_time_reserve_seconds * 1000:
+            logger.warning("### Sweep stopped before the timeout, %s changes left", len(changed) - offset)
+            metrics.count("SweepChangesLeft", len(changed) - offset)
+            return {"findings": len(seen), "changed": len(changed), "notified": offset, "key": key}
+        chunk = changed[offset:offset + sweep_chunk_size]
+        details = executor.map(
+            lambda finding_id: executor.call(
+                client_accessanalyzer.get_finding_v2, analyzerArn=analyzer, id=finding_id
+            ),
+            chunk,
+        )
+        for response in details:
+            notify_finding(analyzer, response)
+        notifier.flush()
+        progress.update((finding_id, seen[finding_id]) for finding_id in chunk)
+        save_checkpoint(key, progress)
+    # once every change was notified the checkpoint drops the findings that are gone
+    save_checkpoint(key, seen)
+    # the marks are folded into the checkpoint
+    delete_marks(notified_keys)
+    return {"findings": len(seen), "changed": len(changed), "notified": len(changed), "key": key}
+
+
+def lambda_handler(event, context):
+    """Lambda Handler"""
+    logs.start_invocation()
+    logger.debug("### event received %s", logs.full(event))
+    try:
+        if event.get("mode") == "sweep":
+            return sweep(event.get("analyzerArn", analyzer_arn), context)
+        findind_id = event["detail"]["findingId"]
+        analyzer = event["detail"]["resources"][0]
+        logger.info("### finding id %s analyzer %s", findind_id, analyzer)
+        response = executor.call(
+            client_accessanalyzer.get_finding_v2,
+            analyzerArn=analyzer,
+            id=findind_id,
+        )
+        logger.info("### Response %s", logs.payload(response))
+        notify_finding(analyzer, response, event.get("time"))
+        notifier.flush()
+        mark_notified(response)
+    finally:
+        # findings left by a failed invocation are queued again by its retry
+        notifier.discard()
+        metrics.flush()
@@ -8,17 +8,53 @@ from aws_cdk import (
     CfnParameter,
     CustomResource,
     Duration,
+    RemovalPolicy,
     aws_accessanalyzer,
+    aws_cloudwatch,
+    aws_dynamodb,
     aws_sns,
     aws_s3,
     aws_iam,
     aws_lambda,
+    aws_lambda_event_sources,
     aws_events,
     aws_events_targets,
+    aws_sqs,
 )
 
 from constructs import Construct
 
+# thresholds of the policy validator: a JSON list, e.g. ["ERROR"], or a comma
+# separated list of finding types or issue codes, e.g. ERROR,SECURITY_WARNING
+THRESHOLDS_PATTERN = r"^\s*(\[[^\]]*\]|[A-Za-z_]+(\s*,\s*[A-Za-z_]+)*)?\s*$"
+
+
+def lambda_bundling(services=(), requirements=True):
+    """Bundling of a Lambda function or layer asset. Dependencies are installed
+    without caches, tests or __pycache__ directories, botocore keeps only the
+    models of the services the function calls, and the sources are compiled
+    by the runtime interpreter so no module is compiled at cold start.
+    """
+    commands = []
+    if requirements:
+        commands.append("pip install --no-cache -r requirements.txt -t /asset-output")
+    commands += [
+        "cp -au . /asset-output",
+        "find /asset-output \\( -name __pycache__ -o -name tests -o -name '*.pyc' \\) -prune -exec rm -rf {} +",
+    ]
+    if services:
+        keep = " ".join(f"! -name {service}" for service in services)
+        commands.append(
+            "if [ -d /asset-output/botocore/data ]; then "
+            f"find /asset-output/botocore/data -mindepth 1 -maxdepth 1 -type d {keep} -exec rm -rf {{}} +; fi"
+        )
+    # Lambda packages are read only, hash based .pyc stay valid whatever the file timestamps
+    commands.append("python -m compileall -q --invalidation-mode unchecked-hash /asset-output")
+    return BundlingOptions(
+        image=aws_lambda.Runtime.PYTHON_3_11.bundling_image,
+        command=["bash", "-c", " && ".join(commands)],
+    )
+
 
 class CommonStack(Stack):
     def __init__(
@@ -33,16 +69,19 @@ class CommonStack(Stack):
             self,
             "SoftFailParam",
             type="String",
-            description="Soft fail parameter",
+            description="Soft fail parameter, JSON or comma separated list of finding types or issue codes",
             default="[]",
+            allowed_pattern=THRESHOLDS_PATTERN,
         )
 
         hard_fail_param = CfnParameter(
             self,
             "HardFailParam",
             type="String",
-            description="Hard fail parameter",
-            default="[]",
+            description="Hard fail parameter, JSON or comma separated list of finding types or issue codes",
+            # shared by the policy validator function and the IaC scan of the pipeline
+            default='["ERROR", "SECURITY_WARNING"]',
+            allowed_pattern=THRESHOLDS_PATTERN,
         )
 
         sns_topic_name = CfnParameter(
@@ -394,6 +433,53 @@ class CommonStack(Stack):
             encryption=aws_s3.BucketEncryption.S3_MANAGED,
         )
 
+        verdict_cache_table = aws_dynamodb.Table(
+            self,
+            "VerdictCacheTable",
+            partition_key=aws_dynamodb.Attribute(
+                name="cache_key",
+                type=aws_dynamodb.AttributeType.STRING,
+            ),
+            billing_mode=aws_dynamodb.BillingMode.PAY_PER_REQUEST,
+            time_to_live_attribute="expires_at",
+            removal_policy=RemovalPolicy.DESTROY,
+        )
+
+        event_deduplication_table = aws_dynamodb.Table(
+            self,
+            "EventDeduplicationTable",
+            partition_key=aws_dynamodb.Attribute(
+                name="dedup_key",
+                type=aws_dynamodb.AttributeType.STRING,
+            ),
+            billing_mode=aws_dynamodb.BillingMode.PAY_PER_REQUEST,
+            time_to_live_attribute="expires_at",
+            removal_policy=RemovalPolicy.DESTROY,
+        )
+
+        policy_version_table = aws_dynamodb.Table(
+            self,
+            "PolicyVersionTable",
+            partition_key=aws_dynamodb.Attribute(
+                name="policy_version",
+                type=aws_dynamodb.AttributeType.STRING,
+            ),
+            billing_mode=aws_dynamodb.BillingMode.PAY_PER_REQUEST,
+            time_to_live_attribute="expires_at",
+            removal_policy=RemovalPolicy.DESTROY,
+        )
+
+        common_layer = aws_lambda.LayerVersion(
+            self,
+            "CommonLayer",
+            code=aws_lambda.Code.from_asset(
+                "./lambda/common/layer/",
+                bundling=lambda_bundling(requirements=False),
+            ),
+            compatible_runtimes=[aws_lambda.Runtime.PYTHON_3_11],
+            description="Shared modules for the policy evaluation Lambda functions",
+        )
+
         lambda_custom_resource_role_policy = aws_iam.ManagedPolicy(
             self,
             "LambdaCustomResourceRolePolicy",
@@ -421,6 +507,11 @@ class CommonStack(Stack):
                         all_purpose_bucket.bucket_arn
                         + "/"
                         + critical_permissions_file_name.value_as_string,
+                        # action index compiled from the list
+                        all_purpose_bucket.bucket_arn
+                        + "/"
+                        + critical_permissions_file_name.value_as_string
+                        + ".index.json",
                     ],
                 ),
                 aws_iam.PolicyStatement(
@@ -433,6 +524,28 @@ class CommonStack(Stack):
                         "arn:aws:access-analyzer:*:" + Aws.ACCOUNT_ID + ":analyzer/" + analyzer_name.value_as_string
                     ],
                 ),
+                aws_iam.PolicyStatement(
+                    sid="AllowIAMManagedPolicyRead",
+                    effect=aws_iam.Effect.ALLOW,
+                    actions=[
+                        "iam:GetPolicy",
+                        "iam:GetPolicyVersion",
+                    ],
+                    resources=[
+                        "arn:aws:iam::aws:policy/*"
+                    ],
+                ),
+                aws_iam.PolicyStatement(
+                    sid="AllowPolicyVersionCache",
+                    effect=aws_iam.Effect.ALLOW,
+                    actions=[
+                        "dynamodb:GetItem",
+                        "dynamodb:PutItem",
+                    ],
+                    resources=[
+                        policy_version_table.table_arn
+                    ],
+                ),
                 aws_iam.PolicyStatement(
                     sid="AllowAccessAnalyzerServiceLinkedRole",
                     effect=aws_iam.Effect.ALLOW,
@@ -505,6 +618,7 @@ class CommonStack(Stack):
                         "iam:GetUserPolicy",
                         "iam:GetPolicyVersion",
                         "iam:GetPolicy",
+                        "iam:ListPolicyVersions",
                     ],
                     resources=["*"],
                 ),
@@ -515,6 +629,24 @@ class CommonStack(Stack):
                     ],
                     resources=[sns_fan_out_lambdas.topic_arn],
                 ),
+                aws_iam.PolicyStatement(
+                    sid="EventDeduplicationPermissions",
+                    effect=aws_iam.Effect.ALLOW,
+                    actions=[
+                        "dynamodb:PutItem",
+                        "dynamodb:DeleteItem",
+                    ],
+                    resources=[event_deduplication_table.table_arn],
+                ),
+                aws_iam.PolicyStatement(
+                    sid="PolicyVersionCachePermissions",
+                    effect=aws_iam.Effect.ALLOW,
+                    actions=[
+                        "dynamodb:GetItem",
+                        "dynamodb:PutItem",
+                    ],
+                    resources=[policy_version_table.table_arn],
+                ),
             ],
         )
         
@@ -532,18 +664,26 @@ class CommonStack(Stack):
             handler='lambda_function.lambda_handler',
             role=lambda_parse_eventbridge_role,
             timeout=Duration.seconds(60),
+            layers=[common_layer],
             code=aws_lambda.Code.from_asset(
                 "./lambda/common/parse_eventbridge/",
-                bundling=BundlingOptions(
-                    image=aws_lambda.Runtime.PYTHON_3_11.bundling_image,
-                    command=[
-                        "bash", "-c",
-                        "pip install --no-cache -r requirements.txt -t /asset-output && cp -au . /asset-output"
-                    ]
-                )
+                bundling=lambda_bundling(["iam", "sns", "dynamodb"]),
             ),
             environment={
                 "SNS_TOPIC_ARN": sns_fan_out_lambdas.topic_arn,
+                # IAM is a global service with low API quotas
+                "API_TPS": "5",
+                "EVALUATION_MAX_WORKERS": "1",
+                "DEDUP_TABLE": event_deduplication_table.table_name,
+                "DEDUP_WINDOW_SECONDS": "600",
+                "POLICY_VERSION_TABLE": policy_version_table.table_name,
+                "POLICY_VERSION_CACHE_SIZE": "256",
+                "POLICY_CACHE_TTL": "86400",
+                "LOG_LEVEL": "INFO",
+                "LOG_SAMPLE_RATE": "0.1",
+                "LOG_MAX_FIELD_BYTES": "2048",
+                "TRACE_EXPORT": "stdout",
+                "TRACE_SAMPLE_RATE": "0.1",
             },
         )
 
@@ -583,19 +723,23 @@ class CommonStack(Stack):
             handler='lambda_function.lambda_handler',
             role=lambda_custom_resource_role,
             timeout=Duration.seconds(60),
+            layers=[common_layer],
             code=aws_lambda.Code.from_asset(
                 "./lambda/common/custom_resource/",
-                bundling=BundlingOptions(
-                    image=aws_lambda.Runtime.PYTHON_3_11.bundling_image,
-                    command=[
-                        "bash", "-c",
-                        "pip install --no-cache -r requirements.txt -t /asset-output && cp -au . /asset-output"
-                    ]
-                )
+                bundling=lambda_bundling(["s3", "iam", "accessanalyzer", "dynamodb"]),
             ),
             environment={
                 "S3BUCKET": all_purpose_bucket.bucket_name,
-                "S3KEY": critical_permissions_file_name.value_as_string
+                "S3KEY": critical_permissions_file_name.value_as_string,
+                "POLICY_VERSION_TABLE": policy_version_table.table_name,
+                "PRESEED_POLICY_ARNS": ",".join([
+                    "arn:aws:iam::aws:policy/ReadOnlyAccess",
+                    "arn:aws:iam::aws:policy/PowerUserAccess",
+                    "arn:aws:iam::aws:policy/AdministratorAccess",
+                    "arn:aws:iam::aws:policy/AmazonS3ReadOnlyAccess",
+                    "arn:aws:iam::aws:policy/AmazonDynamoDBReadOnlyAccess",
+                    "arn:aws:iam::aws:policy/service-role/AWSLambdaBasicExecutionRole",
+                ]),
             },
         )
 
@@ -605,6 +749,207 @@ class CommonStack(Stack):
             service_token=lambda_custom_resource_function.function_arn,
         )
 
+        # findings are collected over this window before one digest is sent,
+        # at most 300 seconds (SQS event source batching window)
+        digest_window_seconds = int(self.node.try_get_context("digest_window_seconds") or 300)
+
+        digest_dead_letter_queue = aws_sqs.Queue(
+            self,
+            "DigestDeadLetterQueue",
+            encryption=aws_sqs.QueueEncryption.SQS_MANAGED,
+            retention_period=Duration.days(14),
+        )
+
+        digest_queue = aws_sqs.Queue(
+            self,
+            "DigestQueue",
+            encryption=aws_sqs.QueueEncryption.SQS_MANAGED,
+            visibility_timeout=Duration.seconds(360),
+            dead_letter_queue=aws_sqs.DeadLetterQueue(
+                max_receive_count=3,
+                queue=digest_dead_letter_queue,
+            ),
+        )
+
+        lambda_digest_role_policy = aws_iam.ManagedPolicy(
+            self,
+            "LambdaDigestRolePolicy",
+            statements=[
+                aws_iam.PolicyStatement(
+                    sid="CloudWatchLogsWritePermissions",
+                    effect=aws_iam.Effect.ALLOW,
+                    actions=[
+                        "logs:CreateLogGroup",
+                        "logs:CreateLogStream",
+                        "logs:PutLogEvents",
+                    ],
+                    resources=[
+                        "arn:aws:logs:" + Aws.REGION + ":" + Aws.ACCOUNT_ID + ":log-group:/*"
+                    ],
+                ),
+                aws_iam.PolicyStatement(
+                    sid="SNSPublishAllow",
+                    effect=aws_iam.Effect.ALLOW,
+                    actions=[
+                        "sns:Publish",
+                    ],
+                    resources=[sns_topic.topic_arn],
+                ),
+            ],
+        )
+
+        lambda_digest_role = aws_iam.Role(
+            self,
+            "LambdaDigestRole",
+            assumed_by=aws_iam.ServicePrincipal(service="lambda.amazonaws.com"),
+            managed_policies=[lambda_digest_role_policy],
+        )
+
+        lambda_function_digest = aws_lambda.Function(
+            scope=self,
+            id="LambdaFunctionDigest",
+            runtime=aws_lambda.Runtime.PYTHON_3_11,
+            handler='lambda_function.lambda_handler',
+            role=lambda_digest_role,
+            timeout=Duration.seconds(60),
+            layers=[common_layer],
+            code=aws_lambda.Code.from_asset(
+                "./lambda/common/digest/",
+                bundling=lambda_bundling(["sns"]),
+            ),
+            environment={
+                "SNS_TOPIC_ARN": sns_topic.topic_arn,
+                "DIGEST_WINDOW_SECONDS": str(digest_window_seconds),
+                "DIGEST_MAX_SUMMARIES": "20",
+                "DIGEST_MAX_REASONS": "5",
+            },
+        )
+
+        lambda_function_digest.add_event_source(
+            aws_lambda_event_sources.SqsEventSource(
+                digest_queue,
+                batch_size=1000,
+                max_batching_window=Duration.seconds(digest_window_seconds),
+                report_batch_item_failures=True,
+            )
+        )
+
+        # embedded metrics printed by the functions, see policy_common/metrics.py
+        metrics_namespace = "IAMPolicyEvaluation"
+        metrics_period = Duration.minutes(1)
+
+        def search(metric_name, dimensions, statistic, label=None):
+            """All the series of a metric, e.g. one per function and operation"""
+            return aws_cloudwatch.MathExpression(
+                expression=(
+                    f"SEARCH('{{{metrics_namespace},{','.join(dimensions)}}} "
+                    f"MetricName=\"{metric_name}\"', '{statistic}', {int(metrics_period.to_seconds())})"
+                ),
+                using_metrics={},
+                label=label,
+                period=metrics_period,
+            )
+
+        def metric(metric_name, function, statistic="Sum", **dimensions):
+            return aws_cloudwatch.Metric(
+                namespace=metrics_namespace,
+                metric_name=metric_name,
+                dimensions_map=dict(Function=function, **dimensions),
+                statistic=statistic,
+                period=metrics_period,
+                label=f"{function} {metric_name} {statistic}",
+            )
+
+        def hit_ratio(function, cache):
+            return aws_cloudwatch.MathExpression(
+                expression="100 * hits / (hits + misses)",
+                using_metrics={
+                    "hits": metric("CacheHits", function, Cache=cache),
+                    "misses": metric("CacheMisses", function, Cache=cache),
+                },
+                label=f"{function} {cache}",
+                period=metrics_period,
+            )
+
+        checkers = ["custom_policy_checks", "policy_validator"]
+        aws_cloudwatch.Dashboard(
+            self,
+            "PolicyEvaluationDashboard",
+            dashboard_name=f"IAMPolicyEvaluation-{Aws.REGION}",
+            widgets=[
+                [
+                    aws_cloudwatch.GraphWidget(
+                        title="API calls by operation",
+                        left=[search("ApiCalls", ["Function", "Operation"], "Sum")],
+                        width=8,
+                    ),
+                    aws_cloudwatch.GraphWidget(
+                        title="API latency p99 by operation (ms)",
+                        left=[search("ApiLatency", ["Function", "Operation"], "p99")],
+                        width=8,
+                    ),
+                    aws_cloudwatch.GraphWidget(
+                        title="Throttles and errors by operation",
+                        left=[
+                            search("Throttles", ["Function", "Operation"], "Sum", "throttled"),
+                            search("ApiErrors", ["Function", "Operation"], "Sum", "failed"),
+                        ],
+                        width=8,
+                    ),
+                ],
+                [
+                    aws_cloudwatch.GraphWidget(
+                        title="Cache hit ratio (%)",
+                        left=[
+                            hit_ratio("parse_eventbridge", "policy_version"),
+                            hit_ratio("custom_policy_checks", "verdict"),
+                            hit_ratio("policy_validator", "verdict"),
+                            hit_ratio("policy_validator", "validation"),
+                        ],
+                        left_y_axis=aws_cloudwatch.YAxisProps(min=0, max=100),
+                        width=8,
+                    ),
+                    aws_cloudwatch.GraphWidget(
+                        title="Events, documents evaluated and findings",
+                        left=[
+                            search("EventsReceived", ["Function", "Action"], "Sum"),
+                            search("DuplicatesSuppressed", ["Function", "Reason"], "Sum", "duplicates"),
+                        ]
+                        + [metric("DocumentsEvaluated", function) for function in checkers],
+                        right=[
+                            search("FindingsEmitted", ["Function", "Severity"], "Sum", "findings"),
+                            search("BuildResults", ["Function", "Status"], "Sum", "builds"),
+                        ],
+                        width=8,
+                    ),
+                    aws_cloudwatch.GraphWidget(
+                        title="Lag from CloudTrail eventTime (ms)",
+                        left=[
+                            metric("FanOutLag", "parse_eventbridge", "p50"),
+                            metric("FanOutLag", "parse_eventbridge", "p99"),
+                        ]
+                        + [
+                            metric("NotificationLag", function, statistic)
+                            for function in checkers
+                            for statistic in ("p50", "p99")
+                        ],
+                        width=8,
+                    ),
+                ],
+                [
+                    aws_cloudwatch.GraphWidget(
+                        title="Queue wait and processing time p99 by function (ms)",
+                        left=[
+                            metric(metric_name, function, "p99")
+                            for metric_name in ("QueueWait", "ProcessingTime")
+                            for function in ["parse_eventbridge"] + checkers
+                        ],
+                        width=24,
+                    ),
+                ],
+            ],
+        )
+
         CfnOutput(
             self,
             "BucketArn",
@@ -645,4 +990,7 @@ class CommonStack(Stack):
         self.critical_permissions_file_name = critical_permissions_file_name.value_as_string
         self.sns_fan_out_lambdas = sns_fan_out_lambdas
         self.soft_fail_param = soft_fail_param
-        self.hard_fail_param = hard_fail_param
\ No newline at end of file
+        self.hard_fail_param = hard_fail_param
+        self.common_layer = common_layer
+        self.verdict_cache_table = verdict_cache_table
+        self.digest_queue = digest_queue
\ No newline at end of file
@@ -2,16 +2,19 @@
 # SPDX-License-Identifier: MIT-0
 from aws_cdk import (
     Aws,
-    BundlingOptions,
     Stack,
     CfnOutput,
     Duration,
     aws_lambda,
     aws_lambda_event_sources,
     aws_iam,
+    aws_sns_subscriptions,
+    aws_sqs,
 )
 from constructs import Construct
 
+from stack_common import lambda_bundling
+
 
 class CustomPolicyChecksStack(Stack):
     def __init__(
@@ -22,6 +25,9 @@ class CustomPolicyChecksStack(Stack):
         s3key,
         snstopic,
         snsfanoutlambdas,
+        commonlayer,
+        verdictcachetable,
+        digestqueue,
         **kwargs
     ) -> None:
         super().__init__(scope, construct_id, **kwargs)
@@ -52,7 +58,10 @@ class CustomPolicyChecksStack(Stack):
                     actions=[
                         "s3:GetObject",
                     ],
-                    resources=[s3bucket.bucket_arn + "/" + s3key],
+                    resources=[
+                        s3bucket.bucket_arn + "/" + s3key,
+                        s3bucket.bucket_arn + "/" + s3key + ".index.json",
+                    ],
                 ),
                 aws_iam.PolicyStatement(
                     sid="SNSPublishAllow",
@@ -62,6 +71,23 @@ class CustomPolicyChecksStack(Stack):
                     ],
                     resources=[snstopic.topic_arn],
                 ),
+                aws_iam.PolicyStatement(
+                    sid="DigestQueueSendPermissions",
+                    effect=aws_iam.Effect.ALLOW,
+                    actions=[
+                        "sqs:SendMessage",
+                    ],
+                    resources=[digestqueue.queue_arn],
+                ),
+                aws_iam.PolicyStatement(
+                    sid="VerdictCachePermissions",
+                    effect=aws_iam.Effect.ALLOW,
+                    actions=[
+                        "dynamodb:GetItem",
+                        "dynamodb:PutItem",
+                    ],
+                    resources=[verdictcachetable.table_arn],
+                ),
                 aws_iam.PolicyStatement(
                     sid="AccessAnalyzerPermissions",
                     effect=aws_iam.Effect.ALLOW,
@@ -87,25 +113,68 @@ class CustomPolicyChecksStack(Stack):
             handler='lambda_function.lambda_handler',
             code=aws_lambda.Code.from_asset(
                 "./lambda/custom_policy_checks/",
-                bundling=BundlingOptions(
-                    image=aws_lambda.Runtime.PYTHON_3_11.bundling_image,
-                    command=[
-                        "bash", "-c",
-                        "pip install --no-cache -r requirements.txt -t /asset-output && cp -au . /asset-output"
-                    ]
-                )
+                bundling=lambda_bundling(["s3", "sns", "sqs", "accessanalyzer", "dynamodb"]),
             ),
-            timeout=Duration.seconds(60),
+            # a batch of 10 messages processed one by one, a broad policy costs
+            # up to ~80 CheckAccessNotGranted calls at API_TPS
+            timeout=Duration.seconds(180),
             role=lambda_custom_policy_checks_role,
+            layers=[commonlayer],
             environment={
                 "SNS_TOPIC_ARN": snstopic.topic_arn,
                 "BUCKET":  s3bucket.bucket_name,
                 "KEY":  s3key,
+                "ACTIONS_BATCH_SIZE": "100",
+                "PREFILTER_VERIFY": "false",
+                "PRIVILEGED_REFRESH_SECONDS": "300",
+                "VERDICT_CACHE_TABLE": verdictcachetable.table_name,
+                "VERDICT_CACHE_TTL": "86400",
+                "API_TPS": "10",
+                "EVALUATION_MAX_WORKERS": "8",
+                "DIGEST_QUEUE_URL": digestqueue.queue_url,
+                "BATCH_TIME_RESERVE_SECONDS": "30",
+                "LOG_LEVEL": "INFO",
+                "LOG_SAMPLE_RATE": "0.1",
+                "LOG_MAX_FIELD_BYTES": "2048",
+                "TRACE_EXPORT": "stdout",
+                "TRACE_SAMPLE_RATE": "0.1",
             }
         )
 
+        custom_policy_checks_dead_letter_queue = aws_sqs.Queue(
+            self,
+            "CustomPolicyChecksDeadLetterQueue",
+            encryption=aws_sqs.QueueEncryption.SQS_MANAGED,
+            retention_period=Duration.days(14),
+        )
+
+        # buffers the fan-out messages so each invocation evaluates a batch of policies
+        custom_policy_checks_queue = aws_sqs.Queue(
+            self,
+            "CustomPolicyChecksQueue",
+            encryption=aws_sqs.QueueEncryption.SQS_MANAGED,
+            # six times the function timeout
+            visibility_timeout=Duration.seconds(1080),
+            dead_letter_queue=aws_sqs.DeadLetterQueue(
+                max_receive_count=3,
+                queue=custom_policy_checks_dead_letter_queue,
+            ),
+        )
+
+        snsfanoutlambdas.add_subscription(
+            aws_sns_subscriptions.SqsSubscription(
+                custom_policy_checks_queue,
+                raw_message_delivery=True,
+            )
+        )
+
         lambda_custom_policy_checks_function.add_event_source(
-            aws_lambda_event_sources.SnsEventSource(snsfanoutlambdas)
+            aws_lambda_event_sources.SqsEventSource(
+                custom_policy_checks_queue,
+                batch_size=10,
+                max_batching_window=Duration.seconds(5),
+                report_batch_item_failures=True,
+            )
         )
 
         CfnOutput(
@@ -3,8 +3,8 @@
 from aws_cdk import (
     Aws,
     Stack,
-    BundlingOptions,
     Duration,
+    RemovalPolicy,
     aws_iam,
     aws_codebuild,
     aws_codecommit,
@@ -13,9 +13,12 @@ from aws_cdk import (
     aws_sns,
     aws_lambda,
     aws_lambda_event_sources,
+    aws_s3,
 )
 from constructs import Construct
 
+from stack_common import lambda_bundling
+
 
 class PipelineStack(Stack):
     def __init__(
@@ -25,6 +28,9 @@ class PipelineStack(Stack):
         snstopic,
         softfailparam,
         hardfailparam,
+        commonlayer,
+        s3bucket,
+        s3key,
         **kwargs
     ) -> None:
         super().__init__(scope, construct_id, **kwargs)
@@ -36,6 +42,19 @@ class PipelineStack(Stack):
             code=aws_codecommit.Code.from_directory("iac", "main"),
         )
 
+        # pip, npm and AWS CLI downloads kept between builds, and the manifest of
+        # the policy findings of the last green build, rescanned in full once expired
+        iac_scan_cache_bucket = aws_s3.Bucket(
+            self,
+            "IacScanCacheBucket",
+            block_public_access=aws_s3.BlockPublicAccess.BLOCK_ALL,
+            encryption=aws_s3.BucketEncryption.S3_MANAGED,
+            enforce_ssl=True,
+            removal_policy=RemovalPolicy.DESTROY,
+            auto_delete_objects=True,
+            lifecycle_rules=[aws_s3.LifecycleRule(expiration=Duration.days(30))],
+        )
+
         iac_scan = aws_codebuild.Project(
             self,
             "IacScan",
@@ -55,51 +74,90 @@ class PipelineStack(Stack):
                     "HARD_FAIL": aws_codebuild.BuildEnvironmentVariable(
                         value=hardfailparam.value_as_string
                     ),
+                    # privileged actions list of the custom policy checks
+                    "PRIVILEGED_BUCKET": aws_codebuild.BuildEnvironmentVariable(
+                        value=s3bucket.bucket_name
+                    ),
+                    "PRIVILEGED_KEY": aws_codebuild.BuildEnvironmentVariable(
+                        value=s3key
+                    ),
+                    "MANIFEST_BUCKET": aws_codebuild.BuildEnvironmentVariable(
+                        value=iac_scan_cache_bucket.bucket_name
+                    ),
+                    "MANIFEST_KEY": aws_codebuild.BuildEnvironmentVariable(
+                        value="manifests/iac_scan.json"
+                    ),
+                    "PIP_CACHE_DIR": aws_codebuild.BuildEnvironmentVariable(
+                        value="/root/.cache/pip"
+                    ),
+                    "PIP_DISABLE_PIP_VERSION_CHECK": aws_codebuild.BuildEnvironmentVariable(
+                        value="1"
+                    ),
+                    "npm_config_cache": aws_codebuild.BuildEnvironmentVariable(
+                        value="/root/.npm"
+                    ),
                 },
             ),
+            cache=aws_codebuild.Cache.bucket(iac_scan_cache_bucket, prefix="iac_scan"),
             source=aws_codebuild.Source.code_commit(
                 repository=code_repository, branch_or_ref="main"
             ),
             build_spec=aws_codebuild.BuildSpec.from_object(
                 {
-                    "version": "0.1",
+                    # 0.2 runs the commands in one shell, the virtual environment stays active
+                    "version": "0.2",
                     "phases": {
                         "install": {
                             "commands": [
-                                "curl https://awscli.amazonaws.com/awscli-exe-linux-x86_64.zip -o awscliv2.zip",
-                                "unzip awscliv2.zip",
-                                "sudo ./aws/install --bin-dir /usr/local/bin --install-dir /usr/local/aws-cli --update",
+                                # the build image ships AWS CLI v2, the installer is only a fallback
+                                "aws --version 2>&1 | grep -q '^aws-cli/2' || ("
+                                " mkdir -p /root/.cache/awscli"
+                                " && cd /root/.cache/awscli"
+                                " && (test -f awscliv2.zip"
+                                " || curl -sS https://awscli.amazonaws.com/awscli-exe-linux-x86_64.zip -o awscliv2.zip)"
+                                " && unzip -qo awscliv2.zip"
+                                " && sudo ./aws/install --bin-dir /usr/local/bin --install-dir /usr/local/aws-cli --update)",
                                 "export PATH=/usr/local/bin:$PATH",
-                                "npm i",
-                                "npm install -g aws-cdk",
+                                # aws-cdk is a dependency in package.json, npx runs the local copy
+                                "npm install --prefer-offline --no-audit --no-fund",
                                 "npx cdk version",
                                 "python -m venv .venv",
                                 ". .venv/bin/activate",
                                 "python --version",
-                                "pip install -r requirements.txt",
-                                "pip install boto3==1.33.0",
-                                "pip install cfn-policy-validator==0.0.25",
-                                "pip list",
+                                "pip install --prefer-binary -r requirements.txt boto3==1.33.0 cfn-policy-validator==0.0.25",
                             ]
                         },
                         "build": {
                             "commands": [
-                                "npx cdk synth > ./iac.yaml",
+                                ". .venv/bin/activate",
+                                # the template is synthesized in-process by the CDK app, without the CDK CLI
+                                "python synth_template.py --output iac.yaml",
                                 "echo 'call cfn-policy-validator to extract policies and roles'",
                                 "cfn-policy-validator parse --template-path ./iac.yaml --region ${AWS_REGION} > iac_iam_parsed.json",
-                                "cat iac_iam_parsed.json | jq -r '.Roles[].Policies[].Policy' > policy.json",
-                                "echo 'call access analyzer to validate policy'",
-                                ## add your commands here 
-                                "echo 'call custom policy checks'",
-                                ## add your commands here
+                                "echo 'call access analyzer and custom policy checks for every policy'",
+                                # a reference policy, when committed, enables CheckNoNewAccess
+                                "python scan_policies.py --parsed iac_iam_parsed.json --report iac_scan_report.json"
+                                " $( [ -f reference_policy.json ] && echo --reference-policy reference_policy.json )",
                             ]  
                         },  
                     },  
+                    "artifacts": {
+                        "files": ["iac_scan_report.json"],
+                    },
+                    "cache": {
+                        "paths": [
+                            "/root/.cache/pip/**/*",
+                            "/root/.npm/**/*",
+                            "/root/.cache/awscli/awscliv2.zip",
+                        ]
+                    },
                 }
             ),
         )
 
         code_repository.grant_pull(iac_scan)
+        s3bucket.grant_read(iac_scan, s3key)
+        iac_scan_cache_bucket.grant_read_write(iac_scan, "manifests/*")
 
         iac_scan.add_to_role_policy(
             aws_iam.PolicyStatement(
@@ -113,6 +171,7 @@ class PipelineStack(Stack):
                     "access-analyzer:ListAccessPreviewFindings",
                     "access-analyzer:CreateAnalyzer",
                     "access-analyzer:CheckAccessNotGranted",
+                    "access-analyzer:CheckNoNewAccess",
                     "s3:ListAllMyBuckets",
                     "cloudformation:ListExports",
                     "ssm:GetParameter",
@@ -193,15 +252,10 @@ class PipelineStack(Stack):
             handler='lambda_function.lambda_handler',
             role=lambda_pipeline_notification_role,
             timeout=Duration.seconds(60),
+            layers=[commonlayer],
             code=aws_lambda.Code.from_asset(
                 "./lambda/pipeline/",
-                bundling=BundlingOptions(
-                    image=aws_lambda.Runtime.PYTHON_3_11.bundling_image,
-                    command=[
-                        "bash", "-c",
-                        "pip install --no-cache -r requirements.txt -t /asset-output && cp -au . /asset-output"
-                    ]
-                )
+                bundling=lambda_bundling(["sns"]),
             ),
             environment={
                 "SNS_TOPIC_ARN": snstopic.topic_arn,
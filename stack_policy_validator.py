@@ -8,10 +8,13 @@ from aws_cdk import (
     aws_lambda,
     aws_lambda_event_sources,
     aws_iam,
-    BundlingOptions,
+    aws_sns_subscriptions,
+    aws_sqs,
 )
 from constructs import Construct
 
+from stack_common import lambda_bundling
+
 
 class PolicyValidatorStack(Stack):
     def __init__(
@@ -22,6 +25,9 @@ class PolicyValidatorStack(Stack):
             snsfanoutlambdas,
             softfailparam,
             hardfailparam,
+            commonlayer,
+            verdictcachetable,
+            digestqueue,
             **kwargs
     ) -> None:
         super().__init__(scope, construct_id, **kwargs)
@@ -55,7 +61,24 @@ class PolicyValidatorStack(Stack):
                         "sns:Publish",
                     ],
                     resources=[snstopic.topic_arn],
-                )
+                ),
+                aws_iam.PolicyStatement(
+                    sid="DigestQueueSendPermissions",
+                    effect=aws_iam.Effect.ALLOW,
+                    actions=[
+                        "sqs:SendMessage",
+                    ],
+                    resources=[digestqueue.queue_arn],
+                ),
+                aws_iam.PolicyStatement(
+                    sid="VerdictCachePermissions",
+                    effect=aws_iam.Effect.ALLOW,
+                    actions=[
+                        "dynamodb:GetItem",
+                        "dynamodb:PutItem",
+                    ],
+                    resources=[verdictcachetable.table_arn],
+                ),
             ]
         )
 
@@ -71,17 +94,13 @@ class PolicyValidatorStack(Stack):
             "LambdaPolicyValidatorFunction",
             runtime=aws_lambda.Runtime.PYTHON_3_11,
             handler="lambda_function.lambda_handler",
-            timeout=Duration.seconds(60),
+            # a batch of 10 messages, their ValidatePolicy pages are rate limited by API_TPS
+            timeout=Duration.seconds(180),
             role=lambda_policy_validator_role,
+            layers=[commonlayer],
             code=aws_lambda.Code.from_asset(
                 "./lambda/policy_validator/",
-                bundling=BundlingOptions(
-                    image=aws_lambda.Runtime.PYTHON_3_11.bundling_image,
-                    command=[
-                        "bash", "-c",
-                        "pip install --no-cache -r requirements.txt -t /asset-output && cp -au . /asset-output"
-                    ]
-                )
+                bundling=lambda_bundling(["sns", "sqs", "accessanalyzer", "dynamodb"]),
             ),
             environment={
                 "REGION": str(Aws.REGION),
@@ -89,12 +108,55 @@ class PolicyValidatorStack(Stack):
                 "SNS_TOPIC_ARN": snstopic.topic_arn,
                 "SOFT_FAIL": softfailparam.value_as_string,
                 "HARD_FAIL": hardfailparam.value_as_string,
+                "VALIDATION_CACHE_SIZE": "256",
+                "VERDICT_CACHE_TABLE": verdictcachetable.table_name,
+                "VERDICT_CACHE_TTL": "86400",
+                "API_TPS": "10",
+                "EVALUATION_MAX_WORKERS": "8",
+                "DIGEST_QUEUE_URL": digestqueue.queue_url,
+                "BATCH_TIME_RESERVE_SECONDS": "30",
+                "LOG_LEVEL": "INFO",
+                "LOG_SAMPLE_RATE": "0.1",
+                "LOG_MAX_FIELD_BYTES": "2048",
+                "TRACE_EXPORT": "stdout",
+                "TRACE_SAMPLE_RATE": "0.1",
             },
         )
 
+        policy_validator_dead_letter_queue = aws_sqs.Queue(
+            self,
+            "PolicyValidatorDeadLetterQueue",
+            encryption=aws_sqs.QueueEncryption.SQS_MANAGED,
+            retention_period=Duration.days(14),
+        )
+
+        # buffers the fan-out messages so each invocation evaluates a batch of policies
+        policy_validator_queue = aws_sqs.Queue(
+            self,
+            "PolicyValidatorQueue",
+            encryption=aws_sqs.QueueEncryption.SQS_MANAGED,
+            # six times the function timeout
+            visibility_timeout=Duration.seconds(1080),
+            dead_letter_queue=aws_sqs.DeadLetterQueue(
+                max_receive_count=3,
+                queue=policy_validator_dead_letter_queue,
+            ),
+        )
+
+        snsfanoutlambdas.add_subscription(
+            aws_sns_subscriptions.SqsSubscription(
+                policy_validator_queue,
+                raw_message_delivery=True,
+            )
+        )
+
         lambda_policy_validator_function.add_event_source(
-            aws_lambda_event_sources.SnsEventSource(
-                snsfanoutlambdas)
+            aws_lambda_event_sources.SqsEventSource(
+                policy_validator_queue,
+                batch_size=10,
+                max_batching_window=Duration.seconds(5),
+                report_batch_item_failures=True,
+            )
         )
 
         CfnOutput(
@@ -2,20 +2,27 @@
 # SPDX-License-Identifier: MIT-0
 from aws_cdk import (
     Aws,
-    BundlingOptions,
     Stack,
     CfnOutput,
     Duration,
     aws_lambda,
     aws_iam,
+    aws_events,
+    aws_events_targets,
 )
 from constructs import Construct
 
+from stack_common import lambda_bundling
+
 
 class UnusedAccessStack(Stack):
-    def __init__(self, scope: Construct, construct_id: str, snstopic, **kwargs) -> None:
+    def __init__(self, scope: Construct, construct_id: str, s3bucket, snstopic, commonlayer, digestqueue, **kwargs) -> None:
         super().__init__(scope, construct_id, **kwargs)
 
+        # analyzer created by the custom resource of the CommonStack
+        analyzer_arn = "arn:aws:access-analyzer:" + Aws.REGION + ":" + Aws.ACCOUNT_ID + ":analyzer/workshop-analyzer"
+        sweep_prefix = "unused_access/"
+
         lambda_unused_access_role_policy = aws_iam.ManagedPolicy(
             self,
             "LambdaUnusedAccessRolePolicy",
@@ -54,14 +61,44 @@ class UnusedAccessStack(Stack):
                     ],
                     resources=[snstopic.topic_arn],
                 ),
+                aws_iam.PolicyStatement(
+                    sid="DigestQueueSendPermissions",
+                    effect=aws_iam.Effect.ALLOW,
+                    actions=[
+                        "sqs:SendMessage",
+                    ],
+                    resources=[digestqueue.queue_arn],
+                ),
                 aws_iam.PolicyStatement(
                     sid="AccessAnalyzerPermissions",
                     effect=aws_iam.Effect.ALLOW,
                     actions=[
                         "access-analyzer:GetFinding",
+                        "access-analyzer:GetFindingV2",
+                        "access-analyzer:ListFindingsV2",
                     ],
                     resources=["*"],
                 ),
+                aws_iam.PolicyStatement(
+                    sid="SweepBucketPermissions",
+                    effect=aws_iam.Effect.ALLOW,
+                    actions=[
+                        "s3:GetObject",
+                        "s3:PutObject",
+                        "s3:DeleteObject",
+                    ],
+                    resources=[s3bucket.bucket_arn + "/" + sweep_prefix + "*"],
+                ),
+                aws_iam.PolicyStatement(
+                    sid="SweepBucketListPermissions",
+                    effect=aws_iam.Effect.ALLOW,
+                    actions=[
+                        "s3:ListBucket",
+                    ],
+                    # without ListBucket S3 answers AccessDenied instead of
+                    # NoSuchKey for the first checkpoint
+                    resources=[s3bucket.bucket_arn],
+                ),
             ],
         )
 
@@ -79,21 +116,44 @@ class UnusedAccessStack(Stack):
             handler='lambda_function.lambda_handler',
             code=aws_lambda.Code.from_asset(
                 "./lambda/unused_access/",
-                bundling=BundlingOptions(
-                    image=aws_lambda.Runtime.PYTHON_3_11.bundling_image,
-                    command=[
-                        "bash", "-c",
-                        "pip install --no-cache -r requirements.txt -t /asset-output && cp -au . /asset-output"
-                    ]
-                )
+                bundling=lambda_bundling(["s3", "sns", "sqs", "accessanalyzer"]),
             ),
-            timeout=Duration.seconds(60),
+            # a sweep pages through every finding of the analyzer
+            timeout=Duration.seconds(600),
             role=lambda_unused_access_role,
+            layers=[commonlayer],
             environment={
                 "SNS_TOPIC_ARN": snstopic.topic_arn,
+                "API_TPS": "10",
+                "EVALUATION_MAX_WORKERS": "4",
+                "ANALYZER_ARN": analyzer_arn,
+                "SWEEP_BUCKET": s3bucket.bucket_name,
+                "SWEEP_PREFIX": sweep_prefix,
+                "SWEEP_STATUS": "ACTIVE",
+                "SWEEP_CHUNK_SIZE": "100",
+                "SWEEP_TIME_RESERVE_SECONDS": "60",
+                "DIGEST_QUEUE_URL": digestqueue.queue_url,
+                "LOG_LEVEL": "INFO",
+                "LOG_SAMPLE_RATE": "0.1",
+                "LOG_MAX_FIELD_BYTES": "2048",
             },
         )
 
+        sweep_rule = aws_events.Rule(
+            self,
+            "UnusedAccessSweepRule",
+            schedule=aws_events.Schedule.rate(
+                Duration.minutes(int(self.node.try_get_context("unused_access_sweep_minutes") or 360))
+            ),
+        )
+
+        sweep_rule.add_target(
+            aws_events_targets.LambdaFunction(
+                lambda_unused_access_function,
+                event=aws_events.RuleTargetInput.from_object({"mode": "sweep"}),
+            ),
+        )
+
         CfnOutput(
             self,
             "LambdaUnusedAccessFunctionArn",
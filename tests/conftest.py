@@ -0,0 +1,7 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+import pathlib
+import sys
+
+# the policy_common package of the Lambda layer
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent / "lambda" / "common" / "layer" / "python"))
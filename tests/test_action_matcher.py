@@ -0,0 +1,93 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+import pytest
+
+from policy_common import action_matcher
+
+ACTIONS = [
+    "iam:PassRole",
+    "iam:PutRolePolicy",
+    "iam:PutUserPolicy",
+    "iam:CreateAccessKey",
+    "iam:CreateUser",
+    "s3:PutBucketPolicy",
+    "s3:GetObject",
+    "ec2:RunInstances",
+    "lambda:UpdateFunctionCode",
+    "kms:Decrypt",
+]
+
+
+def expected(policy_document):
+    """Actions granted according to the regular expression matcher"""
+    return [
+        action
+        for action in ACTIONS
+        if any(
+            action_matcher.statement_grants(statement, action)
+            for statement in action_matcher.statements(policy_document)
+        )
+    ]
+
+
+@pytest.mark.parametrize(
+    "pattern",
+    [
+        "*",
+        "iam:*",
+        "IAM:put*",
+        "iam:Put?olePolicy",
+        "iam:Put*Policy",
+        "iam:*Access*",
+        "*:Put*",
+        "s?:*",
+        "iam:?",
+        "iam:PassRole*",
+        "iam:passrole",
+        "ec2:Run*s",
+        "unknown:*",
+        "iam:",
+        "iam",
+    ],
+)
+def test_trie_matches_compile_pattern(pattern):
+    index = action_matcher.ActionIndex(ACTIONS)
+    statement = {"Effect": "Allow", "Action": pattern, "Resource": "*"}
+    document = {"Statement": [statement]}
+    assert index.candidates(document) == expected(document)
+    assert index.candidates(document) == [
+        action for action in ACTIONS if action_matcher.compile_pattern(pattern).match(action)
+    ]
+
+
+@pytest.mark.parametrize(
+    "not_action",
+    [["iam:*"], ["*"], ["iam:Pass?ole", "s3:*"], "kms:Decrypt"],
+)
+def test_not_action(not_action):
+    index = action_matcher.ActionIndex(ACTIONS)
+    document = {"Statement": [{"Effect": "Allow", "NotAction": not_action, "Resource": "*"}]}
+    assert index.candidates(document) == expected(document)
+
+
+def test_deny_statements_grant_nothing():
+    document = {"Statement": [{"Effect": "Deny", "Action": "*", "Resource": "*"}]}
+    assert action_matcher.candidate_actions(document, ACTIONS) == []
+
+
+def test_single_statement_object():
+    document = {"Version": "2012-10-17", "Statement": {"Effect": "Allow", "Action": "*", "Resource": "*"}}
+    assert action_matcher.candidate_actions(document, ACTIONS) == ACTIONS
+    assert action_matcher.ActionIndex(ACTIONS).candidates(document) == ACTIONS
+
+
+@pytest.mark.parametrize("document", [None, "*", {}, {"Statement": "*"}, {"Statement": ["*", 1]}])
+def test_malformed_documents_grant_nothing(document):
+    assert action_matcher.candidate_actions(document, ACTIONS) == []
+
+
+def test_index_round_trip():
+    index, etag = action_matcher.ActionIndex.from_json(action_matcher.ActionIndex(ACTIONS).to_json('"etag"'))
+    assert etag == '"etag"'
+    document = {"Statement": [{"Effect": "Allow", "Action": ["iam:Put*", "s3:Get*"], "Resource": "*"}]}
+    assert index.candidates(document) == expected(document)
@@ -0,0 +1,52 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+import pytest
+
+from policy_common import canonical
+
+
+def test_layouts_hash_the_same():
+    document = {
+        "Version": "2012-10-17",
+        "Statement": [
+            {"Sid": "B", "Effect": "Allow", "Action": "S3:GetObject", "Resource": "arn:aws:s3:::bucket/*"},
+            {"Sid": "A", "Effect": "Allow", "Action": ["s3:PutObject", "s3:GetObject"], "Resource": ["arn:aws:s3:::bucket/*"]},
+        ],
+    }
+    merged = {
+        "Version": "2012-10-17",
+        "Statement": {"Sid": "A", "Effect": "Allow", "Action": ["s3:PutObject", "s3:GetObject"], "Resource": "arn:aws:s3:::bucket/*"},
+    }
+    assert canonical.document_hash(document) == canonical.document_hash(merged)
+    assert canonical.submitted_hash(document) != canonical.submitted_hash(merged)
+
+
+@pytest.mark.parametrize(
+    "document",
+    [
+        None,
+        "policy",
+        {},
+        {"Version": "2012-10-17"},
+        {"Statement": "*"},
+        {"Statement": ["*", 1, None]},
+        {"Statement": {"Effect": "Allow", "Action": 5, "Resource": "*"}},
+        {"Statement": [{"Effect": "Allow", "Action": [{"iam": "*"}], "Resource": "*"}]},
+        {"Statement": [{"Effect": "Allow", "Action": "*", "Resource": "*", "Condition": {"Bool": "true"}}]},
+        {"Statement": [{"Effect": "Allow", "Action": "*", "Resource": "*", "Condition": ["x"]}]},
+        {"Statement": [{"Sid": 1, "Effect": "Allow", "Action": "s3:*"}, {"Sid": "a", "Effect": "Allow", "Action": "s3:*"}]},
+    ],
+)
+def test_malformed_documents_are_kept(document):
+    canonical_document = canonical.canonicalize(document)
+    # idempotent, and hashable whatever the shape
+    assert canonical.canonicalize(canonical_document) == canonical_document
+    assert canonical.document_hash(document) == canonical.document_hash(canonical_document)
+
+
+def test_malformed_elements_are_not_dropped():
+    document = {"Statement": ["*", {"Effect": "Allow", "Action": 5, "Condition": {"Bool": "true"}}]}
+    canonical_document = canonical.canonicalize(document)
+    assert "*" in canonical_document["Statement"]
+    assert {"Effect": "Allow", "Action": 5, "Condition": {"Bool": "true"}} in canonical_document["Statement"]
+    assert canonical.canonicalize({"Statement": "*"}) == {"Statement": "*"}
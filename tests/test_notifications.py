@@ -0,0 +1,61 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+import json
+
+import pytest
+
+from policy_common import notifications
+
+
+class FakeSQS:
+    def __init__(self):
+        self.bodies = []
+
+    def send_message_batch(self, QueueUrl, Entries):
+        self.bodies += [json.loads(entry["MessageBody"]) for entry in Entries]
+        return {"Successful": Entries}
+
+
+def make_notifier():
+    client_sqs = FakeSQS()
+    notifier = notifications.Notifier("topic", "queue", client_sns=object(), client_sqs=client_sqs)
+    return notifier, client_sqs
+
+
+def notify(notifier, summary):
+    notifier.notify(
+        "custom_policy_checks", "role", "CRITICAL", summary, "subject", "message",
+        event_time="2026-10-17T10:00:00Z", actor="arn:aws:sts::111122223333:assumed-role/dev/alice",
+        reasons=["iam:PassRole: statement 0"],
+    )
+
+
+def test_findings_of_a_record_are_sent_when_it_succeeds():
+    notifier, client_sqs = make_notifier()
+    notifier.for_record(lambda message: notify(notifier, message))("first")
+    assert [body["summary"] for body in client_sqs.bodies] == ["first"]
+    assert client_sqs.bodies[0]["actor"] == "arn:aws:sts::111122223333:assumed-role/dev/alice"
+    assert client_sqs.bodies[0]["event_time"] == "2026-10-17T10:00:00Z"
+    assert client_sqs.bodies[0]["reasons"] == ["iam:PassRole: statement 0"]
+
+
+def test_findings_of_a_failing_record_are_dropped():
+    notifier, client_sqs = make_notifier()
+
+    def failing(message):
+        notify(notifier, message)
+        raise RuntimeError("checker failed")
+
+    with pytest.raises(RuntimeError):
+        notifier.for_record(failing)("lost")
+    notifier.flush()
+    notifier.for_record(lambda message: notify(notifier, message))("kept")
+    assert [body["summary"] for body in client_sqs.bodies] == ["kept"]
+
+
+def test_discard_drops_the_findings_queued_outside_of_a_record():
+    notifier, client_sqs = make_notifier()
+    notify(notifier, "sweep")
+    notifier.discard()
+    notifier.flush()
+    assert client_sqs.bodies == []
@@ -0,0 +1,53 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+import pytest
+
+from policy_common import policy_diff
+
+READ = {"Effect": "Allow", "Action": ["s3:GetObject", "s3:ListBucket"], "Resource": "arn:aws:s3:::bucket/*"}
+WRITE = {"Effect": "Allow", "Action": "s3:PutObject", "Resource": "arn:aws:s3:::bucket/*"}
+DENY = {"Effect": "Deny", "Action": "s3:DeleteObject", "Resource": "*"}
+
+
+def document(*statements):
+    return {"Version": "2012-10-17", "Statement": list(statements)}
+
+
+def test_added_statement_is_the_delta():
+    delta = policy_diff.delta(document(READ), document(READ, WRITE))
+    assert delta["Statement"] == [{"Effect": "Allow", "Action": ["s3:PutObject"], "Resource": ["arn:aws:s3:::bucket/*"]}]
+
+
+def test_broadened_statement_keeps_the_added_actions():
+    broadened = dict(READ, Action=["s3:GetObject", "s3:ListBucket", "s3:PutObject"])
+    delta = policy_diff.delta(document(READ), document(broadened))
+    assert [statement["Action"] for statement in delta["Statement"]] == [["s3:PutObject"]]
+
+
+def test_deny_statements_are_kept_in_the_delta():
+    delta = policy_diff.delta(document(READ, DENY), document(READ, WRITE, DENY))
+    assert {statement["Effect"] for statement in delta["Statement"]} == {"Allow", "Deny"}
+
+
+@pytest.mark.parametrize(
+    "previous, current",
+    [
+        # removed statement
+        (document(READ, WRITE), document(READ)),
+        # narrowed actions
+        (document(READ), document(dict(READ, Action="s3:GetObject"))),
+        # narrowed resource
+        (document(READ), document(dict(READ, Resource="arn:aws:s3:::bucket/prefix/*"))),
+        # added condition
+        (document(READ), document(dict(READ, Condition={"Bool": {"aws:SecureTransport": "true"}}))),
+        # removed or changed deny
+        (document(READ, DENY), document(READ)),
+        (document(READ), document(READ, DENY)),
+        # malformed documents
+        (document(READ), {"Statement": "*"}),
+        (document(READ), document(READ, dict(WRITE, Action=5))),
+        (None, document(READ)),
+    ],
+)
+def test_no_delta(previous, current):
+    assert policy_diff.delta(previous, current) is None